@@ -0,0 +1,561 @@
+"""Offline load benchmark of the search endpoints.
+
+Runs the FastAPI app in-process against a synthetic catalog, with
+deterministic local stand-ins for MongoDB, Gemini (keyword extraction and
+ranking), the HF embedding endpoint, DistilBERT and CLIP, so results only
+reflect this service's own code. Prints one JSON line per catalog size and
+endpoint with latency percentiles, throughput, per-stage percentiles (from
+the Server-Timing breakdown) and peak RSS. The startup line breaks time and
+RSS down by stage: model warm-up, catalog load (frame and filter index),
+document embedding sync and image index build.
+
+    python benchmark.py --sizes 1000,10000,100000 --requests 200 --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import functools
+import hashlib
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+ENDPOINTS = ("simple-search", "recommend", "reverse-search")
+
+BRANDS = ["Acme", "Zenith", "Nova", "Orbit", "Pioneer", "Summit", "Vertex", "Lumen", "Atlas", "Echo"]
+ADJECTIVES = ["wireless", "waterproof", "leather", "lightweight", "premium", "compact", "organic", "classic",
+              "portable", "ergonomic", "cotton", "stainless", "smart", "kids", "gaming"]
+REVIEW_POOL = ["Great product, works as described", "Terrible quality, broke in a week", "Value for money",
+               "Not worth the price", "Excellent build and fast delivery", "Average, does the job",
+               "Stopped working after a month", "Love it, would buy again", "Packaging was damaged",
+               "Exactly what I needed"]
+QUERY_TEMPLATES = ["{adjective} {subcategory} under {price}", "best {subcategory} for my {recipient}",
+                   "{brand} {subcategory}", "need a {adjective} {subcategory} urgently",
+                   "{subcategory} between {low} and {price}", "{subcategory} with {adjective} finish"]
+RECIPIENTS = ["mom", "dad", "friend", "kid", "wife", "husband"]
+
+
+# ------------------- Synthetic data -------------------
+def synthetic_catalog(n: int, categories: Dict[str, List[str]], seed: int = 0) -> List[dict]:
+    """`n` product documents with the schema the app reads."""
+    from bson import ObjectId
+
+    rng = random.Random(seed)
+    groups = [(category, name) for category, names in categories.items() for name in names]
+    now = datetime.datetime(2024, 1, 1)
+    products = []
+    for i in range(n):
+        category, subcategory = groups[i % len(groups)]
+        brand, adjective = rng.choice(BRANDS), rng.choice(ADJECTIVES)
+        features = rng.sample(ADJECTIVES, 3)
+        products.append({
+            "_id": ObjectId(),
+            "title": f"{brand} {adjective} {subcategory} {i}",
+            "description": f"A {adjective} {subcategory} by {brand}, {', '.join(features)}.",
+            "category": category,
+            "tags": [subcategory, adjective] + features[:2],
+            "price": rng.randint(99, 99999),
+            "sold": rng.randint(0, 20000),
+            "rating": round(rng.uniform(1, 5), 1),
+            "reviews": rng.sample(REVIEW_POOL, rng.randint(0, 5)),
+            "images": [f"https://images.example.com/{i}.jpg"],
+            "updated_at": now,
+        })
+    return products
+
+
+def synthetic_queries(n: int, subcategories: List[str], seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        price = rng.choice([500, 1000, 2000, 5000, 20000])
+        queries.append(rng.choice(QUERY_TEMPLATES).format(
+            adjective=rng.choice(ADJECTIVES), subcategory=rng.choice(subcategories), price=price,
+            low=price // 4, recipient=rng.choice(RECIPIENTS), brand=rng.choice(BRANDS)))
+    return queries
+
+
+def synthetic_images(n: int, seed: int = 2) -> List[bytes]:
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(n):
+        pixels = rng.integers(0, 255, size=(224, 224, 3), dtype=np.uint8)
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG")
+        images.append(buffer.getvalue())
+    return images
+
+
+# ------------------- Local stand-ins -------------------
+class FakeTextEmbeddings:
+    """Hashes tokens into a fixed-size bag-of-words vector, like a tiny sentence encoder."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            vector[int(hashlib.md5(token.encode()).hexdigest()[:8], 16) % self.dim] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class FakeClip:
+    """Projects a downsampled image through a fixed random matrix."""
+
+    def __init__(self, dim: int = 512, seed: int = 3):
+        self.dim = dim
+        self._projection = np.random.default_rng(seed).standard_normal((16 * 16 * 3, dim)).astype(np.float32)
+
+    def embed_images(self, images):
+        pixels = np.stack([np.asarray(image.resize((16, 16)), dtype=np.float32).reshape(-1) / 255.0
+                           for image in images])
+        return pixels @ self._projection
+
+    def embed_texts(self, texts):
+        return np.stack([np.frombuffer(hashlib.sha512(text.encode()).digest() * (self.dim // 64), dtype=np.uint8)
+                         [:self.dim].astype(np.float32) for text in texts])
+
+
+def fake_sentiment(texts, **kwargs):
+    return [{"label": "POSITIVE" if len(text) % 2 == 0 else "NEGATIVE", "score": 0.9} for text in texts]
+
+
+class FakeChain:
+    """Stands in for `prompt | llm | parser`, with a fixed per-call latency."""
+
+    def __init__(self, respond, latency: float):
+        self._respond = respond
+        self._latency = latency
+
+    async def ainvoke(self, inputs: dict):
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        return self._respond(inputs)
+
+    async def abatch(self, inputs: List[dict], config: Optional[dict] = None, return_exceptions: bool = False):
+        return await asyncio.gather(*[self.ainvoke(item) for item in inputs], return_exceptions=return_exceptions)
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == "$exists" and (field in doc) != operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte") and value is None:
+                    return False
+                if (op == "$gt" and not value > operand or op == "$gte" and not value >= operand
+                        or op == "$lt" and not value < operand or op == "$lte" and not value <= operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs: List[dict]):
+        self._docs = docs
+
+    def sort(self, field, direction=1):
+        self._docs = sorted(self._docs, key=lambda doc: doc.get(field), reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self._docs = self._docs[:n]
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    async def to_list(self, length=None):
+        return list(self._docs[:length])
+
+    def __aiter__(self):
+        self._iter = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _IdleChangeStream:
+    """A change stream on which nothing ever changes."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.Event().wait()
+
+
+class FakeCollection:
+    def __init__(self, docs: Optional[List[dict]] = None, key: str = "_id"):
+        self._key = key
+        self._docs = {doc[key]: doc for doc in docs or []}
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        docs = [doc for doc in self._docs.values() if not query or _matches(doc, query)]
+        if projection:
+            docs = [{k: v for k, v in doc.items() if k == "_id" or k in projection} for doc in docs]
+        else:
+            docs = [dict(doc) for doc in docs]
+        return FakeCursor(docs)
+
+    async def find_one(self, query: Optional[dict] = None):
+        for doc in self._docs.values():
+            if not query or _matches(doc, query):
+                return dict(doc)
+        return None
+
+    async def count_documents(self, query: dict) -> int:
+        return sum(1 for doc in self._docs.values() if not query or _matches(doc, query))
+
+    async def delete_many(self, query: dict) -> None:
+        for key in [key for key, doc in self._docs.items() if _matches(doc, query)]:
+            del self._docs[key]
+
+    async def bulk_write(self, requests, ordered: bool = True) -> None:
+        for request in requests:
+            if list(request._filter) == [self._key]:
+                key = request._filter[self._key]
+                found = [self._docs[key]] if key in self._docs else []
+            else:
+                found = [doc for doc in self._docs.values() if _matches(doc, request._filter)]
+            if found:
+                found[0].update(request._doc.get("$set", {}))
+            elif request._upsert:
+                doc = {**request._filter, **request._doc.get("$set", {})}
+                self._docs[doc.get(self._key, len(self._docs))] = doc
+
+    def watch(self, **kwargs):
+        return _IdleChangeStream()
+
+    def with_options(self, **kwargs):
+        return self
+
+
+class FakeDatabase:
+    def __init__(self, products: List[dict], embeddings: List[dict]):
+        self.products = FakeCollection(products)
+        self.embeddings = FakeCollection(embeddings, key="product_id")
+        self.review_sentiments = FakeCollection()
+
+    async def list_collection_names(self):
+        return ["products", "embeddings", "review_sentiments"]
+
+
+class _FakeClient:
+    def close(self):
+        pass
+
+
+# ------------------- Measurement -------------------
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PeakRss:
+    """Samples resident memory on a thread while a phase runs."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+class StageRss:
+    """Samples resident memory on a thread and attributes it to the stages running.
+
+    Stages may overlap (catalog listeners run in the background); each one
+    reports the peak seen while it ran and how much RSS grew over it.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stages: Dict[str, dict] = {}
+        self._active: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = current_rss_mb()
+            with self._lock:
+                for stage in self._active.values():
+                    stage["peak"] = max(stage["peak"], rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @contextmanager
+    def stage(self, name: str):
+        rss = current_rss_mb()
+        stage = {"start": rss, "peak": rss, "started": time.perf_counter()}
+        with self._lock:
+            self._active[name] = stage
+        try:
+            yield
+        finally:
+            rss = current_rss_mb()
+            with self._lock:
+                del self._active[name]
+            self.stages[name] = {"seconds": round(time.perf_counter() - stage["started"], 3),
+                                 "peak_rss_mb": round(max(stage["peak"], rss), 1),
+                                 "rss_delta_mb": round(rss - stage["start"], 1)}
+
+    def wrap(self, name: str, fn):
+        """`fn`, an async function, run as stage `name`."""
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+
+
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    stages = {}
+    for part in filter(None, (part.strip() for part in header.split(","))):
+        name, _, duration = part.partition(";dur=")
+        stages[name] = stages.get(name, 0.0) + float(duration) / 1000
+    return stages
+
+
+async def drive(client, endpoint: str, payloads: list, concurrency: int) -> dict:
+    """Send every payload to `endpoint` with `concurrency` requests in flight."""
+    latencies, stage_samples, errors = [], {}, 0
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            payload = queue.get_nowait()
+            started = time.perf_counter()
+            if endpoint == "reverse-search":
+                response = await client.post("/reverse-search/image", params={"top_k": 10},
+                                             files={"file": ("query.jpg", payload, "image/jpeg")},
+                                             headers={"X-Timing": "1"})
+            else:
+                response = await client.post(f"/{endpoint}", json={"query": payload}, headers={"X-Timing": "1"})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                errors += 1
+            for stage_name, seconds in parse_server_timing(response.headers.get("server-timing", "")).items():
+                stage_samples.setdefault(stage_name, []).append(seconds)
+
+    started = time.perf_counter()
+    with PeakRss() as rss:
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        **percentiles(latencies),
+        "stages": {name: percentiles(samples) for name, samples in sorted(stage_samples.items())},
+        "peak_rss_mb": round(rss.peak, 1),
+    }
+
+
+# ------------------- Runner -------------------
+async def run_size(args) -> List[dict]:
+    # Imported here so CACHE_DIR and friends are set before the app reads them
+    import httpx
+    import models
+    from embedding_storage import encode_vector
+    from ingest import url_hash
+    from database import db
+    import main as app_main
+    from keyword_cache import extract_keywords_locally, keyword_cache
+    from response_cache import response_cache
+
+    categories = {name: names for group in app_main.CategoriesSubcategories for name, names in group.items()}
+    products = synthetic_catalog(args.sizes[0], categories, seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+    created_at = datetime.datetime(2024, 1, 1)
+    embeddings = [
+        {"product_id": str(product["_id"]), "image_url": product["images"][0], "url_hash": url_hash(product["images"][0]),
+         **encode_vector(rng.standard_normal(args.image_dim).astype(np.float32)), "created_at": created_at}
+        for product in products
+    ]
+
+    db.client, db.db = _FakeClient(), FakeDatabase(products, embeddings)
+    models.llm.override(None)
+    models.text_embedder.override(FakeTextEmbeddings())
+    models.sentiment_classifier.override(fake_sentiment)
+    models.clip.override(FakeClip(args.image_dim))
+
+    def extract(inputs):
+        fields = extract_keywords_locally(inputs["query"], app_main.Subcategories)
+        if fields is None:
+            fields = {"product_type": inputs["query"].split()[-1], "price_max": None, "price_min": None,
+                      "use_case": None, "recipient": None, "must_have_features": [], "brand_preference": None,
+                      "avoid_features": [], "urgency": None}
+        return app_main.Keywords(**fields)
+
+    latency = args.llm_latency_ms / 1000
+    extraction_chain = FakeChain(extract, latency)
+    ranking = FakeChain(lambda inputs: app_main.RankingResult(best_product_index=0, reasoning="benchmark"), latency)
+
+    async def keyword_chain():
+        return extraction_chain
+
+    async def ranking_chain():
+        return ranking
+
+    app_main.keyword_chain, app_main.ranking_chain = keyword_chain, ranking_chain
+    if not args.keyword_cache:
+        keyword_cache.max_size = 0
+    if not args.response_cache:
+        response_cache.max_bytes, response_cache.redis_url = 0, ""
+
+    rows = []
+    started = time.perf_counter()
+    with StageRss() as rss, rss.stage("startup"):
+        # Warm-up runs first rather than alongside loading, so each stage's
+        # memory is its own; the rest is wired exactly as in production
+        with rss.stage("warm_up"):
+            await app_main.warm_up()
+        app_main.MODEL_WARMUP = False
+        app_main.catalog.start = rss.wrap("catalog_load", app_main.catalog.start)
+        app_main.sync_text_store = rss.wrap("text_index", app_main.sync_text_store)
+        app_main.preload_image_embeddings = rss.wrap("image_index", app_main.preload_image_embeddings)
+        await app_main.startup_event()
+        await app_main.warmup_task
+        await app_main.catalog.wait_for_listeners()
+    rows.append({"size": args.sizes[0], "endpoint": "startup", "seconds": round(time.perf_counter() - started, 2),
+                 "catalog": app_main.catalog.stats(), "image_index": len(app_main.image_index),
+                 "peak_rss_mb": rss.stages["startup"]["peak_rss_mb"],
+                 "stages": {name: stage for name, stage in rss.stages.items() if name != "startup"}})
+
+    queries = synthetic_queries(args.requests + args.warmup, app_main.Subcategories, seed=args.seed + 1)
+    images = synthetic_images(min(args.requests + args.warmup, 32), seed=args.seed + 2)
+    transport = httpx.ASGITransport(app=app_main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for endpoint in args.endpoints:
+            if endpoint == "reverse-search":
+                payloads = [images[i % len(images)] for i in range(args.requests + args.warmup)]
+            else:
+                payloads = queries
+            await drive(client, endpoint, payloads[:args.warmup], args.concurrency)
+            result = await drive(client, endpoint, payloads[args.warmup:], args.concurrency)
+            rows.append({"size": args.sizes[0], "endpoint": endpoint, "concurrency": args.concurrency, **result})
+
+    await app_main.shutdown_event()
+    return rows
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark of the search endpoints")
+    arg_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated catalog sizes")
+    arg_parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Subset of {','.join(ENDPOINTS)}")
+    arg_parser.add_argument("--requests", type=int, default=200, help="Measured requests per endpoint")
+    arg_parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per endpoint")
+    arg_parser.add_argument("--concurrency", type=int, default=8)
+    arg_parser.add_argument("--llm-latency-ms", type=float, default=0,
+                            help="Simulated latency of each keyword extraction / ranking call")
+    arg_parser.add_argument("--keyword-cache", action="store_true", help="Keep the keyword cache enabled")
+    arg_parser.add_argument("--response-cache", action="store_true", help="Keep the response cache enabled")
+    arg_parser.add_argument("--image-dim", type=int, default=512)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size]
+    args.endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint]
+
+    if len(args.sizes) > 1:
+        # A fresh process per size keeps RSS and module state independent
+        for size in args.sizes:
+            argv, skip = [], False
+            for arg in sys.argv[1:]:
+                if skip or arg.startswith("--sizes"):
+                    skip = arg == "--sizes"
+                    continue
+                argv.append(arg)
+            subprocess.run([sys.executable, os.path.abspath(__file__), *argv, "--sizes", str(size)], check=True)
+        return
+
+    os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="benchmark-cache-"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # One process, so there is no other worker to share the catalog with
+    os.environ.setdefault("SHARED_STATE_MODE", "off")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    for row in asyncio.run(run_size(args)):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
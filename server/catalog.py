@@ -0,0 +1,375 @@
+import os
+import ast
+import json
+import hashlib
+import time
+import logging
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from database import db
+from search_index import CatalogIndex
+
+logger = logging.getLogger(__name__)
+
+# How often to poll for changed products when change streams are unavailable
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "30"))
+# Full reload interval; the only way the polling fallback notices deletions
+CATALOG_FULL_RELOAD_SECONDS = float(os.getenv("CATALOG_FULL_RELOAD_SECONDS", "3600"))
+# Full reload interval when no product has `updated_at` to poll on, so
+# reloads are the only way to see any change. A reload that finds the same
+# catalog fingerprint keeps the current snapshot.
+CATALOG_UNTIMESTAMPED_RELOAD_SECONDS = float(os.getenv("CATALOG_UNTIMESTAMPED_RELOAD_SECONDS", "300"))
+# Coalesce bursts of change events into one new snapshot
+CATALOG_DEBOUNCE_SECONDS = float(os.getenv("CATALOG_DEBOUNCE_SECONDS", "1"))
+
+# Fields the service derives and writes back onto products itself. They are
+# not searched or embedded, so changing them only patches the snapshot's
+# columns instead of rebuilding it (see CatalogStore.annotate)
+ANNOTATION_FIELDS = ("sentiment_score", "sentiment_reviews_hash")
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """An immutable, versioned view of the products collection.
+
+    The DataFrame is shared by every request holding this snapshot, so
+    callers must treat it as read-only and copy before mutating.
+    """
+    version: int
+    df: pd.DataFrame
+    index: CatalogIndex
+    loaded_at: float
+    # Same for any process holding the same products; `version` is per process
+    fingerprint: str = ""
+
+    @property
+    def size(self) -> int:
+        return len(self.df)
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.loaded_at
+
+
+def normalize_images(images) -> List[str]:
+    """Image URLs as a list, whether stored as a list, a JSON string, one URL or nothing."""
+    if images is None or (isinstance(images, float) and images != images):
+        return []
+    if isinstance(images, str):
+        try:
+            parsed = json.loads(images)
+        except ValueError:
+            return [images]
+        return [str(image) for image in parsed] if isinstance(parsed, list) else [str(parsed)]
+    if isinstance(images, (list, tuple)):
+        return [str(image) for image in images]
+    return [str(images)]
+
+
+def normalize_reviews(reviews) -> List[str]:
+    """Reviews as a list of strings; a stringified Python list is parsed."""
+    if isinstance(reviews, str):
+        try:
+            reviews = ast.literal_eval(reviews)
+        except (ValueError, SyntaxError):
+            return []
+    if not isinstance(reviews, (list, tuple)):
+        return []
+    return [str(review) for review in reviews]
+
+
+def prepare_product(product: dict) -> dict:
+    """Normalize a raw Mongo document once, at ingest time.
+
+    `images` and `reviews` always end up as lists of strings, so request
+    handlers can emit them without re-checking each row.
+    """
+    product["_id"] = str(product["_id"])
+    product["images"] = normalize_images(product.get("images"))
+    product["reviews"] = normalize_reviews(product.get("reviews"))
+    return product
+
+
+def catalog_fingerprint(df: pd.DataFrame) -> str:
+    """Order-independent hash of every product's content."""
+    if df.empty:
+        return "empty"
+    row_hashes = pd.util.hash_pandas_object(df[sorted(df.columns)].astype(str), index=False).to_numpy()
+    digest = hashlib.sha1(f"{len(df)}:{int(row_hashes.sum(dtype='uint64'))}:{','.join(sorted(df.columns))}".encode())
+    return digest.hexdigest()[:16]
+
+
+class CatalogStore:
+    """Holds the process-wide catalog snapshot and keeps it current.
+
+    The store loads every product once, then follows a Mongo change stream.
+    Deployments without change streams (standalone mongod) fall back to
+    polling on `updated_at` plus a periodic full reload, or on frequent
+    full reloads alone when products have no `updated_at`.
+    """
+
+    def __init__(self):
+        self._docs: Dict[str, dict] = {}
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_updated_at = None
+        self.refresh_mode = "none"
+        # (callback, whether it also runs for annotation-only snapshots)
+        self._listeners: List[Tuple[Callable[[CatalogSnapshot], Awaitable], bool]] = []
+        self._listener_tasks = set()
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        return self._snapshot
+
+    async def get_snapshot(self) -> CatalogSnapshot:
+        if self._snapshot is None:
+            await self.reload()
+        return self._snapshot
+
+    async def reload(self) -> CatalogSnapshot:
+        """Replace the snapshot with a full scan of the collection."""
+        async with self._lock:
+            if db.db is None:
+                await db.connect()
+
+            docs = {}
+            last_updated_at = None
+            async for product in db.catalog_products():
+                product = prepare_product(product)
+                docs[product["_id"]] = product
+                updated_at = product.get("updated_at")
+                if updated_at is not None and (last_updated_at is None or updated_at > last_updated_at):
+                    last_updated_at = updated_at
+
+            self._docs = docs
+            self._last_updated_at = last_updated_at
+            df, index, fingerprint = await asyncio.to_thread(self._build, list(docs.values()))
+            if self._snapshot is not None and fingerprint == self._snapshot.fingerprint:
+                # Unchanged: listeners and caches keyed by the fingerprint stay as they are
+                return self._snapshot
+            return await self._publish(df, index, fingerprint)
+
+    @staticmethod
+    def _build(docs: List[dict]):
+        df = pd.DataFrame(docs)
+        return df, CatalogIndex(df), catalog_fingerprint(df)
+
+    async def adopt(self, df: pd.DataFrame, index: CatalogIndex, fingerprint: str) -> CatalogSnapshot:
+        """Serve a frame and index built by another worker instead of reading Mongo."""
+        async with self._lock:
+            # No documents behind an adopted snapshot; start() rescans if this worker takes over
+            self._docs = {}
+            self.refresh_mode = "shared"
+            return await self._publish(df, index, fingerprint)
+
+    def add_listener(self, callback: Callable[[CatalogSnapshot], Awaitable], on_annotations: bool = True) -> None:
+        """Run `callback(snapshot)` in the background whenever a snapshot is published.
+
+        With `on_annotations=False` the callback skips snapshots that only
+        changed ANNOTATION_FIELDS, e.g. listeners that re-embed or re-score
+        products from their text, images or reviews.
+        """
+        self._listeners.append((callback, on_annotations))
+
+    async def annotate(self, updates: Dict[str, dict]) -> Optional[CatalogSnapshot]:
+        """Apply `product _id -> {field: value}` updates of ANNOTATION_FIELDS in memory.
+
+        The new snapshot copies the frame with those columns patched and
+        keeps the current index, whose rows are unchanged. Used for values
+        this process has just written to Mongo, so they show up right away
+        in either refresh mode without a full rebuild.
+        """
+        async with self._lock:
+            for product_id, fields in updates.items():
+                if product_id in self._docs:
+                    self._docs[product_id].update(fields)
+            snapshot = self._snapshot
+            if snapshot is None or not updates:
+                return snapshot
+            df = await asyncio.to_thread(self._annotated_frame, snapshot.df, updates)
+            digest = hashlib.sha1(snapshot.fingerprint.encode())
+            for product_id in sorted(updates):
+                digest.update(f"{product_id}:{sorted(updates[product_id].items())}".encode())
+            return await self._publish(df, snapshot.index, digest.hexdigest()[:16], annotations_only=True)
+
+    @staticmethod
+    def _annotated_frame(df: pd.DataFrame, updates: Dict[str, dict]) -> pd.DataFrame:
+        rows = pd.Index(df['_id']).get_indexer(list(updates))
+        found = rows >= 0
+        rows = rows[found]
+        fields = [fields for fields, ok in zip(updates.values(), found) if ok]
+        df = df.copy()
+        for name in ANNOTATION_FIELDS:
+            column = df[name].to_numpy(dtype=object, copy=True) if name in df.columns else np.full(len(df), None, dtype=object)
+            for row, values in zip(rows, fields):
+                if name in values:
+                    column[row] = values[name]
+            df[name] = pd.Series(column, index=df.index).infer_objects()
+        return df
+
+    async def _publish(self, df: Optional[pd.DataFrame] = None, index: Optional[CatalogIndex] = None,
+                       fingerprint: str = "", annotations_only: bool = False) -> CatalogSnapshot:
+        if df is None:
+            # Frame and index are built off the event loop; requests keep using
+            # the previous snapshot until the new one is complete
+            df, index, fingerprint = await asyncio.to_thread(self._build, list(self._docs.values()))
+        self._version += 1
+        self._snapshot = CatalogSnapshot(version=self._version, df=df, index=index, loaded_at=time.time(),
+                                         fingerprint=fingerprint)
+        for callback, on_annotations in self._listeners:
+            if annotations_only and not on_annotations:
+                continue
+            task = asyncio.create_task(self._notify(callback, self._snapshot))
+            self._listener_tasks.add(task)
+            task.add_done_callback(self._listener_tasks.discard)
+        return self._snapshot
+
+    async def wait_for_listeners(self) -> None:
+        """Wait until listeners of every snapshot published so far have finished."""
+        while self._listener_tasks:
+            await asyncio.gather(*list(self._listener_tasks), return_exceptions=True)
+
+    async def _notify(self, callback, snapshot: CatalogSnapshot):
+        try:
+            await callback(snapshot)
+        except Exception as e:
+            logger.warning("Catalog listener failed for version %d: %s", snapshot.version, e)
+
+    def _apply_change(self, change: dict, annotations: Dict[str, dict]) -> bool:
+        """Apply one change event; True if the snapshot must be rebuilt.
+
+        Updates that only set ANNOTATION_FIELDS are collected into
+        `annotations` instead, and dropped when they carry the values this
+        process already holds (the echo of its own writes).
+        """
+        op = change.get("operationType")
+        key = str(change.get("documentKey", {}).get("_id"))
+        if op == "delete":
+            self._docs.pop(key, None)
+            return True
+        if op in ("insert", "update", "replace") and change.get("fullDocument") is not None:
+            description = change.get("updateDescription") or {}
+            updated = description.get("updatedFields") or {}
+            if (op == "update" and key in self._docs and updated and not description.get("removedFields")
+                    and set(updated) <= set(ANNOTATION_FIELDS)):
+                stale = {name: value for name, value in updated.items() if self._docs[key].get(name) != value}
+                if stale:
+                    annotations.setdefault(key, {}).update(stale)
+                return False
+            product = prepare_product(change["fullDocument"])
+            self._docs[product["_id"]] = product
+            return True
+        if op in ("drop", "rename", "dropDatabase", "invalidate"):
+            raise RuntimeError(f"Change stream ended with '{op}'")
+        return False
+
+    async def _follow_change_stream(self):
+        async with db.watch_catalog() as stream:
+            self.refresh_mode = "change_stream"
+            async for change in stream:
+                annotations: Dict[str, dict] = {}
+                async with self._lock:
+                    rebuild = self._apply_change(change, annotations)
+                    # Drain whatever else arrived in the debounce window
+                    deadline = time.monotonic() + CATALOG_DEBOUNCE_SECONDS
+                    while time.monotonic() < deadline:
+                        change = await stream.try_next()
+                        if change is None:
+                            await asyncio.sleep(0.05)
+                            continue
+                        rebuild = self._apply_change(change, annotations) or rebuild
+                    if rebuild:
+                        for product_id, fields in annotations.items():
+                            if product_id in self._docs:
+                                self._docs[product_id].update(fields)
+                        await self._publish()
+                if annotations and not rebuild:
+                    # Written by another process, e.g. the sentiment backfill CLI
+                    await self.annotate(annotations)
+
+    async def _poll_updates(self):
+        self.refresh_mode = "polling"
+        last_full_reload = time.monotonic()
+        while True:
+            await asyncio.sleep(CATALOG_POLL_SECONDS)
+            try:
+                if self._last_updated_at is None:
+                    reload_seconds = CATALOG_UNTIMESTAMPED_RELOAD_SECONDS
+                else:
+                    reload_seconds = CATALOG_FULL_RELOAD_SECONDS
+                if time.monotonic() - last_full_reload >= reload_seconds:
+                    await self.reload()
+                    last_full_reload = time.monotonic()
+                    continue
+                if self._last_updated_at is None:
+                    continue
+
+                async with self._lock:
+                    changed = 0
+                    async for product in db.catalog_products({"updated_at": {"$gt": self._last_updated_at}}):
+                        product = prepare_product(product)
+                        self._docs[product["_id"]] = product
+                        if product["updated_at"] > self._last_updated_at:
+                            self._last_updated_at = product["updated_at"]
+                        changed += 1
+                    if changed:
+                        await self._publish()
+            except Exception as e:
+                # Keep serving the last good snapshot and retry next tick
+                logger.warning("Catalog refresh failed: %s", e)
+
+    async def _run(self):
+        try:
+            await self._follow_change_stream()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Standalone servers reject watch(); anything else means the
+            # stream broke and we may have missed events, so rescan first
+            logger.info("Catalog change stream unavailable (%s), falling back to polling", e)
+            try:
+                await self.reload()
+            except Exception as reload_error:
+                logger.warning("Catalog reload failed: %s", reload_error)
+        await self._poll_updates()
+
+    async def start(self):
+        # An adopted snapshot has no documents to apply changes to
+        if self._snapshot is None or not self._docs:
+            await self.reload()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"loaded": False, "refresh_mode": self.refresh_mode}
+        return {
+            "loaded": True,
+            "version": snapshot.version,
+            "fingerprint": snapshot.fingerprint,
+            "size": snapshot.size,
+            "age_seconds": round(snapshot.age_seconds, 3),
+            "refresh_mode": self.refresh_mode,
+        }
+
+
+# Create a global instance
+catalog = CatalogStore()
@@ -1,23 +1,131 @@
 # database.py
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional
+from pymongo.read_preferences import ReadPreference
+from typing import Any, List, Optional, TypedDict
 from dotenv import load_dotenv
+import datetime
 import os
 
 load_dotenv()
 
 # Get MongoDB connection string from environment variable
 MONGO_URI = os.getenv("//mongodb uri")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "smartShopDB")
+
+# Connection pool, per process: requests beyond max_pool_size wait up to
+# MONGO_WAIT_QUEUE_TIMEOUT_MS for a connection (0 waits forever)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))  # 0: no timeout
+# primary, primaryPreferred, secondary, secondaryPreferred or nearest.
+# Writes always go to the primary; the catalog scans (full loads, the
+# polling fallback, listings) may use their own, e.g. secondaryPreferred
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+MONGO_CATALOG_READ_PREFERENCE = os.getenv("MONGO_CATALOG_READ_PREFERENCE", MONGO_READ_PREFERENCE)
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+# Projected shapes of a product, one per read path. The projection sent to
+# Mongo is derived from the annotations, so adding a field here is enough.
+class CatalogProduct(TypedDict, total=False):
+    """What the in-memory catalog needs: filtering, search, /recommend and sentiment refresh."""
+    _id: Any
+    title: str
+    description: str
+    category: str
+    tags: List[str]
+    price: float
+    sold: int
+    rating: float
+    images: Any
+    reviews: Any
+    sentiment_score: float
+    sentiment_reviews_hash: str
+    updated_at: datetime.datetime
+
+
+class ListingProduct(TypedDict, total=False):
+    """What /api/products returns when the caller does not pick `fields`."""
+    _id: Any
+    title: str
+    description: str
+    category: str
+    tags: List[str]
+    price: float
+    originalPrice: float
+    rating: float
+    reviewCount: int
+    reviews: Any
+    sold: int
+    images: Any
+
+
+class ImageSource(TypedDict, total=False):
+    """What image embedding ingestion and reverse search need."""
+    _id: Any
+    images: Any
+
+
+class SentimentSource(TypedDict, total=False):
+    """What the review sentiment backfill needs."""
+    _id: Any
+    reviews: Any
+    sentiment_reviews_hash: str
+
+
+def projection(shape: type) -> dict:
+    return {name: 1 for name in shape.__annotations__}
+
+
+CATALOG_PROJECTION = projection(CatalogProduct)
+LISTING_PROJECTION = projection(ListingProduct)
+IMAGE_SOURCE_PROJECTION = projection(ImageSource)
+SENTIMENT_SOURCE_PROJECTION = projection(SentimentSource)
+
 
 class Database:
-    def __init__(self):
+    def __init__(self, uri: Optional[str] = MONGO_URI, name: str = MONGO_DB_NAME,
+                 max_pool_size: int = MONGO_MAX_POOL_SIZE, min_pool_size: int = MONGO_MIN_POOL_SIZE,
+                 max_idle_time_ms: int = MONGO_MAX_IDLE_TIME_MS, wait_queue_timeout_ms: int = MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                 connect_timeout_ms: int = MONGO_CONNECT_TIMEOUT_MS,
+                 server_selection_timeout_ms: int = MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                 socket_timeout_ms: int = MONGO_SOCKET_TIMEOUT_MS, read_preference: str = MONGO_READ_PREFERENCE,
+                 catalog_read_preference: str = MONGO_CATALOG_READ_PREFERENCE):
+        self.uri = uri
+        self.name = name
+        self.options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "maxIdleTimeMS": max_idle_time_ms or None,
+            "waitQueueTimeoutMS": wait_queue_timeout_ms or None,
+            "connectTimeoutMS": connect_timeout_ms,
+            "serverSelectionTimeoutMS": server_selection_timeout_ms,
+            "socketTimeoutMS": socket_timeout_ms or None,
+            "readPreference": read_preference,
+        }
+        self.catalog_read_preference = _READ_PREFERENCES[catalog_read_preference]
         self.client = None
         self.db = None
 
     async def connect(self):
         if self.client is None:  # Fixed: Use explicit None comparison
-            self.client = AsyncIOMotorClient(MONGO_URI)
-            self.db = self.client.smartShopDB
+            self.client = AsyncIOMotorClient(self.uri, **self.options)
+            self.db = self.client[self.name]
+            # Bound once, so the hot paths skip the __getattr__ proxy
+            self.products = self.db.products
+            self.embeddings = self.db.embeddings
+            self.review_sentiments = self.db.review_sentiments
         return self.db
 
     async def close(self):
@@ -30,5 +138,32 @@ class Database:
             return getattr(self.db, name)
         raise AttributeError(f"Database not connected. Call connect() first.")
 
+    def _catalog_products(self):
+        return self.products.with_options(read_preference=self.catalog_read_preference)
+
+    # Projected reads; each returns a cursor of the matching TypedDict shape
+    def catalog_products(self, query: Optional[dict] = None):
+        """Cursor of CatalogProduct documents."""
+        return self._catalog_products().find(query or {}, CATALOG_PROJECTION)
+
+    def watch_catalog(self):
+        """Change stream of the products collection, with `fullDocument` cut down to CatalogProduct."""
+        fields = {f"fullDocument.{name}": 1 for name in CATALOG_PROJECTION}
+        # updateDescription lets CatalogStore skip updates of annotation fields only
+        pipeline = [{"$project": {"operationType": 1, "documentKey": 1, "updateDescription": 1, **fields}}]
+        return self.products.watch(pipeline=pipeline, full_document="updateLookup")
+
+    def listing(self, query: dict, fields: Optional[List[str]] = None):
+        """Cursor of ListingProduct documents, or of just `fields` (plus _id) when given."""
+        return self._catalog_products().find(query, {name: 1 for name in fields} if fields else LISTING_PROJECTION)
+
+    def image_sources(self, query: Optional[dict] = None):
+        """Cursor of ImageSource documents."""
+        return self._catalog_products().find(query or {}, IMAGE_SOURCE_PROJECTION)
+
+    def sentiment_sources(self, query: Optional[dict] = None):
+        """Cursor of SentimentSource documents."""
+        return self._catalog_products().find(query or {}, SENTIMENT_SOURCE_PROJECTION)
+
 # Create a global instance
 db = Database()
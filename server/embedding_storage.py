@@ -0,0 +1,171 @@
+import os
+import glob
+import json
+import uuid
+import datetime
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+from bson.binary import Binary
+
+from vector_index import CACHE_DIR
+
+# dtype embeddings are written to Mongo with: "float32", or "float16" for half the bytes
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+IMAGE_SHARD_PATH = os.getenv("IMAGE_SHARD_PATH", os.path.join(CACHE_DIR, "image_embeddings.npy"))
+
+
+def encode_vector(vector: np.ndarray, dtype: str = EMBEDDING_STORAGE_DTYPE) -> dict:
+    """Fields storing `vector` as raw little-endian bytes in a BSON Binary."""
+    vector = np.asarray(vector).reshape(-1).astype(np.dtype(dtype).newbyteorder("<"))
+    return {"embedding": Binary(vector.tobytes()), "dtype": dtype, "dim": int(vector.shape[0])}
+
+
+def decode_vector(doc: dict) -> np.ndarray:
+    """The `(1, dim)` float32 embedding of a stored document.
+
+    Also reads the older format of a nested list of Python floats.
+    """
+    value = doc["embedding"]
+    if isinstance(value, (bytes, Binary)):
+        vector = np.frombuffer(value, dtype=np.dtype(doc.get("dtype", "float32")).newbyteorder("<"))
+    else:
+        vector = np.asarray(value)
+    return vector.astype(np.float32).reshape(1, -1)
+
+
+class EmbeddingTable:
+    """Stored embeddings as one `(n, dim)` float32 matrix whose row `i` belongs
+    to `ids[i]` and was made from the image with URL hash `hashes[i]`.
+
+    A table loaded or saved with `load_shard`/`save_shard` holds a
+    read-only memory map of the shard, so its vectors live in the page
+    cache rather than in process memory. Tables are not edited in place;
+    `merge` and `without` return a new one.
+    """
+
+    def __init__(self, ids: Sequence[str] = (), hashes: Sequence[Optional[str]] = (),
+                 matrix: Optional[np.ndarray] = None):
+        self.ids = list(ids)
+        self.hashes = list(hashes)
+        self.matrix = matrix if matrix is not None else np.zeros((0, 0), dtype=np.float32)
+        self._rows = {product_id: i for i, product_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, product_id) -> bool:
+        return product_id in self._rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids)
+
+    @property
+    def mapped(self) -> bool:
+        return isinstance(self.matrix, np.memmap)
+
+    def url_hash(self, product_id: str) -> Optional[str]:
+        row = self._rows.get(product_id)
+        return None if row is None else self.hashes[row]
+
+    def vectors(self, product_ids: Sequence[str]) -> np.ndarray:
+        """Rows of `product_ids`; the matrix itself, uncopied, when that is every row in order."""
+        if list(product_ids) == self.ids:
+            return self.matrix
+        return self.matrix[[self._rows[product_id] for product_id in product_ids]]
+
+    def merge(self, fresh: Dict[str, Tuple[Optional[str], np.ndarray]]) -> "EmbeddingTable":
+        """A table with `product_id -> (url_hash, (1, dim) embedding)` rows added,
+        replacing any existing rows of the same products."""
+        if not fresh:
+            return self
+        keep = [i for i, product_id in enumerate(self.ids) if product_id not in fresh]
+        added = np.concatenate([np.asarray(vector, dtype=np.float32).reshape(1, -1) for _, vector in fresh.values()])
+        if keep:
+            kept = self.matrix if len(keep) == len(self.ids) else self.matrix[keep]
+            added = np.concatenate([kept, added])
+        return EmbeddingTable([self.ids[i] for i in keep] + list(fresh),
+                              [self.hashes[i] for i in keep] + [url_hash for url_hash, _ in fresh.values()], added)
+
+    def without(self, product_ids: Sequence[str]) -> "EmbeddingTable":
+        removed = set(product_ids) & set(self._rows)
+        if not removed:
+            return self
+        keep = [i for i, product_id in enumerate(self.ids) if product_id not in removed]
+        return EmbeddingTable([self.ids[i] for i in keep], [self.hashes[i] for i in keep], self.matrix[keep])
+
+
+def _matrix_path(path: str, generation: str) -> str:
+    return f"{os.path.splitext(path)[0]}.{generation}.npy"
+
+
+def save_shard(path: str, table: EmbeddingTable, loaded_through: Optional[datetime.datetime]) -> EmbeddingTable:
+    """Write a local copy of the stored embeddings: a `.npy` matrix plus an id sidecar.
+
+    Each save writes its matrix under a new generation name, then swaps
+    in the sidecar naming it with one `os.replace`. A crash at any point
+    leaves either the old pair or the new one, never ids of one save
+    against vectors of another. `loaded_through` is the Mongo
+    `created_at` watermark the shard is complete up to; rows written
+    later are fetched on the next load.
+
+    Returns `table` backed by a memory map of the file just written, so
+    the caller can drop its in-memory copy of the vectors.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    matrix = np.ascontiguousarray(table.matrix, dtype=np.float32)
+    matrix_path = _matrix_path(path, uuid.uuid4().hex[:12])
+    with open(matrix_path, "wb") as f:
+        np.save(f, matrix)
+        f.flush()
+        os.fsync(f.fileno())
+    sidecar = {
+        "matrix": os.path.basename(matrix_path),
+        "shape": list(matrix.shape),
+        "ids": table.ids,
+        "hashes": table.hashes,
+        "loaded_through": loaded_through.isoformat() if loaded_through else None,
+    }
+    with open(path + ".ids.json.tmp", "w") as f:
+        json.dump(sidecar, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".ids.json.tmp", path + ".ids.json")
+    try:
+        saved = EmbeddingTable(table.ids, table.hashes, np.load(matrix_path, mmap_mode="r"))
+    except OSError:  # already replaced by another process's save
+        saved = table
+    # Earlier generations, and the unversioned matrix of older releases.
+    # Readers that already mapped one keep their mapping; where the OS
+    # refuses to remove a mapped file (Windows) it is left for a later save.
+    for stale in glob.glob(_matrix_path(path, "*")) + [path]:
+        if stale != matrix_path and os.path.exists(stale):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return saved
+
+
+def load_shard(path: str) -> Optional[Tuple[EmbeddingTable, Optional[datetime.datetime]]]:
+    """Memory-map a shard written by `save_shard`.
+
+    Returns the table and the shard's watermark, or None if there is no
+    usable shard. The table's matrix is one read-only mapping, so nothing
+    is copied at load time.
+    """
+    if not os.path.exists(path + ".ids.json"):
+        return None
+    with open(path + ".ids.json") as f:
+        sidecar = json.load(f)
+    if "matrix" not in sidecar:  # written before generations; rebuilt from Mongo
+        return None
+    try:
+        matrix = np.load(os.path.join(os.path.dirname(path), sidecar["matrix"]), mmap_mode="r")
+    except OSError:  # replaced by a newer save since the sidecar was read
+        return None
+    if list(matrix.shape) != sidecar["shape"] or len(matrix) != len(sidecar["ids"]):
+        return None
+    loaded_through = sidecar.get("loaded_through")
+    return (EmbeddingTable(sidecar["ids"], sidecar["hashes"], matrix),
+            datetime.datetime.fromisoformat(loaded_through) if loaded_through else None)
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Model inference (CLIP, DistilBERT) is CPU-bound; torch releases the GIL,
+# so a small thread pool keeps cores busy without oversubscribing them
+MODEL_POOL_WORKERS = int(os.getenv("MODEL_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Blocking network calls with no async API (image downloads, sync SDKs)
+IO_POOL_WORKERS = int(os.getenv("IO_POOL_WORKERS", "16"))
+
+
+class BoundedPool:
+    """A named, fixed-size thread pool that tracks how much work is waiting.
+
+    `run()` awaits a blocking callable without holding up the event loop.
+    `stats()` reports queue depth (submitted but not started) and active
+    workers, which is what to look at when sizing `max_workers`.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._started = 0
+        self._finished = 0
+        self._cancelled = 0
+        self._max_queue_depth = 0
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self._started += 1
+        return fn(*args, **kwargs)
+
+    def _done(self, future) -> None:
+        # Futures cancelled while still queued never reach _call, so they
+        # leave the queue here rather than by starting
+        with self._lock:
+            if future.cancelled():
+                self._cancelled += 1
+            else:
+                self._finished += 1
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            self._submitted += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue_depth())
+        try:
+            future = self._executor.submit(functools.partial(self._call, fn, args, kwargs))
+        except RuntimeError:  # shut down
+            with self._lock:
+                self._submitted -= 1
+            raise
+        future.add_done_callback(self._done)
+        # Cancelling the awaiting task cancels the future too, if it has not started
+        return await asyncio.wrap_future(future)
+
+    def _queue_depth(self) -> int:
+        return self._submitted - self._started - self._cancelled
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queue_depth(),
+                "max_queue_depth": self._max_queue_depth,
+                "active": self._started - self._finished,
+                "completed": self._finished,
+                "cancelled": self._cancelled,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+model_pool = BoundedPool("model", MODEL_POOL_WORKERS)
+io_pool = BoundedPool("io", IO_POOL_WORKERS)
+
+
+def pool_stats() -> dict:
+    return {pool.name: pool.stats() for pool in (model_pool, io_pool)}
@@ -0,0 +1,134 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Largest upload /reverse-search/image accepts, in bytes
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(10 * 2 ** 20)))
+# Largest image, in pixels, we agree to decode; guards against decompression bombs
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv("IMAGE_UPLOAD_MAX_PIXELS", str(50_000_000)))
+# Uploads are decoded no larger than this on their long side; CLIP only
+# needs 224px, the margin keeps its own resize from losing detail
+IMAGE_DECODE_SIZE = int(os.getenv("IMAGE_DECODE_SIZE", "448"))
+IMAGE_QUERY_CACHE_SIZE = int(os.getenv("IMAGE_QUERY_CACHE_SIZE", "2048"))
+# Uploads whose 64-bit perceptual hashes differ in at most this many bits
+# share an embedding (re-encodes, resizes); -1 reuses only identical bytes
+IMAGE_QUERY_HASH_DISTANCE = int(os.getenv("IMAGE_QUERY_HASH_DISTANCE", "4"))
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def decode_upload(data: bytes, max_side: int = IMAGE_DECODE_SIZE) -> Image.Image:
+    """An RGB image of at most `max_side` pixels on its long side.
+
+    JPEGs are decoded straight at a reduced scale (1/2 to 1/8) through
+    draft mode, so a 12MP photo never exists at full size in memory; other
+    formats are shrunk before the RGB conversion rather than after.
+    """
+    image = Image.open(BytesIO(data))
+    if image.width * image.height > IMAGE_UPLOAD_MAX_PIXELS:
+        raise ImageTooLarge(f"Image is {image.width}x{image.height}, above {IMAGE_UPLOAD_MAX_PIXELS} pixels")
+    image.draft("RGB", (max_side, max_side))
+    image.thumbnail((max_side, max_side))
+    return image.convert("RGB")
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """64-bit difference hash: survives re-encoding, resizing and small edits."""
+    pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).reshape(-1)
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_query_image(data: bytes) -> Tuple[Image.Image, int]:
+    """Decoded upload and its perceptual hash, in one model_pool call."""
+    image = decode_upload(data)
+    return image, perceptual_hash(image)
+
+
+class ImageQueryCache:
+    """LRU cache of query-image CLIP embeddings.
+
+    Keyed by the SHA-256 of the uploaded bytes; on a miss, an entry whose
+    perceptual hash is within `max_distance` bits can still be reused, so
+    the same photo sent at another size or quality skips CLIP too.
+    """
+
+    def __init__(self, max_size: int = IMAGE_QUERY_CACHE_SIZE, max_distance: int = IMAGE_QUERY_HASH_DISTANCE):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        # content hash -> (perceptual hash, embedding)
+        self._entries: "OrderedDict[str, Tuple[int, np.ndarray]]" = OrderedDict()
+        self._hashes: Optional[Tuple[list, np.ndarray]] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_near(self, phash: int) -> Optional[np.ndarray]:
+        """Embedding of the closest cached upload within `max_distance` bits, if any."""
+        with self._lock:
+            if self.max_distance < 0 or not self._entries:
+                self.misses += 1
+                return None
+            if self._hashes is None:
+                keys = list(self._entries)
+                self._hashes = (keys, np.array([self._entries[key][0] for key in keys], dtype=np.uint64))
+            keys, hashes = self._hashes
+            differing = np.bitwise_xor(hashes, np.uint64(phash))
+            distances = np.unpackbits(differing.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] > self.max_distance:
+                self.misses += 1
+                return None
+            self.near_hits += 1
+            return self._entries[keys[nearest]][1]
+
+    def put(self, key: str, phash: int, embedding: np.ndarray) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (phash, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._hashes = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Create a global instance
+image_query_cache = ImageQueryCache()
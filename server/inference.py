@@ -0,0 +1,183 @@
+import os
+import time
+import queue
+import asyncio
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import inference_batch_size, inference_queue_wait
+from models import clip, sentiment_classifier
+
+# How long the first queued input waits for others to share its forward pass;
+# 0 still coalesces whatever queued up while the previous batch ran
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+CLIP_MAX_BATCH_SIZE = int(os.getenv("CLIP_MAX_BATCH_SIZE", "32"))
+SENTIMENT_MAX_BATCH_SIZE = int(os.getenv("SENTIMENT_MAX_BATCH_SIZE", "64"))
+
+# Queued inputs are batched lowest priority value first: requests being
+# served go ahead of background work such as an ingest-time backfill
+PRIORITY_ONLINE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class _Pending:
+    __slots__ = ("item", "future", "enqueued_at")
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """Coalesces inputs from concurrent callers into batched model calls.
+
+    Callers submit individual inputs (one image, one review); a dispatcher
+    thread takes the oldest one, waits up to `max_wait_ms` for more, and
+    runs `batch_fn(model, inputs)` on up to `max_batch_size` of them in one
+    forward pass, with `model` from `load()`. `batch_fn` must return one
+    output per input, in order. Inputs submitted at `PRIORITY_BACKGROUND`
+    only fill batches once no online input is waiting, so a backfill
+    delays a request by one batch at most.
+
+    If `batch_fn` raises, the batch is split and retried, so only the
+    inputs that fail get the exception. Failures that are not down to the
+    inputs (the model failing to load, running out of memory) fail the
+    whole batch at once instead.
+
+    Batches run on the dispatcher's own thread rather than model_pool, so
+    model_pool threads blocked in `run()` can never starve it. One batch
+    runs at a time per model, which on CPU is what the model's own
+    intra-op threads want anyway.
+    """
+
+    def __init__(self, name: str, load: Callable[[], Any], batch_fn: Callable[[Any, List[Any]], Sequence[Any]],
+                 max_batch_size: int, max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+        self.name = name
+        self.load = load
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        # (priority, submission order, pending input)
+        self._queue: "queue.PriorityQueue[Tuple[int, int, _Pending]]" = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, items: Sequence[Any], priority: int = PRIORITY_ONLINE) -> List[Future]:
+        self._ensure_started()
+        pending = [_Pending(item) for item in items]
+        for entry in pending:
+            self._queue.put((priority, next(self._order), entry))
+        return [entry.future for entry in pending]
+
+    def run(self, items: Sequence[Any], priority: int = PRIORITY_ONLINE) -> List[Any]:
+        """Blocking: outputs for `items`, batched with whatever else is queued."""
+        return [future.result() for future in self.submit(items, priority)]
+
+    async def arun(self, items: Sequence[Any], priority: int = PRIORITY_ONLINE) -> List[Any]:
+        return list(await asyncio.gather(*(asyncio.wrap_future(future) for future in self.submit(items, priority))))
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()[2]]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append((self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())[2])
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch: List[_Pending]) -> None:
+        try:
+            model = self.load()
+        except Exception as e:
+            _fail(batch, e)
+            return
+        self._run_on(model, batch)
+
+    def _run_on(self, model: Any, batch: List[_Pending]) -> None:
+        try:
+            outputs = self.batch_fn(model, [entry.item for entry in batch])
+            if len(outputs) != len(batch):
+                raise RuntimeError(f"{self.name} returned {len(outputs)} outputs for {len(batch)} inputs")
+        except Exception as e:
+            if len(batch) == 1 or _out_of_memory(e):
+                _fail(batch, e)
+                return
+            # Halve until the failing inputs are isolated; the rest still get outputs
+            middle = len(batch) // 2
+            self._run_on(model, batch[:middle])
+            self._run_on(model, batch[middle:])
+        else:
+            for entry, output in zip(batch, outputs):
+                entry.future.set_result(output)
+
+    def _dispatch(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            for entry in batch:
+                inference_queue_wait.observe(started - entry.enqueued_at, model=self.name)
+            inference_batch_size.observe(len(batch), model=self.name)
+            self._run_batch(batch)
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+def _fail(batch: List[_Pending], error: Exception) -> None:
+    for entry in batch:
+        entry.future.set_exception(error)
+
+
+def _out_of_memory(error: Exception) -> bool:
+    # torch reports allocation failures as RuntimeError (CUDA's OutOfMemoryError subclasses it)
+    message = str(error).lower()
+    return isinstance(error, MemoryError) or "out of memory" in message or "can't allocate memory" in message
+
+
+def _classify_batch(classifier, texts: List[str]):
+    return classifier(texts, batch_size=len(texts), truncation=True)
+
+
+clip_image_batcher = MicroBatcher("clip_image", clip.get, lambda encoder, images: encoder.embed_images(images),
+                                  CLIP_MAX_BATCH_SIZE)
+clip_text_batcher = MicroBatcher("clip_text", clip.get, lambda encoder, texts: encoder.embed_texts(texts),
+                                 CLIP_MAX_BATCH_SIZE)
+sentiment_batcher = MicroBatcher("sentiment", sentiment_classifier.get, _classify_batch, SENTIMENT_MAX_BATCH_SIZE)
+
+BATCHERS = (clip_image_batcher, clip_text_batcher, sentiment_batcher)
+
+
+def stack(outputs: List[np.ndarray]) -> np.ndarray:
+    """Rows returned for single inputs, back as one `(n, dim)` matrix."""
+    return np.stack(outputs) if outputs else np.zeros((0, 0), dtype=np.float32)
+
+
+def batcher_stats() -> dict:
+    return {batcher.name: batcher.stats() for batcher in BATCHERS}
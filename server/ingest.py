@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import logging
+import asyncio
+import argparse
+import hashlib
+import datetime
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+from PIL import Image
+from pymongo import UpdateOne
+
+from database import db
+from embedding_storage import IMAGE_SHARD_PATH, EmbeddingTable, decode_vector, encode_vector, load_shard
+from executor import model_pool
+from vector_index import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "32"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))
+# How long a partial batch waits for more images before running anyway
+INGEST_BATCH_WAIT_SECONDS = float(os.getenv("INGEST_BATCH_WAIT_SECONDS", "0.5"))
+INGEST_FETCH_TIMEOUT = float(os.getenv("INGEST_FETCH_TIMEOUT", "10"))
+INGEST_CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", os.path.join(CACHE_DIR, "ingest_checkpoint.json"))
+# Runs a transiently failing image (timeouts, 5xx, model errors) is tried in
+# before it is given up on; 404s and undecodable images are given up at once
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+# HTTP statuses that mean the image is gone rather than temporarily unavailable
+PERMANENT_FETCH_STATUSES = {404, 410}
+
+_DONE = object()
+
+
+class IngestCheckpoint:
+    """Which `product_id:url_hash` keys a run has embedded or given up on.
+
+    Written after every bulk write, so an interrupted run picks up where
+    it stopped instead of refetching the whole catalog. Transient failures
+    are retried by later runs, up to `max_attempts` in all; keys given up
+    on are retried only once the product's image URL changes.
+    """
+
+    def __init__(self, path: str = INGEST_CHECKPOINT_PATH, max_attempts: int = INGEST_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.done = set()
+        self.failed: Dict[str, int] = {}  # key -> failed attempts so far
+        self.given_up = set()
+        self.complete = False
+
+    def record_failure(self, key: str, permanent: bool = False) -> None:
+        attempts = self.failed.pop(key, 0) + 1
+        if permanent or attempts >= self.max_attempts:
+            self.given_up.add(key)
+        else:
+            self.failed[key] = attempts
+
+    def record_success(self, key: str) -> None:
+        self.failed.pop(key, None)
+        self.done.add(key)
+
+    def skips(self, key: str) -> bool:
+        return key in self.done or key in self.given_up
+
+    @classmethod
+    def load(cls, path: str = INGEST_CHECKPOINT_PATH) -> Optional["IngestCheckpoint"]:
+        if not os.path.exists(path):
+            return None
+        checkpoint = cls(path)
+        with open(path) as f:
+            data = json.load(f)
+        checkpoint.done = set(data.get("done", []))
+        failed = data.get("failed", {})
+        # Older checkpoints kept a flat list of failures; count them as one attempt
+        checkpoint.failed = dict.fromkeys(failed, 1) if isinstance(failed, list) else dict(failed)
+        checkpoint.given_up = set(data.get("given_up", []))
+        checkpoint.complete = data.get("complete", False)
+        return checkpoint
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(self.done), "failed": self.failed, "given_up": sorted(self.given_up),
+                       "complete": self.complete}, f)
+        os.replace(tmp_path, self.path)
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def image_key(product_id: str, url: str) -> str:
+    return f"{product_id}:{url_hash(url)}"
+
+
+def first_image_urls(images_column) -> List[Optional[str]]:
+    image_urls = []
+    for imgs in images_column:
+        if isinstance(imgs, list) and imgs:
+            image_urls.append(imgs[0])
+        elif isinstance(imgs, str):
+            image_urls.append(imgs)
+        else:
+            image_urls.append(None)
+    return image_urls
+
+
+def _embed_batch(embed_images: Callable, payloads: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+    """Decode a batch of downloads and run them through CLIP in one forward pass."""
+    images = []
+    for data in payloads:
+        try:
+            images.append(Image.open(BytesIO(data)).convert("RGB"))
+        except Exception:
+            images.append(None)
+    decoded = [img for img in images if img is not None]
+    vectors = iter(embed_images(decoded)) if decoded else iter(())
+    return [next(vectors) if img is not None else None for img in images]
+
+
+async def _fetch_worker(client: httpx.AsyncClient, jobs: asyncio.Queue, fetched: asyncio.Queue, failed: list):
+    while True:
+        job = await jobs.get()
+        if job is _DONE:
+            return
+        product_id, url = job
+        try:
+            resp = await client.get(url)
+            resp.raise_for_status()
+            await fetched.put((product_id, url, resp.content))
+        except Exception as e:
+            logger.warning("Failed to fetch image for product %s: %s", product_id, e)
+            permanent = isinstance(e, httpx.HTTPStatusError) and e.response.status_code in PERMANENT_FETCH_STATUSES
+            failed.append((image_key(product_id, url), permanent))
+
+
+async def _embed_stage(fetched: asyncio.Queue, to_store: asyncio.Queue, embed_images: Callable,
+                       batch_size: int, failed: list):
+    finished = False
+    while not finished:
+        batch = []
+        item = await fetched.get()
+        if item is _DONE:
+            break
+        batch.append(item)
+        deadline = time.monotonic() + INGEST_BATCH_WAIT_SECONDS
+        while len(batch) < batch_size:
+            try:
+                item = await asyncio.wait_for(fetched.get(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            if item is _DONE:
+                finished = True
+                break
+            batch.append(item)
+
+        # None from _embed_batch means the bytes did not decode, which retrying
+        # will not fix; a failed forward pass may well succeed next run
+        permanent = True
+        try:
+            vectors = await model_pool.run(_embed_batch, embed_images, [payload for _, _, payload in batch])
+        except Exception as e:
+            logger.error("Failed to embed a batch of %d images: %s", len(batch), e)
+            vectors, permanent = [None] * len(batch), False
+        for (product_id, url, _), vector in zip(batch, vectors):
+            if vector is None:
+                failed.append((image_key(product_id, url), permanent))
+            else:
+                await to_store.put((product_id, url, vector))
+    await to_store.put(_DONE)
+
+
+async def _store_stage(to_store: asyncio.Queue, checkpoint: IngestCheckpoint, failed: list,
+                       results: Dict[str, Tuple[str, np.ndarray]], batch_size: int):
+    finished = False
+    while not finished:
+        batch = [await to_store.get()]
+        if batch[0] is _DONE:
+            break
+        while len(batch) < batch_size and not to_store.empty():
+            item = to_store.get_nowait()
+            if item is _DONE:
+                finished = True
+                break
+            batch.append(item)
+
+        now = datetime.datetime.utcnow()
+        await db.embeddings.bulk_write([
+            UpdateOne(
+                {"product_id": product_id},
+                {"$set": {"product_id": product_id, "image_url": url, "url_hash": url_hash(url),
+                          **encode_vector(vector), "created_at": now}},
+                upsert=True,
+            )
+            for product_id, url, vector in batch
+        ], ordered=False)
+        for product_id, url, vector in batch:
+            results[product_id] = (url_hash(url), vector.reshape(1, -1))
+            checkpoint.record_success(image_key(product_id, url))
+        for key, permanent in failed:
+            checkpoint.record_failure(key, permanent)
+        failed.clear()
+        checkpoint.save()
+        logger.info("Stored %d image embeddings", len(checkpoint.done))
+
+
+def stale_image_targets(df, stored: EmbeddingTable) -> List[Tuple[str, str]]:
+    """`(product_id, image_url)` for products whose first image has no stored
+    embedding yet, or whose stored embedding was made from a different URL."""
+    targets = []
+    for product_id, url in zip(df['_id'], first_image_urls(df['images'])):
+        if url and stored.url_hash(product_id) != url_hash(url):
+            targets.append((product_id, url))
+    return targets
+
+
+async def ingest_image_embeddings(targets: Sequence[Tuple[str, str]], embed_images: Callable,
+                                  concurrency: int = INGEST_CONCURRENCY, batch_size: int = INGEST_BATCH_SIZE,
+                                  restart: bool = False) -> Dict[str, Tuple[str, np.ndarray]]:
+    """Embed each `(product_id, image_url)` target and upsert it into `embeddings`.
+
+    Downloads run concurrently over a bounded connection pool, CLIP runs
+    on batches of `batch_size` images and results are written with
+    `bulk_write`. Progress is checkpointed, so rerunning after an
+    interruption only processes what is left unless `restart` is set.
+    Returns `product_id -> (url_hash, (1, dim) embedding)` for this run.
+    """
+    checkpoint = None if restart else IngestCheckpoint.load()
+    if checkpoint is None:
+        checkpoint = IngestCheckpoint()
+    elif checkpoint.complete:
+        checkpoint.done = set()
+        checkpoint.complete = False
+
+    pending = [(product_id, url) for product_id, url in targets if not checkpoint.skips(image_key(product_id, url))]
+    logger.info("Ingesting %d images (%d done or given up on before)", len(pending), len(targets) - len(pending))
+
+    results: Dict[str, Tuple[str, np.ndarray]] = {}
+    if pending:
+        jobs, fetched, to_store = asyncio.Queue(), asyncio.Queue(maxsize=4 * batch_size), asyncio.Queue()
+        for job in pending:
+            jobs.put_nowait(job)
+        for _ in range(concurrency):
+            jobs.put_nowait(_DONE)
+
+        failed: List[Tuple[str, bool]] = []  # (key, permanent)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=INGEST_FETCH_TIMEOUT, follow_redirects=True) as client:
+            embedder = asyncio.create_task(_embed_stage(fetched, to_store, embed_images, batch_size, failed))
+            storer = asyncio.create_task(_store_stage(to_store, checkpoint, failed, results, batch_size))
+            await asyncio.gather(*[_fetch_worker(client, jobs, fetched, failed) for _ in range(concurrency)])
+            await fetched.put(_DONE)
+            await asyncio.gather(embedder, storer)
+        for key, permanent in failed:
+            checkpoint.record_failure(key, permanent)
+
+    checkpoint.complete = True
+    checkpoint.save()
+    logger.info("Ingested %d/%d image embeddings; %d to retry next run, %d given up on",
+                len(results), len(pending), len(checkpoint.failed), len(checkpoint.given_up))
+    return results
+
+
+async def load_stored_embeddings(shard_path: Optional[str] = IMAGE_SHARD_PATH):
+    """Every stored image embedding, as an `EmbeddingTable`.
+
+    Starts from the local shard when there is one and only fetches rows
+    written since its watermark; rows the shard already has with the same
+    URL hash are skipped, so the table stays backed by the shard's mapping. Also returns the watermark to save the
+    next shard with. Rows from the old positional `product_index` schema
+    cannot be matched to a product reliably, so they are deleted and
+    re-embedded.
+    """
+    await db.embeddings.delete_many({"product_id": {"$exists": False}})
+    started = datetime.datetime.utcnow()
+
+    shard = load_shard(shard_path) if shard_path else None
+    stored, query = EmbeddingTable(), {}
+    if shard is not None and shard[1] is not None:
+        stored, query = shard[0], {"created_at": {"$gte": shard[1]}}
+
+    fresh = {}
+    projection = {"product_id": 1, "url_hash": 1, "embedding": 1, "dtype": 1}
+    async for doc in db.embeddings.find(query, projection):
+        if doc["product_id"] not in stored or stored.url_hash(doc["product_id"]) != doc.get("url_hash"):
+            fresh[doc["product_id"]] = (doc.get("url_hash"), decode_vector(doc))
+    stored = stored.merge(fresh)
+
+    if query and await db.embeddings.count_documents({}) != len(stored):
+        # Rows were deleted since the shard was written; rebuild from Mongo
+        return await load_stored_embeddings(shard_path=None)
+    return stored, started
+
+
+async def delete_stored_embeddings(product_ids: Sequence[str]) -> None:
+    if product_ids:
+        await db.embeddings.delete_many({"product_id": {"$in": list(product_ids)}})
+
+
+def load_clip_embedder() -> Callable:
+    """Standalone CLIP image tower for running ingestion outside the API server."""
+    from models import load_clip_encoder
+    return load_clip_encoder().embed_images
+
+
+async def _main(args):
+    import pandas as pd
+    from catalog import prepare_product
+
+    await db.connect()
+    # Only _id and images; the full catalog is not needed to find stale images
+    df = pd.DataFrame([prepare_product(product) async for product in db.image_sources()])
+    df = df[df['images'].notna()] if not df.empty else pd.DataFrame(columns=['_id', 'images'])
+    stored = EmbeddingTable() if args.restart else (await load_stored_embeddings())[0]
+    await delete_stored_embeddings(sorted(set(stored) - set(df['_id'])))
+    await ingest_image_embeddings(stale_image_targets(df, stored), load_clip_embedder(),
+                                  concurrency=args.concurrency, batch_size=args.batch_size, restart=args.restart)
+    await db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    arg_parser = argparse.ArgumentParser(description="Embed product images with CLIP and store them in MongoDB")
+    arg_parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY, help="Concurrent image downloads")
+    arg_parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="Images per CLIP forward pass")
+    arg_parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and embed everything again")
+    asyncio.run(_main(arg_parser.parse_args()))
@@ -0,0 +1,192 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from vector_index import normalize_rows
+
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "10000"))
+KEYWORD_CACHE_TTL_SECONDS = float(os.getenv("KEYWORD_CACHE_TTL_SECONDS", "86400"))
+# Cosine similarity above which a cached query's keywords are reused; 0 disables
+KEYWORD_CACHE_SIMILARITY = float(os.getenv("KEYWORD_CACHE_SIMILARITY", "0"))
+# "llm": cache, then the LLM. "local_first": cache, then the rule-based
+# extractor, and the LLM only when that cannot find a product type.
+KEYWORD_EXTRACTION_MODE = os.getenv("KEYWORD_EXTRACTION_MODE", "llm")
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", query.lower())).strip()
+
+
+class KeywordCache:
+    """LRU + TTL cache of extracted keywords, keyed by normalized query text.
+
+    With a similarity threshold set, a miss on the exact key can still hit
+    an entry whose query embedding is close enough.
+    """
+
+    def __init__(self, max_size: int = KEYWORD_CACHE_SIZE, ttl_seconds: float = KEYWORD_CACHE_TTL_SECONDS,
+                 similarity_threshold: float = KEYWORD_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # key -> (expires_at, value, normalized query embedding or None)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Query embeddings for near lookups, one row per slot. Slots freed by
+        # eviction are zeroed and reused, so inserts never re-stack the cache.
+        self._matrix: Optional[np.ndarray] = None
+        self._slot_keys: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._free_slots: List[int] = []
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._drop_vector(key)
+
+    def _store_vector(self, key: str, vector: np.ndarray) -> None:
+        if self._matrix is None:
+            self._matrix = np.zeros((64, len(vector)), dtype=np.float32)
+        elif self._matrix.shape[1] != len(vector):
+            self._drop_vector(key)
+            return
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            else:
+                slot = len(self._slot_keys)
+                self._slot_keys.append(None)
+            self._slots[key], self._slot_keys[slot] = slot, key
+        if slot >= len(self._matrix):
+            grown = np.zeros((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+            grown[:len(self._matrix)] = self._matrix
+            self._matrix = grown
+        self._matrix[slot] = vector
+
+    def _drop_vector(self, key: str) -> None:
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._slot_keys[slot] = None
+            self._matrix[slot] = 0
+            self._free_slots.append(slot)
+
+    def _nearest(self, query_embedding) -> Optional[str]:
+        if not self._slots or self._matrix.shape[1] != len(query_embedding):
+            return None
+        scores = self._matrix[:len(self._slot_keys)] @ query_embedding
+        best = int(np.argmax(scores))
+        # A free slot's zero row can only win when nothing clears the threshold
+        key = self._slot_keys[best]
+        return key if key is not None and scores[best] >= self.similarity_threshold else None
+
+    def get(self, query: str, query_embedding=None) -> Optional[Any]:
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+        near = False
+        if entry is None and self.similarity_threshold > 0 and query_embedding is not None:
+            near_key = self._nearest(normalize_rows(np.asarray([query_embedding]))[0])
+            if near_key is not None:
+                key, entry, near = near_key, self._entries[near_key], True
+
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < time.monotonic():
+            self._expire(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if near:
+            self.near_hits += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def put(self, query: str, value: Any, query_embedding=None) -> None:
+        if self.max_size <= 0:
+            return
+        vector = None
+        if query_embedding is not None and self.similarity_threshold > 0:
+            vector = normalize_rows(np.asarray([query_embedding]))[0]
+        key = normalize_query(query)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value, vector)
+        self._entries.move_to_end(key)
+        if vector is None:
+            self._drop_vector(key)
+        else:
+            self._store_vector(key, vector)
+        while len(self._entries) > self.max_size:
+            self._drop_vector(self._entries.popitem(last=False)[0])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# These run on normalize_query() output, so there is no punctuation left
+_PRICE_MAX = re.compile(r"\b(?:under|below|less than|upto|up to|within|max|maximum)\s*(?:rs|inr)?\s*(\d+)")
+_PRICE_MIN = re.compile(r"\b(?:over|above|more than|from|min|minimum)\s*(?:rs|inr)?\s*(\d+)")
+_PRICE_RANGE = re.compile(r"\bbetween\s*(?:rs|inr)?\s*(\d+)\s*(?:and|to)\s*(?:rs|inr)?\s*(\d+)")
+_URGENT = re.compile(r"\b(urgent|urgently|asap|today|tomorrow|quickly)\b")
+
+
+def extract_keywords_locally(query: str, subcategories: Iterable[str]) -> Optional[dict]:
+    """Rule-based extraction for queries that name a known subcategory.
+
+    Returns the Keywords fields, or None if no subcategory is mentioned
+    and the query needs the LLM.
+    """
+    text = normalize_query(query)
+    padded = f" {text} "
+    # Longest name first so "power bank" wins over "bank"
+    product_type = None
+    for name in sorted(set(subcategories), key=len, reverse=True):
+        normalized = normalize_query(name)
+        if f" {normalized} " in padded or f" {normalized}s " in padded:
+            product_type = name
+            break
+    if product_type is None:
+        return None
+
+    price_min = price_max = None
+    price_range = _PRICE_RANGE.search(text)
+    if price_range:
+        price_min, price_max = price_range.groups()
+    else:
+        price_max = (_PRICE_MAX.search(text) or [None, None])[1]
+        price_min = (_PRICE_MIN.search(text) or [None, None])[1]
+
+    return {
+        "product_type": product_type,
+        "price_max": price_max,
+        "price_min": price_min,
+        "use_case": None,
+        "recipient": None,
+        "must_have_features": [],
+        "brand_preference": None,
+        "avoid_features": [],
+        "urgency": "urgent" if _URGENT.search(text) else None,
+    }
+
+
+# Create a global instance
+keyword_cache = KeywordCache()
@@ -1,59 +1,98 @@
 import os
-import ast
+import time
+import asyncio
+import logging
 import pandas as pd
 from dotenv import load_dotenv
 from products import router as products_router
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
-from statistics import mean
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import pipeline, CLIPProcessor, CLIPModel
+from typing import List, Literal, Optional
 from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEndpointEmbeddings
 from database import db
+from catalog import catalog
+from search_index import FilterPlan
+from sentiment import review_cache, save_product_sentiment, score_product_sentiment, score_review_lists
+from keyword_cache import KEYWORD_EXTRACTION_MODE, extract_keywords_locally, keyword_cache
+from response_cache import response_cache
+from image_queries import (IMAGE_UPLOAD_MAX_BYTES, ImageTooLarge, content_hash, decode_query_image,
+                           image_query_cache)
+from shared_state import SHARED_STATE_POLL_SECONDS, shared_state
+from ranking import RANKING_DEADLINE_SECONDS, local_pick
+from executor import io_pool, model_pool, pool_stats
+from inference import (PRIORITY_BACKGROUND, batcher_stats, clip_image_batcher, clip_text_batcher, sentiment_batcher,
+                       stack)
+from metrics import (TIMING_HEADER_ALWAYS, begin_request, record_cache, record_candidates, record_ranker,
+                     registry, request_seconds, stage)
+from models import MODEL_WARMUP, MODELS, llm, model_status, text_embedder, warm_up
+from ingest import delete_stored_embeddings, ingest_image_embeddings, load_stored_embeddings, stale_image_targets
+from text_embeddings import text_store, build_search_text
+from embedding_storage import IMAGE_SHARD_PATH, EmbeddingTable, save_shard
+from vector_index import (IMAGE_INDEX_KIND, IMAGE_INDEX_PATH, IMAGE_INDEX_QUANTIZATION, BruteForceIndex,
+                          load_or_build_index, normalize_rows)
 from PIL import Image
-from io import BytesIO
-import torch
-import requests
-import json
-import datetime
+import orjson
 import numpy as np
 
 
 load_dotenv()
-hf_token = os.getenv("HF_TOKEN")
 
-model = ChatGoogleGenerativeAI(model='gemini-2.0-flash')
-embedding = HuggingFaceEndpointEmbeddings(
-    repo_id="sentence-transformers/all-MiniLM-L6-v2",
-    task="feature-extraction",
-    huggingfacehub_api_token=hf_token
-)
-sentiment_pipeline = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english")
-
-# ------------------- CLIP Model for Reverse Search -------------------
-device = "cuda" if torch.cuda.is_available() else "cpu"
-clip_model_name = "openai/clip-vit-base-patch32"
-clip_model = CLIPModel.from_pretrained(clip_model_name).to(device)
-clip_processor = CLIPProcessor.from_pretrained(clip_model_name)
-product_image_embeddings = []
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# Most queries one /simple-search/batch request may carry
+BATCH_SEARCH_MAX_QUERIES = int(os.getenv("BATCH_SEARCH_MAX_QUERIES", "1000"))
+# Queries extracted, embedded and scored together before their results are streamed
+BATCH_SEARCH_CHUNK_SIZE = int(os.getenv("BATCH_SEARCH_CHUNK_SIZE", "32"))
+# LLM keyword extractions in flight at once within a batch
+BATCH_EXTRACTION_CONCURRENCY = int(os.getenv("BATCH_EXTRACTION_CONCURRENCY", "8"))
+# How /simple-search ranks filtered products when the request does not say:
+# "text" (remote document embeddings) or "clip" (local CLIP text tower
+# against the image embeddings)
+SIMPLE_SEARCH_SCORER = os.getenv("SIMPLE_SEARCH_SCORER", "text")
+
+# Models (Gemini, the embedding endpoint, DistilBERT, CLIP) live in
+# models.py and are loaded lazily, so importing this module stays cheap
+# ------------------- Reverse Search State -------------------
+image_index = BruteForceIndex.empty()
 product_df_for_reverse = pd.DataFrame()
+# product _id -> (image url hash, CLIP embedding)
+image_embeddings = EmbeddingTable()
+# Mongo created_at up to which image_embeddings is known complete
+image_embeddings_loaded_through = None
+image_refresh_lock = asyncio.Lock()
+# Background task loading the catalog, image index and models after startup
+warmup_task = None
+
+# These block while a model loads, so they only run on the worker pools
+# CLIP and DistilBERT calls go through micro-batchers (inference.py), so
+# concurrent requests share forward passes instead of each running batch-1
+def get_image_embeddings(images: List[Image.Image]):
+    return stack(clip_image_batcher.run(images))
 
 def get_image_embedding(image: Image.Image):
-    inputs = clip_processor(images=image, return_tensors="pt").to(device)
-    with torch.no_grad():
-        emb = clip_model.get_image_features(**inputs)
-    return emb.cpu().numpy()
+    return get_image_embeddings([image])
 
 def get_text_embedding(text: str):
-    inputs = clip_processor(text=[text], return_tensors="pt", padding=True).to(device)
-    with torch.no_grad():
-        emb = clip_model.get_text_features(**inputs)
-    return emb.cpu().numpy()
+    return stack(clip_text_batcher.run([text]))
+
+async def get_text_embedding_async(text: str) -> np.ndarray:
+    """CLIP text-tower embedding of `text`, computed locally."""
+    return stack(await clip_text_batcher.arun([text]))[0]
+
+def embed_documents(texts: List[str]):
+    return text_embedder.get().embed_documents(texts)
+
+def classify_sentiment(texts: List[str], **kwargs):
+    # The batcher picks batch size and truncation for the combined batch
+    return sentiment_batcher.run(texts)
+
+def classify_sentiment_background(texts: List[str], **kwargs):
+    """classify_sentiment for ingest-time scoring, queued behind live requests."""
+    return sentiment_batcher.run(texts, priority=PRIORITY_BACKGROUND)
 
 
 class SimpleProduct(BaseModel):
@@ -75,6 +114,14 @@ class RecommendationRequest(BaseModel):
     query: str
 
 
+class SimpleSearchRequest(RecommendationRequest):
+    scorer: Optional[Literal["text", "clip"]] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+
+
 class RecommendationResponse(BaseModel):
     title: str
     price: float
@@ -83,6 +130,8 @@ class RecommendationResponse(BaseModel):
     sold: int
     reasoning: str
     images: Optional[List[str]] = []  
+    # "llm", or "local" when the LLM missed the deadline or gave an invalid answer
+    ranker: str = "llm"
 
 
 class Keywords(BaseModel):
@@ -112,13 +161,16 @@ CategoriesSubcategories = [
     }
 ]
 
+# Flat, de-duplicated subcategory names: what the prompt and the local extractor choose from
+Subcategories = sorted({name for group in CategoriesSubcategories for names in group.values() for name in names})
+SubcategoryChoices = ', '.join(Subcategories)
+
 parser = PydanticOutputParser(pydantic_object=Keywords)
 keywordExtractionPrompt = PromptTemplate(
     template='Extract the following fields from the query: product_type, price_max, use_case, recipient, must_have_features, brand_preference, avoid_features, urgency\n\nQuery: {query} and for product_type only select one from the values {subcategory}\n\n{format_instruction}',
     input_variables=['query','subcategory'],
     partial_variables={'format_instruction': parser.get_format_instructions()}
 )
-chain = keywordExtractionPrompt | model | parser
 
 ranking_parser = PydanticOutputParser(pydantic_object=RankingResult)
 ranking_prompt = PromptTemplate(
@@ -157,7 +209,61 @@ Be decisive - choose one winner and defend it convincingly.
 """,
     partial_variables={'format_instructions': ranking_parser.get_format_instructions()}
 )
-ranking_chain = ranking_prompt | model | ranking_parser
+
+async def keyword_chain():
+    return keywordExtractionPrompt | await llm.aget() | parser
+
+async def ranking_chain():
+    return ranking_prompt | await llm.aget() | ranking_parser
+
+def lookup_keywords(query: str, query_embedding=None) -> Optional[Keywords]:
+    """Keywords found without the LLM: the cache, then the local extractor in local_first mode."""
+    result = keyword_cache.get(query, query_embedding)
+    record_cache("keywords", "hit" if result is not None else "miss")
+    if result is None and KEYWORD_EXTRACTION_MODE == "local_first":
+        fields = extract_keywords_locally(query, Subcategories)
+        if fields is not None:
+            result = Keywords(**fields)
+            keyword_cache.put(query, result, query_embedding)
+    return result
+
+async def extract_keywords(query: str, query_embedding=None) -> Keywords:
+    """Keywords for a query, from the cache when possible and the LLM only on a miss."""
+    result = lookup_keywords(query, query_embedding)
+    if result is None:
+        result = await (await keyword_chain()).ainvoke({'query': query, 'subcategory': SubcategoryChoices})
+        keyword_cache.put(query, result, query_embedding)
+    return result
+
+async def extract_keywords_batch(queries: List[str], query_embeddings=None) -> list:
+    """`extract_keywords` for many queries; the cache misses go to the LLM as one batch.
+
+    Returns a Keywords or the exception raised for each query, in order.
+    """
+    embeddings = query_embeddings if query_embeddings is not None else [None] * len(queries)
+    results = [lookup_keywords(query, embedding) for query, embedding in zip(queries, embeddings)]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        chain = await keyword_chain()
+        outputs = await chain.abatch(
+            [{'query': queries[i], 'subcategory': SubcategoryChoices} for i in pending],
+            config={"max_concurrency": BATCH_EXTRACTION_CONCURRENCY},
+            return_exceptions=True,
+        )
+        for i, output in zip(pending, outputs):
+            results[i] = output
+            if not isinstance(output, Exception):
+                keyword_cache.put(queries[i], output, embeddings[i])
+    return results
+
+async def embed_query_for_cache(query: str):
+    """Query embedding for the keyword and response cache keys; reused by semantic_match."""
+    if keyword_cache.similarity_threshold <= 0 and not response_cache.enabled:
+        return None
+    try:
+        return await (await text_embedder.aget()).aembed_query(query)
+    except Exception:
+        return None
 
 def format_output(result: Keywords):
     return {
@@ -172,247 +278,249 @@ def format_output(result: Keywords):
         "urgency": result.urgency,
     }
 
-async def load_products_from_db():
+async def load_catalog():
     try:
-        if db.db is None:
-            await db.connect()
-
-        cursor = db.products.find()
-        products = []
-        async for product in cursor:
-            product["_id"] = str(product["_id"])
-            products.append(product)
-
-        if len(products) == 0:
-            raise HTTPException(status_code=404, detail="No products found in database")
-
-        df = pd.DataFrame(products)
-        if 'reviews' in df.columns:
-            df['reviews'] = df['reviews'].apply(
-                lambda x: ast.literal_eval(x) if isinstance(x, str) else x
-            )
-        return df
+        snapshot = await catalog.get_snapshot()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-def filter_dataset(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
-    filtered_df = df.copy()
+    if snapshot.size == 0:
+        raise HTTPException(status_code=404, detail="No products found in database")
+    return snapshot
 
-    if filters['product_type']:
-        keywords = filters['product_type'].lower().split()
-        condition = pd.Series([True] * len(filtered_df))
-        for word in keywords:
-            word_condition = (
-                filtered_df['title'].str.contains(word, case=False, na=False) |
-                filtered_df['description'].str.contains(word, case=False, na=False)
-            )
-            if 'category' in filtered_df.columns:
-                word_condition |= filtered_df['category'].str.contains(word, case=False, na=False)
-            condition &= word_condition
-        filtered_df = filtered_df[condition]
-
-    if filters['price_max']:
-        filtered_df = filtered_df[filtered_df['price'] <= filters['price_max']]
-
-    if filters['price_min']:
-        filtered_df = filtered_df[filtered_df['price'] >= filters['price_min']]
-
-    if filters['brand_preference']:
-        filtered_df = filtered_df[filtered_df['title'].str.contains(filters['brand_preference'], case=False, na=False)]
-
-    if filters['urgency'] and "urgent" in filters['urgency'].lower():
-        filtered_df = filtered_df.sort_values(by="sold", ascending=False).head(20)
+def filter_dataset(snapshot, filters: dict) -> np.ndarray:
+    """Row positions in the snapshot frame that match the extracted filters.
 
-    for feature in filters['must_have_features']:
-        condition = filtered_df['description'].str.contains(feature, case=False, na=False)
-        if 'tags' in filtered_df.columns:
-            condition = condition | filtered_df['tags'].str.contains(feature, case=False, na=False)
-        filtered_df = filtered_df[condition]
-
-    for avoid in filters['avoid_features']:
-        condition = ~filtered_df['description'].str.contains(avoid, case=False, na=False)
-        if 'tags' in filtered_df.columns:
-            condition = condition & ~filtered_df['tags'].str.contains(avoid, case=False, na=False)
-        filtered_df = filtered_df[condition]
-
-    return filtered_df.reset_index(drop=True)
-
-def semantic_match(query, df: pd.DataFrame, top_k=10):
-    search_text_parts = [df['title'].fillna(''), df['description'].fillna('')]
-    if 'tags' in df.columns:
-        search_text_parts.append(df['tags'].apply(lambda x: ' '.join(x) if isinstance(x, list) else str(x)))
-    df['search_text'] = pd.concat(search_text_parts, axis=1).apply(lambda row: ' '.join(row.dropna().astype(str)), axis=1)
+    If nothing matches, falls back to the rows matching product_type alone.
+    """
+    rows, relaxed = FilterPlan(snapshot.index, filters).rows()
+    if relaxed:
+        logger.debug("No results after strict filtering, relaxed to product type: %d rows", len(rows))
+    return rows
 
+async def semantic_match(query, df: pd.DataFrame, rows: np.ndarray, top_k=10, query_embedding=None):
+    """The `top_k` rows most similar to the query, materialized as a new frame."""
+    ids = df['_id'].to_numpy()[rows]
     try:
-        doc_embeddings = embedding.embed_documents(df['search_text'].tolist())
-        query_embedding = embedding.embed_query(query)
-        df['similarity_score'] = cosine_similarity([query_embedding], doc_embeddings)[0]
-        return df.sort_values(by='similarity_score', ascending=False).head(top_k).reset_index(drop=True)
+        if query_embedding is None:
+            query_embedding = await (await text_embedder.aget()).aembed_query(query)
+        approximate = text_store.approximate_top_k(ids, query_embedding, top_k)
+        if approximate is not None:
+            positions, scores = approximate
+        else:
+            scores, missing = text_store.score(ids, query_embedding)
+            record_cache("text_embeddings", "hit", int(len(missing) - missing.sum()))
+            record_cache("text_embeddings", "miss", int(missing.sum()))
+            if missing.any():
+                # Products newer than the last store sync are embedded on the fly
+                texts = build_search_text(df.iloc[rows[missing]]).tolist()
+                doc_embeddings = normalize_rows(np.asarray(await (await text_embedder.aget()).aembed_documents(texts)))
+                scores[missing] = doc_embeddings @ normalize_rows(np.asarray([query_embedding]))[0]
+            positions = np.arange(len(rows))
+        top = np.argsort(-scores, kind='stable')[:top_k]
+        matched = df.iloc[rows[positions[top]]].reset_index(drop=True)
+        matched['similarity_score'] = scores[top]
+        return matched
     except Exception:
-        return df.head(top_k).reset_index(drop=True)
-
-def compute_sentiment_score(matched_df):
-    scores = []
-    for reviews in matched_df.get('reviews', []):
-        if not isinstance(reviews, list):
-            scores.append(0)
-            continue
+        return df.iloc[rows[:top_k]].reset_index(drop=True)
+
+async def clip_match(query_embedding: np.ndarray, df: pd.DataFrame, rows: np.ndarray, top_k=10):
+    """The `top_k` rows whose image best matches a CLIP text embedding of the query.
+
+    Scores are exact cosine similarities against the image index, so no
+    remote call is made; products without an image embedding score 0.
+    """
+    ids = df['_id'].to_numpy()[rows]
+    scores, found = image_index.score_ids(query_embedding, ids)
+    record_cache("image_embeddings", "hit", int(found.sum()))
+    record_cache("image_embeddings", "miss", int(len(found) - found.sum()))
+    top = np.argsort(-scores, kind='stable')[:top_k]
+    matched = df.iloc[rows[top]].reset_index(drop=True)
+    matched['similarity_score'] = scores[top]
+    return matched
+
+async def semantic_match_batch(df: pd.DataFrame, row_sets: List[np.ndarray], query_embeddings, top_k=10):
+    """`semantic_match` for several queries sharing one scoring pass.
+
+    The union of every query's candidate rows is scored against all query
+    embeddings in a single matrix-matrix product, and products missing from
+    the text store are embedded once even if several queries share them.
+    """
+    if query_embeddings is None or not row_sets:
+        return [df.iloc[rows[:top_k]].reset_index(drop=True) for rows in row_sets]
+    union = np.unique(np.concatenate(row_sets))
+    try:
+        scores, missing = text_store.score_many(df['_id'].to_numpy()[union], query_embeddings)
+        record_cache("text_embeddings", "hit", int(len(missing) - missing.sum()))
+        record_cache("text_embeddings", "miss", int(missing.sum()))
+        if missing.any():
+            texts = build_search_text(df.iloc[union[missing]]).tolist()
+            doc_embeddings = normalize_rows(np.asarray(await (await text_embedder.aget()).aembed_documents(texts)))
+            scores[:, missing] = normalize_rows(np.asarray(query_embeddings)) @ doc_embeddings.T
+    except Exception:
+        return [df.iloc[rows[:top_k]].reset_index(drop=True) for rows in row_sets]
+
+    results = []
+    for query_scores, rows in zip(scores, row_sets):
+        row_scores = query_scores[np.searchsorted(union, rows)]
+        top = np.argsort(-row_scores, kind='stable')[:top_k]
+        matched = df.iloc[rows[top]].reset_index(drop=True)
+        matched['similarity_score'] = row_scores[top]
+        results.append(matched)
+    return results
+
+async def cached_response(endpoint: str, filters: dict, query: str, query_embedding, snapshot):
+    """The response cache key for a search, and the cached body if there is one."""
+    if not response_cache.enabled:
+        return None, None
+    key = response_cache.key(endpoint, filters, query, query_embedding, snapshot.fingerprint)
+    body = await response_cache.get(key)
+    record_cache("response", "hit" if body is not None else "miss")
+    return key, body
+
+def order_for_display(matched: pd.DataFrame) -> pd.DataFrame:
+    """Best sellers first, then by similarity, as /simple-search lists them."""
+    if 'sold' in matched.columns and 'similarity_score' in matched.columns:
+        return matched.sort_values(by=['sold', 'similarity_score'], ascending=False)
+    if 'similarity_score' in matched.columns:
+        return matched.sort_values(by='similarity_score', ascending=False)
+    if 'sold' in matched.columns:
+        return matched.sort_values(by='sold', ascending=False)
+    return matched
+
+def _column(df: pd.DataFrame, name: str, default, dtype=None) -> list:
+    if name not in df.columns:
+        return [default] * len(df)
+    values = df[name]
+    if dtype is not None:
+        return pd.to_numeric(values, errors='coerce').fillna(default).astype(dtype).tolist()
+    if isinstance(default, list):
+        # Normalized to lists at catalog load
+        return values.tolist()
+    return values.astype(object).where(values.notna(), default).tolist()
+
+def product_records(matched: pd.DataFrame) -> List[dict]:
+    """SimpleProduct-shaped dicts built column by column.
+
+    `images` and `reviews` are already lists (see catalog.prepare_product),
+    so nothing is parsed or validated per row; ORJSONResponse encodes the
+    result directly.
+    """
+    similarity = (matched['similarity_score'].astype(float) if 'similarity_score' in matched.columns
+                  else pd.Series(np.nan, index=matched.index))
+    columns = {
+        "title": _column(matched, 'title', ''),
+        "price": _column(matched, 'price', 0.0, float),
+        "rating": _column(matched, 'rating', 0.0, float),
+        "sentiment_score": _column(matched, 'sentiment_score', 0.0, float),
+        "sold": _column(matched, 'sold', 0, int),
+        "similarity_score": [None if np.isnan(score) else score for score in similarity.tolist()],
+        "images": _column(matched, 'images', []),
+        "category": _column(matched, 'category', None),
+        "reviews": _column(matched, 'reviews', []),
+    }
+    keys = list(columns)
+    return [dict(zip(keys, values)) for values in zip(*columns.values())]
+
+async def compute_sentiment_score(matched_df):
+    # Scores are stored on each product at ingest; only products that have
+    # not been scored yet go through the pipeline, all in one batch
+    if 'sentiment_score' in matched_df.columns:
+        scores = matched_df['sentiment_score'].astype(float)
+    else:
+        scores = pd.Series(np.nan, index=matched_df.index)
+    missing = scores.isna().to_numpy()
+    record_cache("sentiment", "hit", int(len(missing) - missing.sum()))
+    record_cache("sentiment", "miss", int(missing.sum()))
+    if missing.any() and 'reviews' in matched_df.columns:
         try:
-            sentiments = sentiment_pipeline(reviews[:10])
-            score = mean([1 if s['label'] == 'POSITIVE' else 0 for s in sentiments])
-            scores.append(round(score * 100, 2))
+            fresh, _ = await model_pool.run(
+                score_review_lists, matched_df.loc[missing, 'reviews'].tolist(), classify_sentiment, review_cache
+            )
+            scores[missing] = fresh
         except Exception:
-            scores.append(0)
-    matched_df['sentiment_score'] = scores
+            pass
+    matched_df['sentiment_score'] = scores.fillna(0).to_numpy()
     return matched_df
 
 
 # ------------------- Reverse Search Data Preload -------------------
-async def preload_image_embeddings():
-    global product_image_embeddings, product_df_for_reverse
+def build_image_index(embeddings: EmbeddingTable, product_ids):
+    """Index CLIP embeddings by product _id, reusing the saved index when unchanged."""
+    wanted = set(product_ids)
+    # In table order, so the usual case of every row reads the mapped matrix without a copy
+    ids = [product_id for product_id in embeddings if product_id in wanted]
+    if not ids:
+        return BruteForceIndex.empty()
+    return load_or_build_index(IMAGE_INDEX_KIND, IMAGE_INDEX_PATH, embeddings.vectors(ids), ids,
+                               quantization=IMAGE_INDEX_QUANTIZATION)
+
+async def refresh_image_embeddings(snapshot):
+    """Embed only products that are new or whose image changed, then rebuild the index."""
+    global image_embeddings, image_index, product_df_for_reverse
+    async with image_refresh_lock:
+        df = snapshot.df[snapshot.df['images'].notna()]
+        product_ids = df['_id'].tolist()
+
+        removed = sorted(set(image_embeddings) - set(product_ids))
+        if removed:
+            await delete_stored_embeddings(removed)
+            image_embeddings = image_embeddings.without(removed)
+
+        targets = stale_image_targets(df, image_embeddings)
+        fresh = {}
+        if targets:
+            logger.info("%d products need new image embeddings", len(targets))
+            fresh = await ingest_image_embeddings(targets, get_image_embeddings)
+            image_embeddings = image_embeddings.merge(fresh)
+
+        # Saved before indexing so both the index build and later refreshes
+        # read the shard's mapping instead of an in-memory copy
+        if removed or fresh or (len(image_embeddings) and not image_embeddings.mapped):
+            image_embeddings = await asyncio.to_thread(save_image_shard, image_embeddings)
+        if removed or fresh or len(image_index) == 0:
+            image_index = build_image_index(image_embeddings, product_ids)
+            await shared_state.publish("image_index", image_index)
+        product_df_for_reverse = reverse_search_frame(snapshot.df)
+        logger.info("Image index ready: %d/%d products with images", len(image_index), len(product_ids))
+
+def reverse_search_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Products with images, looked up by _id when resolving image search hits."""
+    return df[df['images'].notna()].set_index('_id', drop=False)
+
+def save_image_shard(embeddings: EmbeddingTable) -> EmbeddingTable:
+    """Local copy of the image embeddings so the next startup maps it instead of
+    reading Mongo. Returns the table backed by the saved file, or unchanged if
+    saving failed."""
     try:
-        print("🔄 Starting to preload image embeddings...")
-        
-        # First, try to load existing embeddings from MongoDB
-        existing_embeddings = await load_embeddings_from_db()
-        if existing_embeddings and len(existing_embeddings) > 0:
-            print(f"✅ Loaded {len(existing_embeddings)} existing embeddings from database")
-            product_image_embeddings = existing_embeddings
-            # Load the corresponding product data
-            df = await load_products_from_db()
-            df = df[df['images'].notna()]
-            product_df_for_reverse = df.reset_index(drop=True)
-            return
-        
-        # If no existing embeddings, generate new ones
-        print("🔄 No existing embeddings found, generating new ones...")
-        df = await load_products_from_db()
-        df = df[df['images'].notna()]
-        print(f"📊 Found {len(df)} products with images")
-        
-        image_urls = []
-        for imgs in df['images']:
-            if isinstance(imgs, list) and imgs:
-                image_urls.append(imgs[0])
-            elif isinstance(imgs, str):
-                image_urls.append(imgs)
-            else:
-                image_urls.append(None)
-        
-        df['image_url'] = image_urls
-        embeddings = []
-        successful_embeddings = 0
-        
-        for i, url in enumerate(image_urls):
-            if not url:
-                embeddings.append(None)
-                continue
-            try:
-                print(f"🖼️ Processing image {i+1}/{len(image_urls)}: {url[:50]}...")
-                resp = requests.get(url, timeout=10)
-                img = Image.open(BytesIO(resp.content)).convert("RGB")
-                emb = get_image_embedding(img)
-                embeddings.append(emb)
-                successful_embeddings += 1
-                
-                # Store embedding in MongoDB after each successful generation
-                print(f"💾 Storing embedding {i} in database...")
-                await store_embedding_in_db(i, url, emb)
-                
-            except Exception as e:
-                print(f"❌ Failed to process image {i+1}: {str(e)}")
-                embeddings.append(None)
-        
-        product_df_for_reverse = df.reset_index(drop=True)
-        product_image_embeddings = embeddings
-        
-        print(f"✅ Successfully preloaded {successful_embeddings}/{len(image_urls)} image embeddings")
-        
-    except Exception as e:
-        print(f"❌ Error preloading image embeddings: {str(e)}")
-        product_image_embeddings = []
-        product_df_for_reverse = pd.DataFrame()
+        return save_shard(IMAGE_SHARD_PATH, embeddings, image_embeddings_loaded_through)
+    except OSError as e:
+        logger.warning("Could not save image embedding shard %s: %s", IMAGE_SHARD_PATH, e)
+        return embeddings
 
-async def store_embedding_in_db(product_index: int, image_url: str, embedding):
-    """Store image embedding in MongoDB"""
+async def preload_image_embeddings():
+    global image_embeddings, image_embeddings_loaded_through, image_index, product_df_for_reverse
     try:
-        if db.db is None:
-            print(f"❌ Database not connected when trying to store embedding {product_index}")
-            return
-            
-        embedding_data = {
-            "product_index": product_index,
-            "image_url": image_url,
-            "embedding": embedding.tolist(),  # Convert numpy array to list for MongoDB storage
-            "created_at": datetime.datetime.utcnow()
-        }
-        
-        print(f"💾 Attempting to store embedding {product_index} with data size: {len(embedding_data['embedding'])}")
-        
-        # Check if embedding already exists
-        existing = await db.embeddings.find_one({"product_index": product_index})
-        if existing:
-            # Update existing embedding
-            result = await db.embeddings.update_one(
-                {"product_index": product_index},
-                {"$set": embedding_data}
-            )
-            print(f"✅ Updated embedding for product {product_index}, modified count: {result.modified_count}")
-        else:
-            # Insert new embedding
-            result = await db.embeddings.insert_one(embedding_data)
-            print(f"✅ Inserted embedding for product {product_index}, inserted id: {result.inserted_id}")
-            
+        image_embeddings, image_embeddings_loaded_through = await load_embeddings_from_db()
+        logger.info("Loaded %d existing image embeddings", len(image_embeddings))
+        await refresh_image_embeddings(await catalog.get_snapshot())
+        # Later catalog changes only re-embed what changed
+        catalog.add_listener(refresh_image_embeddings, on_annotations=False)
     except Exception as e:
-        print(f"❌ Error storing embedding for product {product_index}: {str(e)}")
-        print(f"   Error type: {type(e).__name__}")
-        print(f"   Database connection status: db.db = {db.db}")
-        try:
-            if db.db is not None:
-                collections = await db.list_collection_names()
-                print(f"   Available collections: {collections}")
-        except Exception as coll_error:
-            print(f"   Could not list collections: {coll_error}")
+        logger.exception("Error preloading image embeddings: %s", e)
+        image_index = BruteForceIndex.empty()
+        product_df_for_reverse = pd.DataFrame()
 
 async def load_embeddings_from_db():
-    """Load image embeddings from MongoDB"""
+    """Load image embeddings from MongoDB, keyed by product _id"""
     try:
         if db.db is None:
-            print("⚠️ Database not connected, skipping embedding load")
-            return []
-            
-        print("🔍 Checking embeddings collection...")
-        try:
-            embeddings_count = await db.embeddings.count_documents({})
-            print(f"📊 Found {embeddings_count} embeddings in database")
-        except Exception as count_error:
-            print(f"⚠️ Could not count embeddings: {count_error}")
-            return []
-            
-        cursor = db.embeddings.find().sort("product_index", 1)
-        embeddings = []
-        async for doc in cursor:
-            try:
-                # Convert list back to numpy array
-                embedding_array = np.array(doc["embedding"])
-                embeddings.append(embedding_array)
-            except Exception as conv_error:
-                print(f"⚠️ Error converting embedding {doc.get('product_index', 'unknown')}: {conv_error}")
-                continue
-        
-        print(f"✅ Successfully loaded {len(embeddings)} embeddings from database")
-        return embeddings
+            logger.warning("Database not connected, skipping embedding load")
+            return EmbeddingTable(), None
+        return await load_stored_embeddings()
     except Exception as e:
-        print(f"❌ Error loading embeddings from database: {str(e)}")
-        print(f"   Error type: {type(e).__name__}")
-        print(f"   Database connection status: db.db = {db.db}")
-        try:
-            if db.db is not None:
-                collections = await db.list_collection_names()
-                print(f"   Available collections: {collections}")
-        except Exception as coll_error:
-            print(f"   Could not list collections: {coll_error}")
-        return []
+        logger.exception("Error loading embeddings from database (%s): %s", type(e).__name__, e)
+        return EmbeddingTable(), None
 
 # ✅ FastAPI App Initialization with CORS
 app = FastAPI(title="Smart Shopping Assistant", description="Backend for Smart Shopping Assistant")
@@ -424,44 +532,166 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
 app.include_router(products_router, prefix="/api", tags=["products"])
 
-@app.on_event("startup")
-async def startup_event():
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    """Request latency histogram, plus the per-stage breakdown when asked for."""
+    timings = begin_request(request.url.path)
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    request_seconds.observe(time.perf_counter() - started, method=request.method,
+                            path=route.path if route is not None else "unmatched", status=response.status_code)
+    if timings.stages and (TIMING_HEADER_ALWAYS or request.headers.get("X-Timing") == "1"):
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+# Current values read at scrape time
+registry.collector("catalog_version", "gauge", "Version of the catalog snapshot being served.",
+                   lambda: [({}, catalog.stats().get("version", 0))])
+registry.collector("catalog_products", "gauge", "Products in the catalog snapshot being served.",
+                   lambda: [({}, catalog.stats().get("size", 0))])
+registry.collector("catalog_snapshot_age_seconds", "gauge", "Seconds since the catalog snapshot being served was built.",
+                   lambda: [({}, round(catalog.snapshot.age_seconds, 3))] if catalog.snapshot is not None else [])
+registry.collector("executor_queue_depth", "gauge", "Calls waiting for a worker thread.",
+                   lambda: [({"pool": name}, stats["queue_depth"]) for name, stats in pool_stats().items()])
+registry.collector("executor_active_workers", "gauge", "Worker threads currently running a call.",
+                   lambda: [({"pool": name}, stats["active"]) for name, stats in pool_stats().items()])
+registry.collector("keyword_cache_entries", "gauge", "Entries in the keyword extraction cache.",
+                   lambda: [({}, len(keyword_cache))])
+registry.collector("response_cache_bytes", "gauge", "Bytes of response bodies held by the response cache.",
+                   lambda: [({}, response_cache.stats()["bytes"])])
+registry.collector("image_index_products", "gauge", "Products in the reverse image search index.",
+                   lambda: [({}, len(image_index))])
+
+async def sync_text_store(snapshot):
+    await text_store.sync(snapshot.df, embed_documents)
+    await shared_state.publish("text_store", text_store.export())
+
+async def refresh_catalog_sentiment(snapshot):
+    """Score products whose reviews changed, apply the scores to the snapshot, then store them."""
+    updates = await score_product_sentiment(snapshot.df, classify_sentiment_background, review_cache)
+    if updates:
+        # In memory first, so the change stream sees its own writes as no-ops
+        await catalog.annotate(updates)
+        await save_product_sentiment(updates)
+        logger.info("Updated sentiment_score on %d products", len(updates))
+
+async def start_building():
+    """Own the Mongo-facing work: catalog, document and image embeddings, sentiment.
+
+    In a multi-worker deployment only the builder does this; it publishes
+    the results as shared segments the other workers attach to.
+    """
+    # Document embeddings for semantic_match follow every catalog snapshot
+    if len(text_store) == 0 and text_store.load():
+        logger.info("Loaded %d stored text embeddings", len(text_store))
+    catalog.add_listener(sync_text_store, on_annotations=False)
+    catalog.add_listener(lambda snapshot: shared_state.publish(
+        "catalog", (snapshot.df, snapshot.index, snapshot.fingerprint)))
+    # Review sentiment is scored on ingest and stored on the product
+    catalog.add_listener(refresh_catalog_sentiment, on_annotations=False)
+    await load_data()
+
+async def follow_shared_state():
+    """Serve what the builder worker publishes; take over if it goes away."""
+    global image_index, product_df_for_reverse
+    logger.info("Attaching to catalog and embeddings published by the builder worker")
+    while True:
+        published = await shared_state.attach("catalog")
+        if published is not None:
+            snapshot = await catalog.adopt(*published)
+            product_df_for_reverse = reverse_search_frame(snapshot.df)
+        published = await shared_state.attach("text_store")
+        if published is not None:
+            text_store.adopt(published)
+        published = await shared_state.attach("image_index")
+        if published is not None:
+            image_index = published
+
+        if shared_state.try_become_builder():
+            logger.info("Builder worker exited; this worker takes over loading from Mongo")
+            await start_building()
+            return
+        await asyncio.sleep(SHARED_STATE_POLL_SECONDS)
+
+async def load_data():
+    """Check the database, load the catalog snapshot and preload image embeddings."""
     try:
-        print("🚀 Starting Smart Shopping Assistant Backend...")
-        await db.connect()
         await db.products.find_one()
-        print("✅ Database connected successfully")
-        print(f"🔍 Database object: {db}")
-        print(f"🔍 Database.db: {db.db}")
-        
+        logger.info("Database connected")
+
         # Check available collections
         try:
             collections = await db.list_collection_names()
-            print(f"📚 Available collections: {collections}")
+            logger.debug("Available collections: %s", collections)
         except Exception as e:
-            print(f"⚠️ Could not list collections: {e}")
-        
+            logger.warning("Could not list collections: %s", e)
+
+        # Load the catalog snapshot once and keep it current in the background
+        await catalog.start()
+        logger.info("Catalog snapshot loaded: %s", catalog.stats())
+
         # Preload image embeddings for reverse image search
-        print("🔄 Starting image embedding preload...")
         await preload_image_embeddings()
-        print("✅ Startup completed successfully")
-        
+        logger.info("Startup data loaded")
+
     except Exception as e:
-        print(f"❌ Startup error: {str(e)}")
-        pass
+        logger.exception("Startup error: %s", e)
+
+@app.on_event("startup")
+async def startup_event():
+    # Only cheap setup happens here so the server binds right away; data and
+    # models load in the background and /ready reports when they are done
+    global warmup_task
+    logger.info("Starting Smart Shopping Assistant Backend")
+    await db.connect()
+
+    # Cached responses belong to the snapshot they were computed from
+    catalog.add_listener(response_cache.on_catalog_change)
+    # With several workers, one loads from Mongo and the rest map its segments
+    loading = start_building() if shared_state.try_become_builder() else follow_shared_state()
+
+    jobs = [loading] + ([warm_up()] if MODEL_WARMUP else [])
+    warmup_task = asyncio.ensure_future(asyncio.gather(*jobs))
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await catalog.stop()
     await db.close()
+    model_pool.shutdown()
+    io_pool.shutdown()
 
 @app.get("/")
 def root():
     return {"message": "Smart Shopping Assistant Backend is running!"}
 
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+async def ready():
+    """Readiness, as opposed to liveness (`/`): 503 until every component can serve."""
+    catalog_stats = catalog.stats()
+    components = {
+        "database": {"state": "ready" if db.db is not None else "not_loaded"},
+        "catalog": {"state": "ready" if catalog_stats["loaded"] else "not_loaded", "size": catalog_stats.get("size", 0)},
+        "image_index": {"state": "ready" if len(image_index) > 0 else "not_loaded", "size": len(image_index)},
+        **model_status(),
+    }
+    # With warm-up off, models load on first use and do not hold up readiness
+    required = ["database", "catalog"] + ([lazy.name for lazy in MODELS] if MODEL_WARMUP else [])
+    is_ready = all(components[name]["state"] == "ready" for name in required)
+    return JSONResponse(status_code=200 if is_ready else 503,
+                        content={"ready": is_ready, "components": components})
+
 @app.get("/status")
 async def status():
     try:
@@ -478,9 +708,17 @@ async def status():
             "status": "running",
             "database": db_status,
             "collections": collections,
-            "image_search_ready": len(product_image_embeddings) > 0,
+            "catalog": catalog.stats(),
+            "shared_state": shared_state.stats(),
+            "pools": pool_stats(),
+            "models": model_status(),
+            "inference": batcher_stats(),
+            "keyword_cache": keyword_cache.stats(),
+            "response_cache": response_cache.stats(),
+            "image_query_cache": image_query_cache.stats(),
+            "image_search_ready": len(image_index) > 0,
             "products_loaded": len(product_df_for_reverse) if len(product_df_for_reverse) > 0 else 0,
-            "embeddings_loaded": len([e for e in product_image_embeddings if e is not None])
+            "embeddings_loaded": len(image_index)
         }
     except Exception as e:
         return {
@@ -518,191 +756,248 @@ async def test_database():
         return {"error": str(e)}
 
 # ------------------- Reverse Image Search Endpoint -------------------
-@app.post("/reverse-search/image", response_model=SimpleSearchResponse)
+@app.post("/reverse-search/image", response_model=SimpleSearchResponse, response_class=ORJSONResponse)
 async def reverse_search_image(file: UploadFile = File(...), top_k: int = 3):
     try:
         # Check if image embeddings are loaded
-        if not product_image_embeddings or len(product_image_embeddings) == 0:
+        if len(image_index) == 0:
             raise HTTPException(status_code=503, detail="Image search service not ready. Please try again in a moment.")
         
-        img = Image.open(file.file).convert("RGB")
-        query_emb = get_image_embedding(img)
-        
-        similarities = []
-        for idx, emb in enumerate(product_image_embeddings):
-            if emb is not None:
-                sim = cosine_similarity(query_emb, emb)[0][0]
-                similarities.append((idx, sim))
-        
-        if not similarities:
-            raise HTTPException(status_code=404, detail="No similar products found")
-            
-        similarities = sorted(similarities, key=lambda x: x[1], reverse=True)[:top_k]
-        results = []
-        
-        for idx, sim in similarities:
-            row = product_df_for_reverse.iloc[idx]
-            results.append(SimpleProduct(
-                title=row.get('title', ''),
-                price=row.get('price', 0),
-                rating=row.get('rating', 0.0),
-                sentiment_score=0.0,
-                sold=row.get('sold', 0),
-                similarity_score=float(sim),
-                images=row.get('images', []),
-                category=row.get('category', None),
-                reviews=row.get('reviews', []) if isinstance(row.get('reviews', []), list) else []
-            ))
-        
-        return SimpleSearchResponse(products=results)
+        with stage("read_upload"):
+            data = await read_upload(file)
+        with stage("embed_image"):
+            query_emb = await embed_query_image(data)
+
+        return ORJSONResponse({"products": product_records(image_search(query_emb, top_k))})
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in reverse image search: {str(e)}")
+        logger.exception("Error in reverse image search: %s", e)
         raise HTTPException(status_code=500, detail=f"Image search failed: {str(e)}")
 
 
-@app.post("/simple-search", response_model=SimpleSearchResponse)
-async def simple_search(req: RecommendationRequest):
+async def read_upload(file: UploadFile) -> bytes:
+    """The uploaded bytes, refusing anything over IMAGE_UPLOAD_MAX_BYTES before reading it all."""
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(256 * 1024)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > IMAGE_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image is larger than {IMAGE_UPLOAD_MAX_BYTES} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def embed_query_image(data: bytes) -> np.ndarray:
+    """CLIP embedding of an uploaded image, reused for identical or near-identical uploads."""
+    key = content_hash(data)
+    embedding = image_query_cache.get(key)
+    if embedding is not None:
+        record_cache("image_query", "hit")
+        return embedding
+    try:
+        image, phash = await model_pool.run(decode_query_image, data)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not decode the uploaded image")
+    embedding = image_query_cache.get_near(phash)
+    record_cache("image_query", "near_hit" if embedding is not None else "miss")
+    if embedding is None:
+        embedding = stack(await clip_image_batcher.arun([image]))[0]
+    image_query_cache.put(key, phash, embedding)
+    return embedding
+
+@app.post("/reverse-search/text", response_model=SimpleSearchResponse, response_class=ORJSONResponse)
+async def reverse_search_text(req: RecommendationRequest, top_k: int = 10):
+    """Products whose image matches a text query, via CLIP's text tower.
+
+    Runs entirely in-process: no keyword extraction and no remote
+    embedding call, just the local CLIP model and the image index.
+    """
+    if len(image_index) == 0:
+        raise HTTPException(status_code=503, detail="Image search service not ready. Please try again in a moment.")
     try:
-        #print("🔍 User query:", req.query)
-        result = chain.invoke({'query': req.query,'subcategory':CategoriesSubcategories})
+        with stage("embed_query"):
+            query_emb = await get_text_embedding_async(req.query)
+        return ORJSONResponse({"products": product_records(image_search(query_emb, top_k))})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error in text-to-image search: %s", e)
+        raise HTTPException(status_code=500, detail=f"Image search failed: {str(e)}")
+
+
+def image_search(query_emb: np.ndarray, top_k: int) -> pd.DataFrame:
+    """The `top_k` products nearest to a CLIP embedding in the image index."""
+    with stage("image_search"):
+        top_ids, top_scores = image_index.search(query_emb, top_k)
+    if len(top_ids) == 0:
+        raise HTTPException(status_code=404, detail="No similar products found")
+
+    # Hash lookups in the _id index; np.isin would sort all product ids per request
+    rows = product_df_for_reverse.index.get_indexer(np.asarray(top_ids))
+    found = rows >= 0
+    matched = product_df_for_reverse.iloc[rows[found]].reset_index(drop=True)
+    matched['similarity_score'] = np.asarray(top_scores, dtype=float)[found]
+    matched['sentiment_score'] = 0.0
+    return matched
+
+
+@app.post("/simple-search", response_model=SimpleSearchResponse, response_class=ORJSONResponse)
+async def simple_search(req: SimpleSearchRequest):
+    # The CLIP scorer needs the image index; until it is loaded, rank by text
+    scorer = req.scorer or SIMPLE_SEARCH_SCORER
+    if scorer == "clip" and len(image_index) == 0:
+        scorer = "text"
+    endpoint = "simple-search" if scorer == "text" else "simple-search:clip"
+    try:
+        with stage("embed_query"):
+            if scorer == "clip":
+                # Local CLIP embedding; it also keys the response cache
+                query_embedding = await get_text_embedding_async(req.query)
+            else:
+                query_embedding = await embed_query_for_cache(req.query)
+        with stage("extract_keywords"):
+            # The keyword cache compares text-embedder vectors, not CLIP ones
+            result = await extract_keywords(req.query, query_embedding if scorer == "text" else None)
         filters = format_output(result)
-        #print("🧠 Extracted filters:", filters)
+        logger.debug("Query %r -> filters %s", req.query, filters)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Query parsing failed: {str(e)}")
 
-    df = await load_products_from_db()
-
-    # First filtering
-    filtered = filter_dataset(df, filters)
-
-    if filtered.empty:
-        # print("⚠️ No results after strict filtering. Relaxing...")
-        relaxed_filters = {
-            "product_type": filters.get("product_type"),
-            "price_max": None,
-            "price_min": None,
-            "use_case": None,
-            "recipient": None,
-            "must_have_features": [],
-            "brand_preference": None,
-            "avoid_features": [],
-            "urgency": None,
-        }
-        filtered = filter_dataset(df, relaxed_filters)
+    with stage("load_catalog"):
+        snapshot = await load_catalog()
 
-        if filtered.empty:
-            # print("❌ Still no matches after relaxing filters.")
-            # Return empty product list instead of random products
-            return SimpleSearchResponse(products=[])
+    with stage("response_cache"):
+        cache_key, body = await cached_response(endpoint, filters, req.query, query_embedding, snapshot)
+    if body is not None:
+        return Response(body, media_type="application/json")
 
-    # Semantic match
-    matched = semantic_match(req.query, filtered)
+    # Strict filtering, relaxed to product type if nothing matches
+    with stage("filter"):
+        filtered = filter_dataset(snapshot, filters)
+    record_candidates("filter", len(filtered))
 
-    # Add sentiment scores
-    matched = compute_sentiment_score(matched)
+    if len(filtered) == 0:
+        # Return empty product list instead of random products
+        return SimpleSearchResponse(products=[])
 
-    # Sort based on availability
-    if 'sold' in matched.columns and 'similarity_score' in matched.columns:
-        matched = matched.sort_values(by=['sold', 'similarity_score'], ascending=False)
-    elif 'similarity_score' in matched.columns:
-        matched = matched.sort_values(by='similarity_score', ascending=False)
-    elif 'sold' in matched.columns:
-        matched = matched.sort_values(by='sold', ascending=False)
-
-    # Convert to list of SimpleProduct
-    products = []
-    for _, row in matched.iterrows():
-        images = row.get("images", [])
-
-        # Handle NaN, None, or empty
-        if images is None or (isinstance(images, float) and pd.isna(images)):
-            images = []
-        # If it's a string, try to parse as JSON or treat as single image
-        elif isinstance(images, str):
-            try:
-                import json
-                parsed = json.loads(images)
-                if isinstance(parsed, list):
-                    images = parsed
-                else:
-                    images = [parsed]
-            except Exception:
-                images = [images]
-        # If it's a list or tuple, keep as is
-        elif isinstance(images, (list, tuple)):
-            images = list(images)
+    # Semantic match
+    with stage("semantic_match"):
+        if scorer == "clip":
+            matched = await clip_match(query_embedding, snapshot.df, filtered)
         else:
-            images = [images]
-
-        products.append(SimpleProduct(
-            title=row.get('title', ''),
-            price=row.get('price', 0),
-            rating=row.get('rating', 0.0),
-            sentiment_score=row.get('sentiment_score', 0.0),
-            sold=row.get('sold', 0),
-            similarity_score=row.get('similarity_score'),
-            images=images,
-            category=row.get('category', None),  
-            reviews=row.get('reviews', []) if isinstance(row.get('reviews', []), list) else []  
-        ))
-    return SimpleSearchResponse(products=products)
+            matched = await semantic_match(req.query, snapshot.df, filtered, query_embedding=query_embedding)
+    record_candidates("semantic_match", len(matched))
 
+    # Add sentiment scores
+    with stage("sentiment"):
+        matched = await compute_sentiment_score(matched)
 
-@app.post("/recommend", response_model=RecommendationResponse)
-async def recommend_product(req: RecommendationRequest):
-    try:
-        result = chain.invoke({'query': req.query,'subcategory':CategoriesSubcategories})
-        filters = format_output(result)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Query parsing failed: {str(e)}")
-
-    df = await load_products_from_db()
-    filtered = filter_dataset(df, filters)
-
-    if filtered.empty:
-        relaxed_filters = {
-            "product_type": filters.get("product_type"),
-            "price_max": None,
-            "price_min": None,
-            "use_case": None,
-            "recipient": None,
-            "must_have_features": [],
-            "brand_preference": None,
-            "avoid_features": [],
-            "urgency": None,
-        }
-        filtered = filter_dataset(df, relaxed_filters)
-        if filtered.empty:
-            raise HTTPException(status_code=404, detail="No matching products found")
+    # Sort based on availability
+    matched = order_for_display(matched)
 
-    matched = semantic_match(req.query, filtered)
-    matched = compute_sentiment_score(matched)
+    body = orjson.dumps({"products": product_records(matched)})
+    if cache_key is not None:
+        await response_cache.put(cache_key, body)
+    return Response(body, media_type="application/json")
 
-    product_subset_columns = ['title', 'description', 'rating', 'sentiment_score', 'similarity_score', 'sold', 'price']
-    available_columns = [col for col in product_subset_columns if col in matched.columns]
-    product_subset = matched[available_columns]
-    product_data_str = product_subset.to_string(index=True)
 
+async def _prepare_batch(queries: List[str]):
+    """Query embeddings (one call) and extracted keywords (one LLM batch) for a chunk."""
     try:
-        ranking_response = ranking_chain.invoke({"query": req.query, "product_data": product_data_str})
-        idx = ranking_response.best_product_index
-        if not (0 <= idx < len(matched)):
-            raise Exception("Invalid index")
-        top_product = matched.iloc[idx]
-        reasoning = ranking_response.reasoning
+        with stage("embed_query"):
+            query_embeddings = await (await text_embedder.aget()).aembed_documents(queries)
     except Exception:
-        if 'sold' in matched.columns:
-            matched['normalized_sales'] = (matched['sold'] - matched['sold'].min()) / (matched['sold'].max() - matched['sold'].min() + 1e-5)
-            matched['combined_score'] = 0.7 * matched['similarity_score'] + 0.3 * matched['normalized_sales']
-        else:
-            matched['combined_score'] = matched['similarity_score']
-        top_product = matched.sort_values(by='combined_score', ascending=False).iloc[0]
-        reasoning = "Fallback: Based on similarity and sales performance"
+        query_embeddings = None
+    with stage("extract_keywords"):
+        keywords = await extract_keywords_batch(
+            queries, query_embeddings if keyword_cache.similarity_threshold > 0 else None)
+    return query_embeddings, keywords
+
+async def _search_chunk(snapshot, queries: List[str], query_embeddings, keywords) -> List[dict]:
+    results = [{"query": query} for query in queries]
+    row_sets, matched_for = [], []
+    with stage("filter"):
+        for i, result in enumerate(keywords):
+            if isinstance(result, Exception):
+                results[i]["error"] = f"Query parsing failed: {str(result)}"
+                continue
+            rows = filter_dataset(snapshot, format_output(result))
+            record_candidates("filter", len(rows))
+            if len(rows) == 0:
+                results[i]["products"] = []
+                continue
+            row_sets.append(rows)
+            matched_for.append(i)
+
+    embeddings = None
+    if query_embeddings is not None:
+        embeddings = [query_embeddings[i] for i in matched_for]
+    with stage("semantic_match"):
+        matches = await semantic_match_batch(snapshot.df, row_sets, embeddings)
+
+    # One sentiment pass over every distinct product in the chunk's results
+    if matches:
+        with stage("sentiment"):
+            combined = pd.concat(matches, ignore_index=True).drop_duplicates('_id').reset_index(drop=True)
+            combined = await compute_sentiment_score(combined)
+            sentiment = pd.Series(combined['sentiment_score'].to_numpy(), index=combined['_id'])
+        for i, matched in zip(matched_for, matches):
+            matched['sentiment_score'] = sentiment.reindex(matched['_id']).to_numpy()
+            results[i]["products"] = product_records(order_for_display(matched))
+    return results
+
+@app.post("/simple-search/batch")
+async def simple_search_batch(req: BatchSearchRequest):
+    """Many /simple-search queries in one call, streamed back as NDJSON.
+
+    Each line is `{"index", "query", "products"}` (or `"error"` in place of
+    products) and lines arrive in input order. Queries are processed in
+    chunks: keyword extraction and query embedding are batched calls, and
+    the next chunk's are already running while the current one is scored.
+    """
+    if len(req.queries) > BATCH_SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_SEARCH_MAX_QUERIES} queries per batch")
+    snapshot = await load_catalog()
+    chunks = [req.queries[start:start + BATCH_SEARCH_CHUNK_SIZE]
+              for start in range(0, len(req.queries), BATCH_SEARCH_CHUNK_SIZE)]
+
+    async def stream():
+        index = 0
+        prepared = asyncio.create_task(_prepare_batch(chunks[0])) if chunks else None
+        try:
+            for position, chunk in enumerate(chunks):
+                query_embeddings, keywords = await prepared
+                if position + 1 < len(chunks):
+                    prepared = asyncio.create_task(_prepare_batch(chunks[position + 1]))
+                for result in await _search_chunk(snapshot, chunk, query_embeddings, keywords):
+                    yield orjson.dumps({"index": index, **result}) + b"\n"
+                    index += 1
+        finally:
+            # The client went away mid-stream; don't leave an extraction running
+            if prepared is not None and not prepared.done():
+                prepared.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def rank_with_llm(query: str, matched: pd.DataFrame):
+    """The LLM's pick as (position in `matched`, reasoning); raises on an out-of-range answer."""
+    product_subset_columns = ['title', 'description', 'rating', 'sentiment_score', 'similarity_score', 'sold', 'price']
+    available_columns = [col for col in product_subset_columns if col in matched.columns]
+    product_data_str = matched[available_columns].to_string(index=True)
+    ranking_response = await (await ranking_chain()).ainvoke({"query": query, "product_data": product_data_str})
+    idx = ranking_response.best_product_index
+    if not (0 <= idx < len(matched)):
+        raise ValueError("Invalid index")
+    return idx, ranking_response.reasoning
 
 
+def recommendation_response(top_product: pd.Series, reasoning: str, ranker: str) -> RecommendationResponse:
     return RecommendationResponse(
         title=top_product['title'],
         price=top_product['price'],
@@ -710,5 +1005,73 @@ async def recommend_product(req: RecommendationRequest):
         sentiment_score=top_product.get('sentiment_score', 0.0),
         sold=top_product.get('sold', 0),
         reasoning=reasoning,
-        images=top_product.get('images', []) 
+        images=top_product.get('images', []),
+        ranker=ranker,
     )
+
+
+def cache_late_ranking(task: asyncio.Task, cache_key: str, matched: pd.DataFrame) -> None:
+    if task.cancelled() or task.exception() is not None:
+        return
+    idx, reasoning = task.result()
+    body = orjson.dumps(recommendation_response(matched.iloc[idx], reasoning, "llm").model_dump())
+    asyncio.get_running_loop().create_task(response_cache.put(cache_key, body))
+
+
+@app.post("/recommend", response_model=RecommendationResponse)
+async def recommend_product(req: RecommendationRequest):
+    try:
+        with stage("embed_query"):
+            query_embedding = await embed_query_for_cache(req.query)
+        with stage("extract_keywords"):
+            result = await extract_keywords(req.query, query_embedding)
+        filters = format_output(result)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Query parsing failed: {str(e)}")
+
+    with stage("load_catalog"):
+        snapshot = await load_catalog()
+    with stage("response_cache"):
+        cache_key, body = await cached_response("recommend", filters, req.query, query_embedding, snapshot)
+    if body is not None:
+        return Response(body, media_type="application/json")
+    with stage("filter"):
+        filtered = filter_dataset(snapshot, filters)
+    record_candidates("filter", len(filtered))
+    if len(filtered) == 0:
+        raise HTTPException(status_code=404, detail="No matching products found")
+
+    with stage("semantic_match"):
+        matched = await semantic_match(req.query, snapshot.df, filtered, query_embedding=query_embedding)
+    record_candidates("semantic_match", len(matched))
+    with stage("sentiment"):
+        matched = await compute_sentiment_score(matched)
+
+    # The local pick is ready immediately; the LLM has until the deadline to answer
+    local_idx = local_pick(matched, filters)
+    llm_idx = reasoning = None
+    if RANKING_DEADLINE_SECONDS > 0:
+        llm_task = asyncio.create_task(rank_with_llm(req.query, matched))
+        try:
+            with stage("rank"):
+                llm_idx, reasoning = await asyncio.wait_for(asyncio.shield(llm_task), RANKING_DEADLINE_SECONDS)
+        except asyncio.TimeoutError:
+            if cache_key is not None:
+                # Let it finish anyway so the next identical query gets its answer from the cache
+                llm_task.add_done_callback(lambda task: cache_late_ranking(task, cache_key, matched))
+            else:
+                llm_task.cancel()
+        except Exception:
+            pass
+
+    if llm_idx is not None:
+        response = recommendation_response(matched.iloc[llm_idx], reasoning, "llm")
+    else:
+        response = recommendation_response(
+            matched.iloc[local_idx], "Best combination of relevance, rating, review sentiment, sales and price fit",
+            "local")
+    record_ranker(response.ranker)
+    # Local picks are not cached, so the next request gives the LLM another chance
+    if cache_key is not None and response.ranker == "llm":
+        await response_cache.put(cache_key, orjson.dumps(response.model_dump()))
+    return response
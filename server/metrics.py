@@ -0,0 +1,187 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Send "X-Timing: 1" on a request to get its per-stage breakdown back in a
+# Server-Timing header; set to "1" to add it to every response
+TIMING_HEADER_ALWAYS = os.getenv("TIMING_HEADER_ALWAYS", "0") == "1"
+
+_INF_LABEL = 'le="+Inf"'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000, 100000)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts, +Inf count, sum)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            if position < len(self.buckets):
+                series[0][position] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, value_sum) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, _INF_LABEL)} {total}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {value_sum}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collectors that report current values at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        # name -> (type, help, callback returning [(labels dict, value)])
+        self._collectors: Dict[str, Tuple[str, str, Callable[[], Iterable[Tuple[dict, float]]]]] = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, kind: str, help_text: str,
+                  callback: Callable[[], Iterable[Tuple[dict, float]]]) -> None:
+        self._collectors[name] = (kind, help_text, callback)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, (kind, help_text, callback) in self._collectors.items():
+            try:
+                samples = list(callback())
+            except Exception:
+                continue
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "End-to-end request latency.", ("method", "path", "status")))
+stage_seconds = registry.register(Histogram(
+    "search_stage_duration_seconds", "Time spent in each stage of a search request.", ("endpoint", "stage")))
+candidate_rows = registry.register(Histogram(
+    "search_candidate_rows", "Candidate-set size after each stage of a search request.", ("endpoint", "stage"),
+    buckets=SIZE_BUCKETS))
+cache_lookups = registry.register(Counter(
+    "search_cache_lookups_total", "Cache lookups made while serving requests, by outcome.", ("cache", "result")))
+inference_batch_size = registry.register(Histogram(
+    "inference_batch_size", "Inputs per batched model call.", ("model",), buckets=BATCH_BUCKETS))
+inference_queue_wait = registry.register(Histogram(
+    "inference_queue_wait_seconds", "Time an input waited to join a model batch.", ("model",)))
+ranker_choices = registry.register(Counter(
+    "recommend_ranker_total", "Which ranker produced each /recommend answer.", ("ranker",)))
+
+
+class RequestTimings:
+    """Stage durations of one request, in the order they ran."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: List[Tuple[str, float]] = []
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages)
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def begin_request(endpoint: str) -> RequestTimings:
+    timings = RequestTimings(endpoint)
+    _current.set(timings)
+    return timings
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request."""
+    timings = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        endpoint = timings.endpoint if timings is not None else ""
+        stage_seconds.observe(elapsed, endpoint=endpoint, stage=name)
+        if timings is not None:
+            timings.stages.append((name, elapsed))
+
+
+def record_candidates(stage_name: str, count: int) -> None:
+    timings = _current.get()
+    candidate_rows.observe(count, endpoint=timings.endpoint if timings is not None else "", stage=stage_name)
+
+
+def record_cache(cache: str, result: str, count: int = 1) -> None:
+    if count:
+        cache_lookups.inc(count, cache=cache, result=result)
+
+
+def record_ranker(ranker: str) -> None:
+    ranker_choices.inc(ranker=ranker)
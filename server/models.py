@@ -0,0 +1,241 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+from executor import model_pool
+
+logger = logging.getLogger(__name__)
+
+# Load every model in the background right after startup; with "0" each
+# one is only loaded by the first request that needs it
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+TEXT_EMBEDDING_MODEL = os.getenv("TEXT_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
+# How CLIP and DistilBERT run: "torch"; "int8" for dynamically quantized
+# Linear layers (CPU only); or "onnx" for ONNX Runtime, which needs
+# onnxruntime, plus optimum for DistilBERT
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", os.path.join(os.getenv("CACHE_DIR", "cache"), "onnx"))
+
+
+class LazyModel:
+    """A model or client that is built on first use instead of at import.
+
+    `get()` blocks while the model loads, so call it from a worker thread;
+    `aget()` does that for async callers. Loading happens at most once even
+    if several requests ask for the model at the same time, and a failed
+    load is retried on the next call.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self.state = "not_loaded"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self) -> Any:
+        if self.ready:
+            return self._value
+        with self._lock:
+            if not self.ready:
+                self.state = "loading"
+                started = time.monotonic()
+                try:
+                    self._value = self._loader()
+                except Exception as e:
+                    self.state, self.error = "failed", str(e)
+                    raise
+                self.state, self.error = "ready", None
+                self.load_seconds = round(time.monotonic() - started, 3)
+        return self._value
+
+    def override(self, value: Any) -> None:
+        """Use an already-built stand-in instead of loading (benchmarks, local runs)."""
+        with self._lock:
+            self._value = value
+            self.state, self.error, self.load_seconds = "ready", None, 0.0
+
+    async def aget(self) -> Any:
+        if self.ready:
+            return self._value
+        return await model_pool.run(self.get)
+
+    def status(self) -> dict:
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+
+def _onnx_dir(model_name: str) -> str:
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "--"))
+
+
+def _quantize_int8(model):
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class ClipEncoder:
+    """CLIP image and text towers on the best available device."""
+
+    def __init__(self, model_name: str = CLIP_MODEL_NAME, backend: str = INFERENCE_BACKEND):
+        import torch
+        from transformers import CLIPModel, CLIPProcessor
+
+        self._torch = torch
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = CLIPModel.from_pretrained(model_name).to(self.device)
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+        self.backend = "torch"
+        if backend == "int8" and self.device == "cpu":
+            self.model = _quantize_int8(self.model)
+            self.backend = "int8"
+
+    def embed_images(self, images: List):
+        inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+        with self._torch.no_grad():
+            emb = self.model.get_image_features(**inputs)
+        return emb.cpu().numpy()
+
+    def embed_texts(self, texts: List[str]):
+        inputs = self.processor(text=texts, return_tensors="pt", padding=True).to(self.device)
+        with self._torch.no_grad():
+            emb = self.model.get_text_features(**inputs)
+        return emb.cpu().numpy()
+
+
+class OnnxClipEncoder(ClipEncoder):
+    """CLIP towers exported once to ONNX and run with ONNX Runtime.
+
+    Only the processor is loaded alongside the sessions; the torch model
+    is loaded just to export, the first time.
+    """
+
+    def __init__(self, model_name: str = CLIP_MODEL_NAME):
+        import onnxruntime as ort
+        from transformers import CLIPProcessor
+
+        self.device = "cpu"
+        self.model = None
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+        self.backend = "onnx"
+        directory = _onnx_dir(model_name)
+        image_path, text_path = os.path.join(directory, "image.onnx"), os.path.join(directory, "text.onnx")
+        if not (os.path.exists(image_path) and os.path.exists(text_path)):
+            self._export(model_name, directory, image_path, text_path)
+        self._image_session = ort.InferenceSession(image_path, providers=["CPUExecutionProvider"])
+        self._text_session = ort.InferenceSession(text_path, providers=["CPUExecutionProvider"])
+
+    def _export(self, model_name: str, directory: str, image_path: str, text_path: str) -> None:
+        import torch
+        from transformers import CLIPModel
+
+        model = CLIPModel.from_pretrained(model_name).eval()
+
+        class ImageTower(torch.nn.Module):
+            def forward(self, pixel_values):
+                return model.get_image_features(pixel_values=pixel_values)
+
+        class TextTower(torch.nn.Module):
+            def forward(self, input_ids, attention_mask):
+                return model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+        os.makedirs(directory, exist_ok=True)
+        size = self.processor.image_processor.crop_size["height"]
+        tokens = self.processor(text=["a photo"], return_tensors="pt", padding=True)
+        logger.info("Exporting %s to ONNX in %s", model_name, directory)
+        # Written under a temporary name so a half-finished export is never loaded
+        torch.onnx.export(ImageTower(), (torch.zeros(1, 3, size, size),), image_path + ".tmp",
+                          input_names=["pixel_values"], output_names=["embeds"],
+                          dynamic_axes={"pixel_values": {0: "batch"}, "embeds": {0: "batch"}}, opset_version=17)
+        torch.onnx.export(TextTower(), (tokens["input_ids"], tokens["attention_mask"]), text_path + ".tmp",
+                          input_names=["input_ids", "attention_mask"], output_names=["embeds"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                        "attention_mask": {0: "batch", 1: "sequence"}, "embeds": {0: "batch"}},
+                          opset_version=17)
+        os.replace(image_path + ".tmp", image_path)
+        os.replace(text_path + ".tmp", text_path)
+
+    def embed_images(self, images: List):
+        inputs = self.processor(images=images, return_tensors="np")
+        return self._image_session.run(None, {"pixel_values": inputs["pixel_values"].astype(np.float32)})[0]
+
+    def embed_texts(self, texts: List[str]):
+        inputs = self.processor(text=texts, return_tensors="np", padding=True)
+        return self._text_session.run(None, {"input_ids": inputs["input_ids"].astype(np.int64),
+                                             "attention_mask": inputs["attention_mask"].astype(np.int64)})[0]
+
+
+def load_clip_encoder():
+    """CLIP on the configured INFERENCE_BACKEND."""
+    if INFERENCE_BACKEND == "onnx":
+        return OnnxClipEncoder()
+    return ClipEncoder()
+
+
+def _load_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=LLM_MODEL)
+
+
+def _load_text_embedder():
+    from langchain_huggingface import HuggingFaceEndpointEmbeddings
+    return HuggingFaceEndpointEmbeddings(
+        repo_id=TEXT_EMBEDDING_MODEL,
+        task="feature-extraction",
+        huggingfacehub_api_token=os.getenv("HF_TOKEN"),
+    )
+
+
+def _load_sentiment():
+    from transformers import pipeline
+    from sentiment import SENTIMENT_MODEL
+
+    if INFERENCE_BACKEND == "onnx":
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        directory = _onnx_dir(SENTIMENT_MODEL)
+        if os.path.exists(os.path.join(directory, "model.onnx")):
+            model = ORTModelForSequenceClassification.from_pretrained(directory)
+        else:
+            model = ORTModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL, export=True)
+            model.save_pretrained(directory)
+        return pipeline("sentiment-analysis", model=model, tokenizer=AutoTokenizer.from_pretrained(SENTIMENT_MODEL))
+
+    classifier = pipeline("sentiment-analysis", model=SENTIMENT_MODEL)
+    if INFERENCE_BACKEND == "int8" and classifier.device.type == "cpu":
+        classifier.model = _quantize_int8(classifier.model)
+    return classifier
+
+
+llm = LazyModel("llm", _load_llm)
+text_embedder = LazyModel("text_embedder", _load_text_embedder)
+sentiment_classifier = LazyModel("sentiment", _load_sentiment)
+clip = LazyModel("clip", load_clip_encoder)
+
+MODELS = (llm, text_embedder, sentiment_classifier, clip)
+
+
+async def warm_up() -> None:
+    """Load every model one after another without blocking requests."""
+    for lazy in MODELS:
+        try:
+            await lazy.aget()
+            logger.info("Loaded %s in %ss", lazy.name, lazy.load_seconds)
+        except Exception as e:
+            logger.error("Failed to load %s: %s", lazy.name, e)
+
+
+def model_status() -> dict:
+    return {lazy.name: lazy.status() for lazy in MODELS}
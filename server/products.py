@@ -1,18 +1,110 @@
 # products.py
-from fastapi import APIRouter
+import os
+import json
+import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 from database import db
 
 router = APIRouter()
 
+PRODUCTS_MAX_PAGE_SIZE = int(os.getenv("PRODUCTS_MAX_PAGE_SIZE", "1000"))
+# Documents Mongo returns per round trip while streaming a listing
+PRODUCTS_STREAM_BATCH_SIZE = int(os.getenv("PRODUCTS_STREAM_BATCH_SIZE", "500"))
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _dumps(product: dict) -> str:
+    product["_id"] = str(product["_id"])  # convert ObjectId to string
+    return json.dumps(product, default=_json_default)
+
+
+def _build_query(after: Optional[str], category: Optional[str], price_min: Optional[float],
+                 price_max: Optional[float]) -> dict:
+    query = {}
+    if after:
+        query["_id"] = {"$gt": ObjectId(after) if ObjectId.is_valid(after) else after}
+    if category:
+        query["category"] = category
+    price = {}
+    if price_min is not None:
+        price["$gte"] = price_min
+    if price_max is not None:
+        price["$lte"] = price_max
+    if price:
+        query["price"] = price
+    return query
+
+
+def _field_names(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(",") if name.strip()] or None
+
+
+async def _stream(cursor, ndjson: bool):
+    if not ndjson:
+        yield "["
+    first = True
+    async for product in cursor:
+        if ndjson:
+            yield _dumps(product) + "\n"
+        else:
+            yield ("" if first else ",") + _dumps(product)
+        first = False
+    if not ndjson:
+        yield "]"
+
+
 @router.get("/products")
-async def get_products():
+async def get_products(
+    limit: Optional[int] = Query(None, ge=1, description="Page size; omit to list every product"),
+    after: Optional[str] = Query(None, description="Return products after this _id (the X-Next-Cursor of the previous page)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return; _id is always included. "
+                                                   "Defaults to the listing fields (database.ListingProduct)"),
+    category: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Products ordered by `_id`, filtered and projected in Mongo.
+
+    With `limit`, returns one page and puts the `_id` to pass as `after`
+    for the next one in the `X-Next-Cursor` header (absent on the last
+    page). Without it, the whole listing is streamed from the cursor, so
+    memory stays bounded however large the catalog is. `format=ndjson`
+    writes one product per line instead of a JSON array.
+    """
     # Ensure database connection
     if db.db is None:
         await db.connect()
-    
-    cursor = db.products.find()
-    products = []
-    async for product in cursor:
-        product["_id"] = str(product["_id"])  # convert ObjectId to string
-        products.append(product)
-    return products
\ No newline at end of file
+
+    ndjson = format == "ndjson"
+    media_type = "application/x-ndjson" if ndjson else "application/json"
+    query = _build_query(after, category, price_min, price_max)
+    cursor = db.listing(query, _field_names(fields)).sort("_id", 1)
+
+    if limit is None:
+        return StreamingResponse(_stream(cursor.batch_size(PRODUCTS_STREAM_BATCH_SIZE), ndjson), media_type=media_type)
+
+    if limit > PRODUCTS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be at most {PRODUCTS_MAX_PAGE_SIZE}")
+    page = await cursor.limit(limit + 1).to_list(length=limit + 1)
+    headers = {}
+    if len(page) > limit:
+        page = page[:limit]
+        headers["X-Next-Cursor"] = str(page[-1]["_id"])
+
+    if ndjson:
+        body = "".join(_dumps(product) + "\n" for product in page)
+    else:
+        body = "[" + ",".join(_dumps(product) for product in page) + "]"
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,63 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from search_index import as_number
+
+# How long /recommend waits for the LLM ranking before answering with the
+# local scorer's pick; 0 skips the LLM entirely
+RANKING_DEADLINE_SECONDS = float(os.getenv("RANKING_DEADLINE_SECONDS", "2.5"))
+
+# Weights of the local scorer; each signal is scaled to [0, 1] first
+LOCAL_RANKING_WEIGHTS = {
+    "similarity": 0.35,
+    "rating": 0.2,
+    "sentiment": 0.15,
+    "sales": 0.2,
+    "price_fit": 0.1,
+}
+
+
+def _numeric(matched: pd.DataFrame, column: str) -> np.ndarray:
+    if column not in matched.columns:
+        return np.zeros(len(matched))
+    return pd.to_numeric(matched[column], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min() if len(values) else 0
+    return (values - values.min()) / spread if spread > 0 else np.ones(len(values))
+
+
+def price_fit(prices: np.ndarray, price_min: Optional[float], price_max: Optional[float]) -> np.ndarray:
+    """1 inside the requested price range, falling off with relative distance outside it."""
+    fit = np.ones(len(prices))
+    if price_max:
+        over = prices > price_max
+        fit[over] = np.clip(1 - (prices[over] - price_max) / price_max, 0, 1)
+    if price_min:
+        under = prices < price_min
+        fit[under] = np.clip(1 - (price_min - prices[under]) / price_min, 0, 1)
+    return fit
+
+
+def local_scores(matched: pd.DataFrame, filters: dict) -> np.ndarray:
+    """Weighted score of each candidate from similarity, rating, sentiment, sales and price fit."""
+    if matched.empty:
+        return np.zeros(0)
+    signals = {
+        "similarity": np.clip(_numeric(matched, 'similarity_score'), 0, 1),
+        "rating": np.clip(_numeric(matched, 'rating') / 5, 0, 1),
+        "sentiment": np.clip(_numeric(matched, 'sentiment_score') / 100, 0, 1),
+        "sales": _min_max(_numeric(matched, 'sold')),
+        "price_fit": price_fit(_numeric(matched, 'price'), as_number(filters.get('price_min')),
+                               as_number(filters.get('price_max'))),
+    }
+    return sum(LOCAL_RANKING_WEIGHTS[name] * values for name, values in signals.items())
+
+
+def local_pick(matched: pd.DataFrame, filters: dict) -> int:
+    """Position in `matched` of the local scorer's best product."""
+    return int(np.argmax(local_scores(matched, filters)))
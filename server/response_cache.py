@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from keyword_cache import normalize_query
+from vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# Memory bound of the in-process cache, in bytes of cached response bodies; 0 disables it
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 2 ** 20)))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+# Sign bits of random projections that make up a query-embedding bucket;
+# fewer bits put more (less similar) phrasings in the same bucket
+RESPONSE_CACHE_BUCKET_BITS = int(os.getenv("RESPONSE_CACHE_BUCKET_BITS", "16"))
+# e.g. redis://localhost:6379/0, so every uvicorn worker shares hits
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL", "")
+_PROJECTION_SEED = 20240101
+
+
+def canonical_filters(filters: dict) -> str:
+    """`format_output()` filters as a stable string: case, whitespace and list order do not matter."""
+    canonical = {}
+    for name, value in filters.items():
+        if isinstance(value, str):
+            value = " ".join(value.lower().split()) or None
+        elif isinstance(value, (list, tuple)):
+            value = sorted(" ".join(str(item).lower().split()) for item in value)
+        canonical[name] = value
+    return json.dumps(canonical, sort_keys=True, default=str)
+
+
+class ResponseCache:
+    """Full search responses keyed by filters, query-embedding bucket and catalog.
+
+    Keys contain the catalog snapshot's fingerprint, so a catalog change
+    makes every older entry unreachable; the local entries are also
+    dropped right away to free memory. Values are the encoded response
+    bodies, which is what the byte bound counts. With a Redis URL set,
+    misses fall through to Redis and fills are written to both.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 bucket_bits: int = RESPONSE_CACHE_BUCKET_BITS, redis_url: str = RESPONSE_CACHE_REDIS_URL):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bucket_bits = bucket_bits
+        self.redis_url = redis_url
+        self._redis = None
+        self._projection = None
+        # key -> (expires_at, body)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or bool(self.redis_url)
+
+    def _bucket(self, query: str, query_embedding) -> str:
+        if query_embedding is None or self.bucket_bits <= 0:
+            return "q:" + hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()[:16]
+        vector = normalize_rows(np.asarray([query_embedding], dtype=np.float32))[0]
+        if self._projection is None or self._projection.shape[0] != vector.shape[0]:
+            # Seeded, so every worker draws the same hyperplanes
+            rng = np.random.default_rng(_PROJECTION_SEED)
+            self._projection = rng.standard_normal((vector.shape[0], self.bucket_bits)).astype(np.float32)
+        bits = (vector @ self._projection) >= 0
+        return "e:" + np.packbits(bits).tobytes().hex()
+
+    def key(self, endpoint: str, filters: dict, query: str, query_embedding, catalog_fingerprint: str) -> str:
+        filters_hash = hashlib.sha1(canonical_filters(filters).encode("utf-8")).hexdigest()[:16]
+        return f"search:{endpoint}:{catalog_fingerprint}:{filters_hash}:{self._bucket(query, query_embedding)}"
+
+    def _client(self):
+        if self._redis is None and self.redis_url:
+            import redis.asyncio as redis
+            self._redis = redis.from_url(self.redis_url)
+        return self._redis
+
+    def _store_local(self, key: str, body: bytes) -> None:
+        if self.max_bytes <= 0 or len(body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[1])
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, body)
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key)
+            self._bytes -= len(entry[1])
+
+        client = self._client()
+        if client is not None:
+            try:
+                body = await client.get(key)
+            except Exception as e:
+                logger.warning("Shared response cache unavailable: %s", e)
+                body = None
+            if body is not None:
+                self._store_local(key, body)
+                self.shared_hits += 1
+                return body
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, body: bytes) -> None:
+        self._store_local(key, body)
+        client = self._client()
+        if client is not None:
+            try:
+                await client.set(key, body, ex=max(1, int(self.ttl_seconds)))
+            except Exception as e:
+                logger.warning("Shared response cache unavailable: %s", e)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    async def on_catalog_change(self, snapshot) -> None:
+        # Entries for the previous fingerprint can never be hit again
+        self.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "shared": bool(self.redis_url),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Create a global instance
+response_cache = ResponseCache()
@@ -0,0 +1,284 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Fields filter predicates look at
+INDEXED_FIELDS = ('title', 'description', 'category', 'tags')
+# Numeric columns kept in sorted order for range and top-N predicates
+NUMERIC_FIELDS = ('price', 'sold', 'rating')
+# How many best sellers an "urgent" query is narrowed to
+URGENT_TOP_N = 20
+# Distinct terms remembered per field before the lookup cache is reset
+TERM_CACHE_SIZE = 10000
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def _field_text(value) -> str:
+    if isinstance(value, list):
+        return ' '.join(str(v) for v in value)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    return str(value)
+
+
+def as_number(value) -> Optional[float]:
+    """A filter bound as a float; the LLM returns prices as strings like "2,000"."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+class NumericIndex:
+    """One numeric column sorted once per snapshot.
+
+    Range predicates become two binary searches over `sorted_values` and
+    "top N by value" is a prefix of `descending`. `rank[row]` is the row's
+    position in ascending order, so the same predicates can be applied to
+    an arbitrary candidate set without touching the column again. Missing
+    values sort last and never satisfy a bound, like a pandas comparison.
+    """
+
+    def __init__(self, values):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+        self.order = np.argsort(values, kind='stable')
+        self.sorted_values = values[self.order]
+        self.valid = int(np.count_nonzero(~np.isnan(values)))
+        self.rank = np.empty(len(values), dtype=np.int64)
+        self.rank[self.order] = np.arange(len(values))
+        # Descending with ties in catalog order; missing values stay at the end
+        self.descending = np.argsort(-np.where(np.isnan(values), -np.inf, values), kind='stable')
+        self._descending_rank = np.empty(len(values), dtype=np.int64)
+        self._descending_rank[self.descending] = np.arange(len(values))
+
+    def rank_bounds(self, low: Optional[float], high: Optional[float]) -> Tuple[int, int]:
+        """Ascending ranks `[start, stop)` of values within `low <= value <= high`."""
+        valid_values = self.sorted_values[:self.valid]
+        start = int(np.searchsorted(valid_values, low, side='left')) if low is not None else 0
+        stop = int(np.searchsorted(valid_values, high, side='right')) if high is not None else self.valid
+        return start, max(start, stop)
+
+    def rows_between(self, low: Optional[float], high: Optional[float], within: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sorted rows (optionally restricted to `within`) with a value in `[low, high]`."""
+        start, stop = self.rank_bounds(low, high)
+        if within is None:
+            return np.sort(self.order[start:stop])
+        ranks = self.rank[within]
+        return within[(ranks >= start) & (ranks < stop)]
+
+    def top(self, n: int, within: Optional[np.ndarray] = None) -> np.ndarray:
+        """The `n` rows (optionally among `within`) with the largest values, largest first."""
+        if within is None:
+            return self.descending[:n]
+        ranks = self._descending_rank[within]
+        if len(ranks) > n:
+            picked = np.argpartition(ranks, n)[:n]
+            return within[picked[np.argsort(ranks[picked])]]
+        return within[np.argsort(ranks)]
+
+
+class PackedStrings:
+    """Strings stored as one UTF-8 blob plus row offsets.
+
+    Two flat arrays instead of a list of str objects, so a shared segment
+    maps them (see shared_state) rather than unpickling every string into
+    each worker. Substring search scans the blob directly; strings are
+    separated by NUL, so a match never spans two of them.
+    """
+
+    _SEPARATOR = b"\0"
+
+    def __init__(self, strings: List[str]):
+        encoded = [s.encode("utf-8") + self._SEPARATOR for s in strings]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=self.offsets[1:])
+        self.blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1].tobytes().decode("utf-8")
+
+    def containing(self, needle: str) -> np.ndarray:
+        """Sorted positions of the strings that contain `needle`."""
+        pattern = re.compile(re.escape(needle.encode("utf-8")))
+        starts = np.fromiter((match.start() for match in pattern.finditer(memoryview(self.blob))), dtype=np.int64)
+        if len(starts) == 0:
+            return _EMPTY
+        return np.unique(np.searchsorted(self.offsets, starts, side='right') - 1)
+
+
+class Postings:
+    """Token -> sorted row positions for one field, as flat arrays.
+
+    Tokens are a PackedStrings vocabulary; token i's rows are
+    `rows[starts[i]:starts[i + 1]]`. Like PackedStrings, this keeps a
+    field's postings mappable instead of one small array per token.
+    """
+
+    def __init__(self, postings: Dict[str, list]):
+        tokens = list(postings)
+        self.vocab = PackedStrings(tokens)
+        self.starts = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(postings[token]) for token in tokens], out=self.starts[1:])
+        self.rows = (np.concatenate([np.asarray(postings[token], dtype=np.int64) for token in tokens])
+                     if tokens else _EMPTY)
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def rows_with_substring(self, token: str) -> np.ndarray:
+        """Sorted rows with a token containing `token`."""
+        matches = [self.rows[self.starts[i]:self.starts[i + 1]] for i in self.vocab.containing(token)]
+        if not matches:
+            return _EMPTY
+        if len(matches) == 1:
+            return matches[0]
+        return np.unique(np.concatenate(matches))
+
+
+class CatalogIndex:
+    """Inverted index over one catalog snapshot's text fields.
+
+    Each field maps lowercase alphanumeric tokens to sorted arrays of row
+    positions. `rows_containing` keeps the case-insensitive substring
+    semantics filter_dataset always had ("shoe" matches "shoes"): a term
+    is looked up against the field vocabulary rather than every row, and
+    only terms spanning punctuation or spaces are re-checked against the
+    raw text of the candidate rows. Numeric columns get a NumericIndex.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self._texts: Dict[str, PackedStrings] = {}
+        self._postings: Dict[str, Postings] = {}
+        self._term_cache: Dict[str, Dict[str, np.ndarray]] = {}
+        for field in INDEXED_FIELDS:
+            if field not in df.columns:
+                continue
+            texts = [_field_text(value).lower() for value in df[field].tolist()]
+            postings: Dict[str, list] = {}
+            for row, text in enumerate(texts):
+                for token in set(_TOKEN.findall(text)):
+                    postings.setdefault(token, []).append(row)
+            self._texts[field] = PackedStrings(texts)
+            self._postings[field] = Postings(postings)
+            self._term_cache[field] = {}
+        self.numeric: Dict[str, NumericIndex] = {
+            field: NumericIndex(df[field].to_numpy()) for field in NUMERIC_FIELDS if field in df.columns
+        }
+
+    def all_rows(self) -> np.ndarray:
+        return np.arange(self.size, dtype=np.int64)
+
+    def rows_containing(self, field: str, term: str) -> np.ndarray:
+        """Sorted rows whose `field` contains `term`, ignoring case."""
+        if field not in self._postings:
+            return _EMPTY
+        term = term.lower()
+        cache = self._term_cache[field]
+        if term in cache:
+            return cache[term]
+
+        tokens = _TOKEN.findall(term)
+        if not tokens:
+            rows = self._texts[field].containing(term)
+        else:
+            postings = self._postings[field]
+            rows = postings.rows_with_substring(tokens[0])
+            for token in tokens[1:]:
+                if len(rows) == 0:
+                    break
+                rows = np.intersect1d(rows, postings.rows_with_substring(token), assume_unique=True)
+            if tokens != [term] and len(rows):
+                rows = np.intersect1d(rows, self._texts[field].containing(term), assume_unique=True)
+
+        if len(cache) >= TERM_CACHE_SIZE:
+            cache.clear()
+        cache[term] = rows
+        return rows
+
+    def rows_containing_any(self, fields, term: str) -> np.ndarray:
+        """Rows where at least one of `fields` contains `term`."""
+        found = [self.rows_containing(field, term) for field in fields]
+        found = [rows for rows in found if len(rows)]
+        if not found:
+            return _EMPTY
+        return found[0] if len(found) == 1 else np.unique(np.concatenate(found))
+
+
+class FilterPlan:
+    """Evaluates one query's filters against a CatalogIndex.
+
+    The product_type rows are computed once and shared by the strict pass
+    and the relaxed fallback, which keeps only product_type. Every other
+    predicate runs once, narrowing the candidate rows left by the previous
+    one, in the order filter_dataset always applied them.
+    """
+
+    def __init__(self, index: CatalogIndex, filters: dict):
+        self.index = index
+        self.filters = filters
+        self.type_rows = None
+        if filters.get('product_type'):
+            for word in filters['product_type'].lower().split():
+                found = index.rows_containing_any(('title', 'description', 'category'), word)
+                self.type_rows = found if self.type_rows is None else np.intersect1d(self.type_rows, found,
+                                                                                       assume_unique=True)
+        self._strict = None
+
+    def relaxed(self) -> np.ndarray:
+        """Rows matching product_type alone."""
+        return self.index.all_rows() if self.type_rows is None else self.type_rows
+
+    def strict(self) -> np.ndarray:
+        """Rows matching every filter."""
+        if self._strict is not None:
+            return self._strict
+        filters, index = self.filters, self.index
+        rows = self.type_rows
+
+        low, high = as_number(filters.get('price_min')), as_number(filters.get('price_max'))
+        # A bound of 0 never filtered anything before either
+        low, high = low or None, high or None
+        if (low is not None or high is not None) and 'price' in index.numeric:
+            rows = index.numeric['price'].rows_between(low, high, within=rows)
+
+        if filters.get('brand_preference'):
+            brand_rows = index.rows_containing('title', filters['brand_preference'])
+            rows = brand_rows if rows is None else np.intersect1d(rows, brand_rows, assume_unique=True)
+
+        if filters.get('urgency') and "urgent" in filters['urgency'].lower() and 'sold' in index.numeric:
+            rows = index.numeric['sold'].top(URGENT_TOP_N, within=rows)
+
+        if rows is None:
+            rows = index.all_rows()
+        for feature in filters.get('must_have_features') or []:
+            rows = rows[np.isin(rows, index.rows_containing_any(('description', 'tags'), feature))]
+        for avoid in filters.get('avoid_features') or []:
+            rows = rows[~np.isin(rows, index.rows_containing_any(('description', 'tags'), avoid))]
+
+        self._strict = rows
+        return rows
+
+    def rows(self) -> Tuple[np.ndarray, bool]:
+        """Strict rows, or the relaxed rows if nothing matches strictly.
+
+        Also returns whether the filters were relaxed.
+        """
+        rows = self.strict()
+        if len(rows) == 0:
+            return self.relaxed(), True
+        return rows, False
+
+
+def filter_rows(index: CatalogIndex, filters: dict) -> np.ndarray:
+    """Row positions that satisfy every one of `filters`."""
+    return FilterPlan(index, filters).strict()
@@ -0,0 +1,192 @@
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from statistics import mean
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database import db
+
+# Only the first reviews of each product are classified, as before
+REVIEWS_PER_PRODUCT = int(os.getenv("SENTIMENT_REVIEWS_PER_PRODUCT", "10"))
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "64"))
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "200000"))
+SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+
+
+def review_key(review: str) -> str:
+    return hashlib.sha1(str(review).encode("utf-8")).hexdigest()
+
+
+def scored_reviews(reviews) -> Optional[List[str]]:
+    """The reviews a product's score is computed from, or None if it has none."""
+    if not isinstance(reviews, list):
+        return None
+    return [str(review) for review in reviews[:REVIEWS_PER_PRODUCT]]
+
+
+def reviews_digest(reviews) -> str:
+    """Identifies the review set a stored `sentiment_score` was computed from."""
+    reviews = scored_reviews(reviews)
+    if not reviews:
+        return ""
+    return hashlib.sha1("\x1f".join(review_key(r) for r in reviews).encode("utf-8")).hexdigest()
+
+
+class ReviewSentimentCache:
+    """Per-review POSITIVE/NEGATIVE labels keyed by review hash.
+
+    An in-process LRU sits in front of the `review_sentiments` collection,
+    so a review is classified once no matter how many products or requests
+    it shows up in. Used from model_pool threads and the event loop.
+    """
+
+    def __init__(self, max_size: int = SENTIMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._labels: "OrderedDict[str, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bool]:
+        with self._lock:
+            positive = self._labels.get(key)
+            if positive is not None:
+                self._labels.move_to_end(key)
+            return positive
+
+    def put(self, key: str, positive: bool) -> None:
+        with self._lock:
+            self._labels[key] = positive
+            self._labels.move_to_end(key)
+            while len(self._labels) > self.max_size:
+                self._labels.popitem(last=False)
+
+    async def load_from_db(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            missing = [key for key in set(keys) if key not in self._labels]
+        if not missing or db.db is None:
+            return
+        async for doc in db.review_sentiments.find({"_id": {"$in": missing}}):
+            self.put(doc["_id"], doc["positive"])
+
+    async def save_to_db(self, labels: Dict[str, bool]) -> None:
+        if not labels or db.db is None:
+            return
+        await db.review_sentiments.bulk_write(
+            [UpdateOne({"_id": key}, {"$set": {"positive": positive}}, upsert=True) for key, positive in labels.items()],
+            ordered=False,
+        )
+
+
+def score_review_lists(review_lists: List, classify: Callable, cache: ReviewSentimentCache) -> Tuple[List[float], Dict[str, bool]]:
+    """Score many products' reviews with one batched pipeline call.
+
+    Every uncached review across all products goes to `classify` in one
+    call, which pads and runs them in batches of `SENTIMENT_BATCH_SIZE`. Returns each product's percentage of positive
+    reviews (0 when it has none) and the labels that were newly computed.
+    """
+    per_product = [scored_reviews(reviews) for reviews in review_lists]
+
+    # Labels are read from the cache once, up front: storing fresh labels
+    # below can evict them when a call has more reviews than the cache holds
+    known, pending = {}, {}
+    for reviews in per_product:
+        for review in reviews or []:
+            key = review_key(review)
+            if key in known or key in pending:
+                continue
+            positive = cache.get(key)
+            if positive is None:
+                pending[key] = review
+            else:
+                known[key] = positive
+
+    fresh = {}
+    if pending:
+        outputs = classify(list(pending.values()), batch_size=SENTIMENT_BATCH_SIZE, truncation=True)
+        for key, output in zip(pending, outputs):
+            fresh[key] = output['label'] == 'POSITIVE'
+            cache.put(key, fresh[key])
+    known.update(fresh)
+
+    scores = []
+    for reviews in per_product:
+        if not reviews:
+            scores.append(0)
+            continue
+        labels = [known[key] for key in map(review_key, reviews)]
+        scores.append(round(mean([1 if positive else 0 for positive in labels]) * 100, 2))
+    return scores, fresh
+
+
+async def score_product_sentiment(df: pd.DataFrame, classify: Callable,
+                                  cache: ReviewSentimentCache) -> Dict[str, dict]:
+    """`_id -> {sentiment_score, sentiment_reviews_hash}` for every product whose
+    reviews changed since it was last scored."""
+    if 'reviews' not in df.columns or df.empty:
+        return {}
+    digests = df['reviews'].apply(reviews_digest)
+    stored = df['sentiment_reviews_hash'] if 'sentiment_reviews_hash' in df.columns else pd.Series("", index=df.index)
+    stale = df[(digests != stored.fillna("")).to_numpy()]
+    if stale.empty:
+        return {}
+
+    keys = [review_key(r) for reviews in stale['reviews'] for r in (scored_reviews(reviews) or [])]
+    await cache.load_from_db(keys)
+    # Not model_pool: a backfill can take minutes, and the thread mostly waits
+    # on `classify`, which must not hold a worker that live requests need
+    scores, fresh = await asyncio.to_thread(score_review_lists, stale['reviews'].tolist(), classify, cache)
+    await cache.save_to_db(fresh)
+    return {product_id: {"sentiment_score": score, "sentiment_reviews_hash": digest}
+            for product_id, digest, score in zip(stale['_id'], digests[stale.index], scores)}
+
+
+async def save_product_sentiment(updates: Dict[str, dict]) -> None:
+    """Persist scores from score_product_sentiment onto the products.
+
+    `updated_at` is left alone: the running service applies the scores to
+    its snapshot itself (CatalogStore.annotate), and its change stream
+    ignores updates of these fields only.
+    """
+    if not updates:
+        return
+    requests = []
+    for product_id, fields in updates.items():
+        key = ObjectId(product_id) if ObjectId.is_valid(product_id) else product_id
+        requests.append(UpdateOne({"_id": key}, {"$set": fields}))
+    await db.products.bulk_write(requests, ordered=False)
+
+
+async def refresh_product_sentiment(df: pd.DataFrame, classify: Callable, cache: ReviewSentimentCache) -> int:
+    """Score and store `sentiment_score` on every product whose reviews changed.
+
+    Used by the CLI as an offline backfill. Returns the number of products updated.
+    """
+    updates = await score_product_sentiment(df, classify, cache)
+    await save_product_sentiment(updates)
+    return len(updates)
+
+
+# Create a global instance
+review_cache = ReviewSentimentCache()
+
+
+async def _backfill():
+    from transformers import pipeline
+    from catalog import prepare_product
+
+    classify = pipeline("sentiment-analysis", model=SENTIMENT_MODEL)
+    await db.connect()
+    # Only the fields sentiment scoring reads, not the whole catalog
+    df = pd.DataFrame([prepare_product(product) async for product in db.sentiment_sources()])
+    updated = await refresh_product_sentiment(df, classify, review_cache)
+    print(f"✅ Updated sentiment_score on {updated}/{len(df)} products")
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_backfill())
@@ -0,0 +1,224 @@
+import os
+import json
+import mmap
+import time
+import pickle
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so every worker loads on its own
+    fcntl = None
+
+from vector_index import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# "auto": the first uvicorn worker to take the builder lock loads from Mongo
+# and publishes segments, the others map them; "off": every worker loads on its own
+SHARED_STATE_MODE = os.getenv("SHARED_STATE_MODE", "auto")
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", os.path.join(CACHE_DIR, "shared"))
+# How often followers look for a new generation (and for a vacant builder lock)
+SHARED_STATE_POLL_SECONDS = float(os.getenv("SHARED_STATE_POLL_SECONDS", "2"))
+# Arrays smaller than this are pickled inline; mapping them costs more than copying
+SEGMENT_MIN_BUFFER_BYTES = int(os.getenv("SEGMENT_MIN_BUFFER_BYTES", str(64 * 1024)))
+
+_MAGIC = b"SHSEG1\n"
+_ALIGN = 64
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_segment(path: str, value: Any) -> int:
+    """Pickle `value` into a file whose large arrays can be mapped back without copying.
+
+    Uses pickle protocol 5 out-of-band buffers: every contiguous numpy
+    array (DataFrame numeric blocks, embedding matrices, the CatalogIndex
+    text blobs and postings) of at least SEGMENT_MIN_BUFFER_BYTES is
+    written raw and 64-byte aligned after the pickle stream. Python
+    objects, such as the DataFrame's string and list columns, stay in the
+    pickle stream and are copied into each reader. Returns the file size.
+    """
+    buffers = []
+
+    def out_of_band(buffer: pickle.PickleBuffer):
+        if buffer.raw().nbytes < SEGMENT_MIN_BUFFER_BYTES:
+            return True
+        buffers.append(buffer.raw())
+
+    payload = pickle.dumps(value, protocol=5, buffer_callback=out_of_band)
+    layout, offset = [], _aligned(len(payload))
+    for buffer in buffers:
+        layout.append((offset, buffer.nbytes))
+        offset = _aligned(offset + buffer.nbytes)
+    header = json.dumps({"payload": len(payload), "buffers": layout}).encode("utf-8")
+    data_start = _aligned(len(_MAGIC) + 8 + len(header))
+
+    with open(path, "wb") as f:
+        f.write(_MAGIC + len(header).to_bytes(8, "little") + header)
+        f.seek(data_start)
+        f.write(payload)
+        for (buffer_offset, _), buffer in zip(layout, buffers):
+            f.seek(data_start + buffer_offset)
+            f.write(buffer)
+        f.truncate(data_start + offset)
+        return data_start + offset
+
+
+def read_segment(path: str) -> Any:
+    """Load a segment written by `write_segment`.
+
+    Arrays stored out-of-band come back as read-only views into one shared
+    mapping of the file, so every worker attached to a segment shares their
+    pages, and the file stays mapped while they live.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    if bytes(view[:len(_MAGIC)]) != _MAGIC:
+        raise ValueError(f"{path} is not a shared state segment")
+    header_start = len(_MAGIC) + 8
+    header_length = int.from_bytes(view[len(_MAGIC):header_start], "little")
+    header = json.loads(bytes(view[header_start:header_start + header_length]))
+    data_start = _aligned(header_start + header_length)
+    buffers = [view[data_start + offset:data_start + offset + length] for offset, length in header["buffers"]]
+    return pickle.loads(view[data_start:data_start + header["payload"]], buffers=buffers)
+
+
+class SharedSegment:
+    """One named value published in generations.
+
+    Each publish writes `<name>-<generation>.seg` and then atomically
+    replaces the `<name>.current` pointer, so an attaching worker sees
+    either the previous generation or the new one, never a partial file.
+    The generation before the current one is kept for workers that read
+    the pointer just before the swap; older ones are deleted (workers
+    still mapping them keep their pages until they let go).
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.generation: Optional[int] = None
+        self.bytes = 0
+
+    @property
+    def _pointer(self) -> str:
+        return os.path.join(self.directory, f"{self.name}.current")
+
+    def _path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{self.name}-{generation}.seg")
+
+    def publish(self, value: Any) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        generation = time.time_ns()
+        tmp_path = self._path(generation) + ".tmp"
+        self.bytes = write_segment(tmp_path, value)
+        os.replace(tmp_path, self._path(generation))
+        with open(self._pointer + ".tmp", "w") as f:
+            f.write(str(generation))
+        os.replace(self._pointer + ".tmp", self._pointer)
+
+        keep = {self._path(generation)} | ({self._path(self.generation)} if self.generation else set())
+        self.generation = generation
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.startswith(f"{self.name}-") and filename.endswith(".seg") and path not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return generation
+
+    def current_generation(self) -> Optional[int]:
+        try:
+            with open(self._pointer) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def attach(self) -> Optional[Tuple[int, Any]]:
+        """`(generation, value)` if a newer generation than the one attached is published, else None."""
+        generation = self.current_generation()
+        if generation is None or generation == self.generation:
+            return None
+        path = self._path(generation)
+        value = read_segment(path)
+        self.generation, self.bytes = generation, os.path.getsize(path)
+        return generation, value
+
+
+class SharedState:
+    """Decides which worker builds the catalog and embeddings and which ones attach.
+
+    The builder holds an exclusive flock on `builder.lock` for as long as
+    its process lives; the kernel releases it when the process exits, so
+    a follower polling `try_become_builder()` can take over.
+    """
+
+    def __init__(self, directory: str = SHARED_STATE_DIR, mode: str = SHARED_STATE_MODE):
+        self.directory = directory
+        self.enabled = mode == "auto" and fcntl is not None
+        self.role = "standalone"
+        self._lock_file = None
+        self._segments: Dict[str, SharedSegment] = {}
+
+    def try_become_builder(self) -> bool:
+        if not self.enabled:
+            return True
+        if self._lock_file is not None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, "builder.lock"), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            self.role = "follower"
+            return False
+        self._lock_file = lock_file
+        self.role = "builder"
+        return True
+
+    def segment(self, name: str) -> SharedSegment:
+        if name not in self._segments:
+            self._segments[name] = SharedSegment(self.directory, name)
+        return self._segments[name]
+
+    async def publish(self, name: str, value: Any) -> None:
+        """Publish `value` for followers; a no-op unless this worker is the builder."""
+        if self.role != "builder":
+            return
+        try:
+            await asyncio.to_thread(self.segment(name).publish, value)
+        except Exception as e:
+            # Followers keep the previous generation
+            logger.warning("Could not publish shared segment '%s': %s", name, e)
+
+    async def attach(self, name: str) -> Optional[Any]:
+        """The newest published value of `name` if it changed since the last call, else None."""
+        try:
+            attached = await asyncio.to_thread(self.segment(name).attach)
+        except Exception as e:
+            # Usually the builder swapped generations mid-read; next poll retries
+            logger.debug("Could not attach shared segment '%s': %s", name, e)
+            return None
+        return attached[1] if attached is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "role": self.role,
+            "segments": {
+                name: {"generation": segment.generation, "bytes": segment.bytes}
+                for name, segment in self._segments.items()
+            },
+        }
+
+
+# Create a global instance
+shared_state = SharedState()
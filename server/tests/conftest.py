@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Set before the app modules are imported: they read these at import time
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="test-cache-"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("SHARED_STATE_MODE", "off")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+"""End to end: the app starts against the benchmark's offline fakes and serves every search endpoint."""
+import asyncio
+import argparse
+
+import benchmark
+
+
+def test_benchmark_startup_and_endpoints():
+    args = argparse.Namespace(sizes=[200], endpoints=list(benchmark.ENDPOINTS), requests=4, warmup=1, concurrency=2,
+                              llm_latency_ms=0, keyword_cache=False, response_cache=False, image_dim=64, seed=0)
+    rows = asyncio.run(benchmark.run_size(args))
+
+    startup = rows[0]
+    assert startup["endpoint"] == "startup"
+    assert startup["catalog"]["loaded"] and startup["catalog"]["size"] == 200
+    assert startup["image_index"] == 200
+
+    import main as app_main
+    assert app_main.warmup_task.done() and app_main.warmup_task.exception() is None
+    # Scores from the ingest-time sentiment refresh are applied to the snapshot
+    df = app_main.catalog.snapshot.df
+    reviewed = df['reviews'].apply(len) > 0
+    assert reviewed.any() and df.loc[reviewed, 'sentiment_score'].notna().all()
+
+    assert [row["endpoint"] for row in rows[1:]] == list(benchmark.ENDPOINTS)
+    for row in rows[1:]:
+        assert row["requests"] == 4 and row["errors"] == 0, row
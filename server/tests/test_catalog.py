@@ -0,0 +1,55 @@
+import asyncio
+
+import benchmark
+import catalog as catalog_module
+from catalog import CatalogStore
+
+# No updated_at, like the products the app itself writes
+PRODUCTS = [{"_id": "a", "title": "Acme shoes", "price": 999}, {"_id": "b", "title": "Nova shoes", "price": 1500}]
+
+
+def serve(monkeypatch, products):
+    monkeypatch.setattr(catalog_module.db, "db", object())
+    monkeypatch.setattr(catalog_module.db, "catalog_products",
+                        lambda query=None: benchmark.FakeCursor([dict(product) for product in products]))
+
+
+def test_reload_keeps_an_unchanged_snapshot(monkeypatch):
+    serve(monkeypatch, PRODUCTS)
+
+    async def scenario():
+        store, published = CatalogStore(), []
+
+        async def listener(snapshot):
+            published.append(snapshot.version)
+
+        store.add_listener(listener)
+        first = await store.reload()
+        assert await store.reload() is first
+        await store.wait_for_listeners()
+        assert published == [first.version]
+
+    asyncio.run(scenario())
+
+
+def test_polling_without_updated_at_falls_back_to_reloads(monkeypatch):
+    products = [dict(product) for product in PRODUCTS]
+    serve(monkeypatch, products)
+    monkeypatch.setattr(catalog_module, "CATALOG_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(catalog_module, "CATALOG_UNTIMESTAMPED_RELOAD_SECONDS", 0.05)
+
+    async def scenario():
+        store = CatalogStore()
+        first = await store.reload()
+        polling = asyncio.ensure_future(store._poll_updates())
+        products[0]["price"] = 799
+        try:
+            for _ in range(200):
+                if store.snapshot is not first:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            polling.cancel()
+        assert store.snapshot.df.set_index("_id").loc["a", "price"] == 799
+
+    asyncio.run(scenario())
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from embedding_storage import EmbeddingTable, load_shard, save_shard
+
+
+def vector(value):
+    return np.full((1, 4), value, dtype=np.float32)
+
+
+def test_shard_round_trip_is_one_mapping(tmp_path):
+    path = str(tmp_path / "shard.npy")
+    table = EmbeddingTable().merge({"a": ("ha", vector(1)), "b": ("hb", vector(2))})
+    saved = save_shard(path, table, None)
+    loaded, _ = load_shard(path)
+    assert saved.mapped and loaded.mapped
+    assert loaded.ids == ["a", "b"] and loaded.url_hash("b") == "hb"
+    # Every row in order is the mapping itself, not a copy
+    assert loaded.vectors(["a", "b"]) is loaded.matrix
+    np.testing.assert_array_equal(loaded.vectors(["b"]), vector(2))
+
+
+def test_merge_replaces_and_without_drops():
+    table = EmbeddingTable().merge({"a": ("ha", vector(1)), "b": ("hb", vector(2))})
+    table = table.merge({"a": ("ha2", vector(3))}).without(["b"])
+    assert table.ids == ["a"] and table.url_hash("a") == "ha2"
+    np.testing.assert_array_equal(table.matrix, vector(3))
+
+
+def test_mapped_generations_that_cannot_be_removed_are_left(tmp_path, monkeypatch):
+    path = str(tmp_path / "shard.npy")
+    save_shard(path, EmbeddingTable().merge({"a": ("ha", vector(1))}), None)
+
+    def refuse(stale):  # as Windows does for a file that is still mapped
+        raise PermissionError(stale)
+
+    monkeypatch.setattr(os, "remove", refuse)
+    save_shard(path, EmbeddingTable().merge({"a": ("ha", vector(2))}), None)
+    loaded, _ = load_shard(path)
+    np.testing.assert_array_equal(loaded.matrix, vector(2))
@@ -0,0 +1,93 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+import benchmark
+from catalog import prepare_product
+from main import CategoriesSubcategories
+from search_index import CatalogIndex, FilterPlan
+
+
+def baseline_filter_dataset(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """filter_dataset as it was before FilterPlan, on the whole DataFrame."""
+    filtered_df = df.copy()
+
+    if filters['product_type']:
+        keywords = filters['product_type'].lower().split()
+        condition = pd.Series([True] * len(filtered_df))
+        for word in keywords:
+            word_condition = (
+                filtered_df['title'].str.contains(word, case=False, na=False) |
+                filtered_df['description'].str.contains(word, case=False, na=False)
+            )
+            if 'category' in filtered_df.columns:
+                word_condition |= filtered_df['category'].str.contains(word, case=False, na=False)
+            condition &= word_condition
+        filtered_df = filtered_df[condition]
+
+    if filters['price_max']:
+        filtered_df = filtered_df[filtered_df['price'] <= filters['price_max']]
+
+    if filters['price_min']:
+        filtered_df = filtered_df[filtered_df['price'] >= filters['price_min']]
+
+    if filters['brand_preference']:
+        filtered_df = filtered_df[filtered_df['title'].str.contains(filters['brand_preference'], case=False, na=False)]
+
+    if filters['urgency'] and "urgent" in filters['urgency'].lower():
+        filtered_df = filtered_df.sort_values(by="sold", ascending=False).head(20)
+
+    for feature in filters['must_have_features']:
+        condition = filtered_df['description'].str.contains(feature, case=False, na=False)
+        if 'tags' in filtered_df.columns:
+            condition = condition | filtered_df['tags'].str.contains(feature, case=False, na=False)
+        filtered_df = filtered_df[condition]
+
+    for avoid in filters['avoid_features']:
+        condition = ~filtered_df['description'].str.contains(avoid, case=False, na=False)
+        if 'tags' in filtered_df.columns:
+            condition = condition & ~filtered_df['tags'].str.contains(avoid, case=False, na=False)
+        filtered_df = filtered_df[condition]
+
+    return filtered_df.reset_index(drop=True)
+
+
+def relax(filters: dict) -> dict:
+    return {**filters, "price_max": None, "price_min": None, "must_have_features": [],
+            "brand_preference": None, "avoid_features": [], "urgency": None}
+
+
+@pytest.fixture(scope="module")
+def catalog_df():
+    categories = {name: names for group in CategoriesSubcategories for name, names in group.items()}
+    df = pd.DataFrame([prepare_product(product) for product in benchmark.synthetic_catalog(3000, categories)])
+    # The baseline's str.contains never matched list cells, so compare on joined tags
+    df['tags'] = df['tags'].str.join(', ')
+    return df
+
+
+def filter_cases():
+    product_types = [None, "shoes", "Wireless shoes", "Watch", "hovercraft"]
+    prices = [(None, None), (None, 20000), (5000, 60000), (99999, None)]
+    brands = [None, "acme", "Nova"]
+    features = [([], []), (["waterproof"], []), (["smart", "cotton"], ["leather"]), ([], ["kids"])]
+    urgencies = [None, "urgent"]
+    for product_type, (low, high), brand, (must, avoid), urgency in itertools.product(
+            product_types, prices, brands, features, urgencies):
+        yield {"product_type": product_type, "price_min": low, "price_max": high, "brand_preference": brand,
+               "must_have_features": must, "avoid_features": avoid, "urgency": urgency,
+               "use_case": None, "recipient": None}
+
+
+def test_filter_plan_matches_baseline_filter_dataset(catalog_df):
+    index = CatalogIndex(catalog_df)
+    for filters in filter_cases():
+        plan = FilterPlan(index, filters)
+        strict = baseline_filter_dataset(catalog_df, filters)
+        assert set(catalog_df['_id'].iloc[plan.strict()]) == set(strict['_id']), filters
+        relaxed = baseline_filter_dataset(catalog_df, relax(filters))
+        assert set(catalog_df['_id'].iloc[plan.relaxed()]) == set(relaxed['_id']), filters
+        rows, was_relaxed = plan.rows()
+        assert was_relaxed == strict.empty
+        assert set(catalog_df['_id'].iloc[rows]) == set((relaxed if strict.empty else strict)['_id'])
@@ -0,0 +1,66 @@
+import pytest
+
+from inference import PRIORITY_BACKGROUND, MicroBatcher
+
+
+def upper(model, items):
+    if "bad" in items:
+        raise ValueError("bad input")
+    return [item.upper() for item in items]
+
+
+def test_failure_is_limited_to_the_failing_input():
+    batcher = MicroBatcher("test", lambda: None, upper, max_batch_size=8, max_wait_ms=50)
+    futures = batcher.submit(["a", "bad", "b", "c"])
+    assert [future.result(timeout=5) for future in futures[::2]] == ["A", "B"]
+    assert futures[3].result(timeout=5) == "C"
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+
+
+def test_load_failure_fails_the_batch_once():
+    loads = []
+
+    def load():
+        loads.append(1)
+        raise RuntimeError("model unavailable")
+
+    batcher = MicroBatcher("test", load, upper, max_batch_size=8, max_wait_ms=50)
+    futures = batcher.submit(["a", "b", "c", "d"])
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert len(loads) == 1
+
+
+def test_out_of_memory_is_not_bisected():
+    calls = []
+
+    def run(model, items):
+        calls.append(len(items))
+        raise RuntimeError("DefaultCPUAllocator: can't allocate memory")
+
+    batcher = MicroBatcher("test", lambda: None, run, max_batch_size=8, max_wait_ms=50)
+    futures = batcher.submit(["a", "b", "c", "d"])
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert calls == [4]
+
+
+def test_online_inputs_go_ahead_of_background_ones():
+    batches = []
+
+    def record(model, items):
+        batches.append(list(items))
+        return items
+
+    batcher = MicroBatcher("test", lambda: None, record, max_batch_size=2, max_wait_ms=0)
+    batcher._ensure_started = lambda: None  # queue everything before dispatching
+    background = batcher.submit(["b1", "b2", "b3", "b4"], priority=PRIORITY_BACKGROUND)
+    online = batcher.submit(["o1"])
+    del batcher._ensure_started
+    batcher._ensure_started()
+    assert online[0].result(timeout=5) == "o1"
+    assert [future.result(timeout=5) for future in background] == ["b1", "b2", "b3", "b4"]
+    assert batches[0] == ["o1", "b1"]
@@ -0,0 +1,70 @@
+import asyncio
+from collections import Counter
+
+import httpx
+import numpy as np
+
+import benchmark
+import ingest
+from executor import BoundedPool
+from ingest import INGEST_MAX_ATTEMPTS, IngestCheckpoint, image_key
+
+IMAGE = benchmark.synthetic_images(1)[0]
+STATUSES = {"ok": 200, "gone": 404, "flaky": 503}
+
+
+def embed_images(images):
+    return [np.ones(4, dtype=np.float32) for _ in images]
+
+
+def test_checkpoint_retries_transient_failures_then_gives_up(tmp_path):
+    checkpoint = IngestCheckpoint(str(tmp_path / "checkpoint.json"), max_attempts=2)
+    checkpoint.record_failure("flaky")
+    checkpoint.record_failure("gone", permanent=True)
+    assert not checkpoint.skips("flaky") and checkpoint.skips("gone")
+    checkpoint.save()
+
+    checkpoint = IngestCheckpoint.load(checkpoint.path)
+    checkpoint.max_attempts = 2
+    checkpoint.record_failure("flaky")
+    assert checkpoint.skips("flaky") and "flaky" not in checkpoint.failed
+
+
+def test_ingest_gives_up_on_missing_images_and_after_repeated_failures(monkeypatch):
+    requested = Counter()
+
+    def respond(request):
+        name = request.url.path.strip("/").split(".")[0]
+        requested[name] += 1
+        return httpx.Response(STATUSES[name], content=IMAGE if STATUSES[name] == 200 else b"")
+
+    client = httpx.AsyncClient
+    monkeypatch.setattr(ingest.httpx, "AsyncClient",
+                        lambda **kwargs: client(transport=httpx.MockTransport(respond), **kwargs))
+    monkeypatch.setattr(ingest.db, "embeddings", benchmark.FakeCollection(key="product_id"), raising=False)
+    # Its own pool: the app's is shut down by tests that stop the server
+    pool = BoundedPool("model", 1)
+    monkeypatch.setattr(ingest, "model_pool", pool)
+
+    targets = [(name, f"https://images.example.com/{name}.jpg") for name in STATUSES]
+
+    async def run(restart=False):
+        return await ingest.ingest_image_embeddings(targets, embed_images, concurrency=2, batch_size=1,
+                                                    restart=restart)
+
+    assert set(asyncio.run(run(restart=True))) == {"ok"}
+    checkpoint = IngestCheckpoint.load()
+    assert image_key(*targets[1]) in checkpoint.given_up
+    assert checkpoint.failed == {image_key(*targets[2]): 1}
+
+    # Later runs skip the 404 and retry the 503 until it runs out of attempts
+    targets = targets[1:]
+    for _ in range(INGEST_MAX_ATTEMPTS + 1):
+        assert asyncio.run(run()) == {}
+    assert requested == {"ok": 1, "gone": 1, "flaky": INGEST_MAX_ATTEMPTS}
+    assert image_key(*targets[1]) in IngestCheckpoint.load().given_up
+
+    # A new image URL is a new key, so it is tried again
+    targets = [("flaky", "https://images.example.com/ok.jpg")]
+    assert set(asyncio.run(run())) == {"flaky"}
+    pool.shutdown()
@@ -0,0 +1,14 @@
+import numpy as np
+
+from keyword_cache import KeywordCache
+
+
+def test_near_hits_follow_inserts_and_evictions():
+    cache = KeywordCache(max_size=2, similarity_threshold=0.9)
+    vectors = np.eye(3)
+    for i, vector in enumerate(vectors):
+        cache.put(f"query {i}", i, vector)
+    # "query 0" was evicted; its slot is reused rather than matched
+    assert cache.get("other", vectors[0]) is None
+    assert cache.get("other", vectors[1]) == 1
+    assert cache.get("other", vectors[2]) == 2
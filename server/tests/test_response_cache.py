@@ -0,0 +1,49 @@
+import asyncio
+
+import pandas as pd
+
+from catalog import CatalogStore, catalog_fingerprint
+from response_cache import ResponseCache
+from search_index import CatalogIndex
+
+FILTERS = {"product_type": "shoes", "price_max": 2000, "must_have_features": []}
+
+
+def products(price: int):
+    return pd.DataFrame([{"_id": "a", "title": "Acme shoes", "price": price, "sentiment_score": None},
+                         {"_id": "b", "title": "Nova shoes", "price": 1500, "sentiment_score": None}])
+
+
+def test_catalog_changes_invalidate_cached_responses():
+    async def scenario():
+        store, cache = CatalogStore(), ResponseCache(max_bytes=2 ** 20, redis_url="")
+        store.add_listener(cache.on_catalog_change)
+        df = products(999)
+        snapshot = await store.adopt(df, CatalogIndex(df), catalog_fingerprint(df))
+        key = cache.key("simple-search", FILTERS, "cheap shoes", None, snapshot.fingerprint)
+        await cache.put(key, b"cached")
+        assert await cache.get(key) == b"cached"
+
+        # Annotations such as sentiment scores change the responses too
+        annotated = await store.annotate({"a": {"sentiment_score": 80.0}})
+        await store.wait_for_listeners()
+        assert annotated.fingerprint != snapshot.fingerprint
+        assert await cache.get(key) is None
+        assert cache.key("simple-search", FILTERS, "cheap shoes", None, annotated.fingerprint) != key
+
+        # So does a product change: the old key is unreachable and the entry freed
+        await cache.put(key, b"cached")
+        changed = products(1299)
+        reloaded = await store.adopt(changed, CatalogIndex(changed), catalog_fingerprint(changed))
+        await store.wait_for_listeners()
+        assert cache.stats()["entries"] == 0
+        assert cache.key("simple-search", FILTERS, "cheap shoes", None, reloaded.fingerprint) != key
+
+    asyncio.run(scenario())
+
+
+def test_fingerprint_is_shared_by_workers_with_the_same_catalog():
+    # Workers sharing a Redis cache must agree on keys whatever order they read products in
+    df = products(999)
+    assert catalog_fingerprint(df) == catalog_fingerprint(df.iloc[::-1].reset_index(drop=True))
+    assert catalog_fingerprint(df) != catalog_fingerprint(products(1299))
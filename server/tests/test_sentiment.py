@@ -0,0 +1,20 @@
+from sentiment import ReviewSentimentCache, review_key, score_review_lists
+
+
+def all_positive(texts, **kwargs):
+    return [{"label": "POSITIVE", "score": 0.9} for _ in texts]
+
+
+def test_scores_survive_cache_eviction():
+    # More new reviews than the cache holds: storing them evicts each other
+    scores, fresh = score_review_lists([["a", "b", "c", "d"]], all_positive, ReviewSentimentCache(max_size=2))
+    assert scores == [100]
+    assert len(fresh) == 4
+
+
+def test_cached_labels_are_not_reclassified():
+    cache = ReviewSentimentCache(max_size=2)
+    cache.put(review_key("a"), False)
+    scores, fresh = score_review_lists([["a", "b", "c"]], all_positive, cache)
+    assert scores == [round(2 / 3 * 100, 2)]
+    assert review_key("a") not in fresh
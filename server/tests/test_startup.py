@@ -0,0 +1,29 @@
+"""Smoke test: the startup hook schedules catalog loading and model warm-up."""
+import asyncio
+
+import main
+
+
+def test_startup_schedules_loading(monkeypatch):
+    calls = []
+
+    async def load_data():
+        calls.append("load_data")
+
+    async def warm_up():
+        calls.append("warm_up")
+
+    async def connect():
+        return None
+
+    monkeypatch.setattr(main, "load_data", load_data)
+    monkeypatch.setattr(main, "warm_up", warm_up)
+    monkeypatch.setattr(main, "MODEL_WARMUP", True)
+    monkeypatch.setattr(main.db, "connect", connect)
+
+    async def start():
+        await main.startup_event()
+        await main.warmup_task
+
+    asyncio.run(start())
+    assert sorted(calls) == ["load_data", "warm_up"]
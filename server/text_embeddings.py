@@ -0,0 +1,183 @@
+import os
+import asyncio
+import hashlib
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from executor import io_pool
+from vector_index import (CACHE_DIR, TEXT_INDEX_KIND, TEXT_INDEX_PATH, BruteForceIndex,
+                          load_or_build_index, normalize_rows)
+
+TEXT_EMBEDDING_PATH = os.getenv("TEXT_EMBEDDING_PATH", os.path.join(CACHE_DIR, "text_embeddings.npz"))
+# Documents per embed_documents() call while (re)building the store
+TEXT_EMBEDDING_BATCH_SIZE = int(os.getenv("TEXT_EMBEDDING_BATCH_SIZE", "256"))
+# Below this many filtered candidates an exact scan beats an ANN lookup
+ANN_MIN_CANDIDATES = int(os.getenv("ANN_MIN_CANDIDATES", "5000"))
+# ANN results fetched per requested result, to survive the filter intersection
+ANN_OVERSAMPLE = int(os.getenv("ANN_OVERSAMPLE", "10"))
+
+
+def _tags_text(tags) -> str:
+    return ' '.join(tags) if isinstance(tags, list) else str(tags)
+
+
+def build_search_text(df: pd.DataFrame) -> pd.Series:
+    """The text each product is embedded from: title, description and tags."""
+    search_text_parts = [df['title'].fillna(''), df['description'].fillna('')]
+    if 'tags' in df.columns:
+        search_text_parts.append(df['tags'].apply(_tags_text))
+    return pd.concat(search_text_parts, axis=1).apply(lambda row: ' '.join(row.dropna().astype(str)), axis=1)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TextEmbeddingStore:
+    """Precomputed, L2-normalized document embeddings keyed by product `_id`.
+
+    Each row also records a hash of the text it was embedded from, so a
+    catalog refresh only re-embeds products whose title, description or
+    tags actually changed. The store is persisted to `TEXT_EMBEDDING_PATH`,
+    and an ANN index of kind `TEXT_INDEX_KIND` is kept over it.
+    """
+
+    def __init__(self, path: str = TEXT_EMBEDDING_PATH):
+        self.path = path
+        # (ids, hashes, matrix) is swapped as one tuple so readers never see
+        # the ids of one build paired with the matrix of another
+        self._state = (pd.Index([], dtype=object), np.array([], dtype=object), np.zeros((0, 0), dtype=np.float32))
+        self.index = BruteForceIndex.empty()
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path, allow_pickle=True) as data:
+            self._state = (
+                pd.Index(data["ids"], dtype=object),
+                data["hashes"],
+                np.ascontiguousarray(data["matrix"], dtype=np.float32),
+            )
+        return True
+
+    def save(self) -> None:
+        ids, hashes, matrix = self._state
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, ids=np.asarray(ids, dtype=object), hashes=hashes, matrix=matrix)
+        os.replace(tmp_path, self.path)
+
+    def export(self):
+        """State and index, for workers that attach instead of embedding themselves."""
+        return self._state, self.index
+
+    def adopt(self, exported) -> None:
+        self._state, self.index = exported
+
+    def update(self, df: pd.DataFrame, embed_documents: Callable[[List[str]], List[List[float]]]) -> int:
+        """Bring the store in line with `df`, embedding only new or changed rows.
+
+        Products no longer in `df` are dropped. Returns the number of
+        documents that had to be embedded.
+        """
+        texts = build_search_text(df)
+        ids = pd.Index(df['_id'].astype(str), dtype=object)
+        hashes = np.array([content_hash(t) for t in texts], dtype=object)
+
+        old_ids, old_hashes, old_matrix = self._state
+        positions = old_ids.get_indexer(ids)
+        reusable = positions >= 0
+        reusable[reusable] = old_hashes[positions[reusable]] == hashes[reusable]
+        stale = np.flatnonzero(~reusable)
+
+        dim = old_matrix.shape[1] if len(old_matrix) else 0
+        fresh = []
+        stale_texts = texts.iloc[stale].tolist()
+        for start in range(0, len(stale_texts), TEXT_EMBEDDING_BATCH_SIZE):
+            fresh.extend(embed_documents(stale_texts[start:start + TEXT_EMBEDDING_BATCH_SIZE]))
+        if fresh:
+            fresh = normalize_rows(np.asarray(fresh))
+            dim = fresh.shape[1]
+
+        matrix = np.zeros((len(ids), dim), dtype=np.float32)
+        if reusable.any():
+            matrix[reusable] = old_matrix[positions[reusable]]
+        if len(stale):
+            matrix[stale] = fresh
+
+        self._state = (ids, hashes, matrix)
+        return len(stale)
+
+    async def sync(self, df: pd.DataFrame, embed_documents) -> int:
+        """Background refresh used when a new catalog snapshot is published."""
+        async with self._lock:
+            previous_size = len(self)
+            # Mostly waiting on the remote embedding endpoint
+            embedded = await io_pool.run(self.update, df, embed_documents)
+            changed = embedded or len(self) != previous_size
+            if changed:
+                await asyncio.to_thread(self.save)
+            if TEXT_INDEX_KIND != "brute" and (changed or len(self.index) == 0):
+                self.index = await asyncio.to_thread(self.build_index)
+            return embedded
+
+    def build_index(self):
+        ids, _, matrix = self._state
+        return load_or_build_index(TEXT_INDEX_KIND, TEXT_INDEX_PATH, matrix, np.asarray(ids, dtype=object))
+
+    def approximate_top_k(self, ids, query_embedding, top_k: int):
+        """ANN shortcut for large candidate sets.
+
+        Looks up the nearest products catalog-wide and keeps those in `ids`.
+        Returns `(positions into ids, scores)`, or None when the candidate set
+        is small enough for an exact scan or too few ANN hits survive.
+        """
+        if TEXT_INDEX_KIND == "brute" or len(ids) < ANN_MIN_CANDIDATES or len(self.index) == 0:
+            return None
+        hit_ids, hit_scores = self.index.search(query_embedding, top_k * ANN_OVERSAMPLE)
+        hits = pd.Series(hit_scores, index=pd.Index(hit_ids, dtype=object))
+        positions = np.flatnonzero(pd.Index(ids, dtype=object).isin(hits.index))
+        if len(positions) < top_k:
+            return None
+        return positions, hits.reindex(pd.Index(ids, dtype=object)[positions]).to_numpy()
+
+    def score(self, ids, query_embedding):
+        """Cosine similarity of the query against the stored rows for `ids`.
+
+        Returns `(scores, missing)`; `missing` marks ids with no stored
+        embedding, whose score is left at 0 for the caller to fill in.
+        """
+        scores, missing = self.score_many(ids, np.asarray(query_embedding).reshape(1, -1))
+        return scores[0], missing
+
+    def score_many(self, ids, query_embeddings):
+        """`score` for several queries at once, as one matrix-matrix product.
+
+        Returns `(scores, missing)` with `scores` of shape `(len(queries), len(ids))`.
+        """
+        store_ids, _, matrix = self._state
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1))
+        rows = store_ids.get_indexer(pd.Index(ids, dtype=object))
+        missing = rows < 0
+        scores = np.zeros((len(queries), len(rows)), dtype=np.float32)
+        if matrix.shape[1] == queries.shape[1] and not missing.all():
+            found = rows[~missing]
+            if 2 * len(found) >= len(matrix):
+                # Scoring every stored row and keeping the candidates' columns
+                # reads the matrix once instead of copying a candidates x dim block
+                scores[:, ~missing] = (queries @ matrix.T)[:, found]
+            else:
+                scores[:, ~missing] = queries @ matrix[found].T
+        else:
+            missing[:] = True
+        return scores, missing
+
+
+# Create a global instance
+text_store = TextEmbeddingStore()
@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import logging
+import hashlib
+import argparse
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+IMAGE_INDEX_PATH = os.getenv("IMAGE_INDEX_PATH", os.path.join(CACHE_DIR, "image_index.npz"))
+TEXT_INDEX_PATH = os.getenv("TEXT_INDEX_PATH", os.path.join(CACHE_DIR, "text_index.npz"))
+
+# Which index backs each search path: "brute", "hnsw" or "ivf"
+IMAGE_INDEX_KIND = os.getenv("IMAGE_INDEX_KIND", "brute")
+TEXT_INDEX_KIND = os.getenv("TEXT_INDEX_KIND", "brute")
+
+# Recall/latency knobs. Higher values trade latency for recall.
+HNSW_M = int(os.getenv("ANN_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("ANN_IVF_NLIST", "0"))  # 0 picks ~4*sqrt(N)
+IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", "8"))
+IVF_TRAIN_ITERATIONS = int(os.getenv("ANN_IVF_TRAIN_ITERATIONS", "20"))
+# "int8" keeps brute-force matrices as int8 codes plus a per-row scale (~4x less memory)
+IMAGE_INDEX_QUANTIZATION = os.getenv("IMAGE_INDEX_QUANTIZATION", "none")
+# Rows dequantized per step when scoring an int8 matrix, bounding scratch memory
+QUANTIZED_SCORE_CHUNK = 16384
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: `matrix ~= codes * scales[:, None]`."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Positions of the `top_k` largest scores, best first."""
+    if top_k < len(scores):
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+def fingerprint(matrix: np.ndarray, ids: np.ndarray) -> str:
+    """Identifies the vectors an index was built from, so a saved index
+    is only reused when its inputs are unchanged."""
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+    digest.update(json.dumps([str(i) for i in ids]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class VectorIndex:
+    """Cosine top-k search over a set of vectors, each tagged with an id.
+
+    Subclasses implement `_build`, `search` and their own persistence;
+    everything works on L2-normalized float32 vectors so inner product
+    equals cosine similarity.
+    """
+    kind = "abstract"
+    # Only the brute-force index quantizes; the others always store float32
+    quantization = "none"
+
+    def __init__(self, ids: np.ndarray, dim: int, source_fingerprint: str = ""):
+        self.ids = np.asarray(ids)
+        self.dim = dim
+        self.fingerprint = source_fingerprint
+        self._id_order: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, ids: Sequence, **params) -> "VectorIndex":
+        ids = np.asarray(ids)
+        if len(matrix) != len(ids):
+            raise ValueError(f"Got {len(matrix)} vectors but {len(ids)} ids")
+        matrix = normalize_rows(matrix) if len(matrix) else np.zeros((0, 0), dtype=np.float32)
+        return cls._build(matrix, ids, fingerprint(matrix, ids), **params)
+
+    @classmethod
+    def _build(cls, matrix: np.ndarray, ids: np.ndarray, source_fingerprint: str, **params) -> "VectorIndex":
+        raise NotImplementedError
+
+    @classmethod
+    def empty(cls) -> "VectorIndex":
+        return cls.build(np.zeros((0, 0), dtype=np.float32), np.array([], dtype=np.int64))
+
+    def search(self, query: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return `(ids, scores)` of the `top_k` most similar items, best first."""
+        raise NotImplementedError
+
+    def _empty_result(self):
+        return self.ids[:0], np.zeros(0, dtype=np.float32)
+
+    def _vectors(self, positions: np.ndarray) -> np.ndarray:
+        """Normalized stored vectors at `positions`, for exact rescoring."""
+        raise NotImplementedError
+
+    def positions_of(self, ids: Sequence) -> np.ndarray:
+        """Position of each id in this index, -1 where it is not indexed."""
+        ids = np.asarray(ids)
+        if len(self) == 0 or len(ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind="stable")
+        sorted_ids = self.ids[self._id_order]
+        at = np.clip(np.searchsorted(sorted_ids, ids), 0, len(sorted_ids) - 1)
+        return np.where(sorted_ids[at] == ids, self._id_order[at], -1)
+
+    def score_ids(self, query: np.ndarray, ids: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact cosine similarity of `query` to each of `ids`, plus which of them are indexed.
+
+        Ids that are not indexed score 0. Unlike `search`, this is exact for
+        every index kind, so it suits scoring an already-filtered candidate set.
+        """
+        positions = self.positions_of(ids)
+        found = positions >= 0
+        scores = np.zeros(len(positions), dtype=np.float32)
+        if found.any():
+            scores[found] = self._vectors(positions[found]) @ self._normalize_query(query)
+        return scores, found
+
+    def _normalize_query(self, query: np.ndarray) -> np.ndarray:
+        return normalize_rows(np.asarray(query).reshape(1, -1))[0]
+
+    def _meta(self) -> dict:
+        return {"kind": self.kind, "dim": self.dim, "fingerprint": self.fingerprint}
+
+    def save(self, path: str) -> None:
+        raise NotImplementedError
+
+
+class BruteForceIndex(VectorIndex):
+    """Exact scan: one matrix-vector product and `np.argpartition`.
+
+    With `quantization="int8"` the matrix is held as int8 codes and a
+    per-row scale, and scored in chunks to keep scratch memory bounded.
+    """
+    kind = "brute"
+
+    def __init__(self, matrix: Optional[np.ndarray], ids: np.ndarray, source_fingerprint: str = "",
+                 quantization: str = "none", codes: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None):
+        if quantization == "int8" and codes is None and matrix is not None and len(matrix):
+            codes, scales = quantize_int8(matrix)
+        if codes is not None:
+            matrix = None
+        dim = codes.shape[1] if codes is not None else (matrix.shape[1] if matrix.ndim == 2 else 0)
+        super().__init__(ids, dim, source_fingerprint)
+        self.matrix = matrix
+        self.codes = codes
+        self.scales = scales
+        self.quantization = "int8" if codes is not None else "none"
+
+    @classmethod
+    def _build(cls, matrix, ids, source_fingerprint, quantization="none", **params):
+        return cls(matrix, ids, source_fingerprint, quantization=quantization)
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        if self.codes is None:
+            return self.matrix @ query
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), QUANTIZED_SCORE_CHUNK):
+            chunk = slice(start, start + QUANTIZED_SCORE_CHUNK)
+            scores[chunk] = (self.codes[chunk].astype(np.float32) @ query) * self.scales[chunk]
+        return scores
+
+    def _vectors(self, positions):
+        if self.codes is None:
+            return self.matrix[positions]
+        return self.codes[positions].astype(np.float32) * self.scales[positions, None]
+
+    def search(self, query, top_k):
+        if len(self) == 0 or top_k <= 0:
+            return self._empty_result()
+        scores = self._scores(self._normalize_query(query))
+        top = _top_k(scores, top_k)
+        return self.ids[top], scores[top]
+
+    def save(self, path):
+        meta = dict(self._meta(), quantization=self.quantization)
+        if self.codes is not None:
+            _savez(path, meta, ids=self.ids, codes=self.codes, scales=self.scales)
+        else:
+            _savez(path, meta, ids=self.ids, matrix=self.matrix)
+
+    @classmethod
+    def _load(cls, meta, data, path):
+        if meta.get("quantization") == "int8":
+            return cls(None, data["ids"], meta["fingerprint"], codes=data["codes"], scales=data["scales"])
+        return cls(data["matrix"], data["ids"], meta["fingerprint"])
+
+
+class IVFFlatIndex(VectorIndex):
+    """Inverted-file index: vectors are bucketed by their nearest k-means
+    centroid and a query only scans the `nprobe` closest buckets."""
+    kind = "ivf"
+
+    def __init__(self, centroids, matrix, ids, offsets, nprobe, source_fingerprint=""):
+        super().__init__(ids, matrix.shape[1] if matrix.ndim == 2 else 0, source_fingerprint)
+        self.centroids = centroids
+        # Rows are stored grouped by list: list `c` is matrix[offsets[c]:offsets[c + 1]]
+        self.matrix = matrix
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def _build(cls, matrix, ids, source_fingerprint, nlist=IVF_NLIST, nprobe=IVF_NPROBE,
+               iterations=IVF_TRAIN_ITERATIONS, seed=0, **params):
+        n = len(matrix)
+        if n == 0:
+            return cls(np.zeros((0, 0), dtype=np.float32), matrix, ids, np.zeros(1, dtype=np.int64), nprobe, source_fingerprint)
+        nlist = nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        sample = matrix[rng.choice(n, size=min(n, 256 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            # Empty lists keep their previous centroid
+            filled = np.bincount(assignment, minlength=nlist) > 0
+            centroids[filled] = normalize_rows(sums[filled])
+
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        return cls(centroids, np.ascontiguousarray(matrix[order]), ids[order], offsets, nprobe, source_fingerprint)
+
+    def _vectors(self, positions):
+        return self.matrix[positions]
+
+    def search(self, query, top_k):
+        if len(self) == 0 or top_k <= 0:
+            return self._empty_result()
+        query = self._normalize_query(query)
+        probe = _top_k(self.centroids @ query, min(self.nprobe, len(self.centroids)))
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        if len(rows) == 0:
+            return self._empty_result()
+        scores = self.matrix[rows] @ query
+        top = _top_k(scores, top_k)
+        return self.ids[rows[top]], scores[top]
+
+    def save(self, path):
+        meta = dict(self._meta(), nprobe=self.nprobe)
+        _savez(path, meta, ids=self.ids, matrix=self.matrix, centroids=self.centroids, offsets=self.offsets)
+
+    @classmethod
+    def _load(cls, meta, data, path):
+        return cls(data["centroids"], data["matrix"], data["ids"], data["offsets"], meta["nprobe"], meta["fingerprint"])
+
+
+class HNSWIndex(VectorIndex):
+    """Hierarchical navigable small-world graph, backed by `hnswlib`."""
+    kind = "hnsw"
+
+    def __init__(self, graph, ids, dim, ef_search, source_fingerprint=""):
+        super().__init__(ids, dim, source_fingerprint)
+        self.graph = graph
+        self.ef_search = ef_search
+        if graph is not None:
+            graph.set_ef(ef_search)
+
+    @staticmethod
+    def _hnswlib():
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("HNSW indexes need the 'hnswlib' package: pip install hnswlib") from e
+        return hnswlib
+
+    @classmethod
+    def _build(cls, matrix, ids, source_fingerprint, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+               ef_search=HNSW_EF_SEARCH, **params):
+        if len(matrix) == 0:
+            return cls(None, ids, 0, ef_search, source_fingerprint)
+        hnswlib = cls._hnswlib()
+        graph = hnswlib.Index(space="ip", dim=matrix.shape[1])
+        graph.init_index(max_elements=len(matrix), ef_construction=ef_construction, M=m)
+        graph.add_items(matrix, np.arange(len(matrix)))
+        return cls(graph, ids, matrix.shape[1], ef_search, source_fingerprint)
+
+    def _vectors(self, positions):
+        # Items were added with their position as the hnswlib label
+        return np.asarray(self.graph.get_items(positions), dtype=np.float32)
+
+    def search(self, query, top_k):
+        if len(self) == 0 or top_k <= 0:
+            return self._empty_result()
+        top_k = min(top_k, len(self))
+        self.graph.set_ef(max(self.ef_search, top_k))
+        labels, distances = self.graph.knn_query(self._normalize_query(query), k=top_k)
+        # hnswlib's "ip" distance is 1 - inner product
+        return self.ids[labels[0]], (1.0 - distances[0]).astype(np.float32)
+
+    def save(self, path):
+        meta = dict(self._meta(), ef_search=self.ef_search)
+        if self.graph is not None:
+            self.graph.save_index(path + ".graph")
+        _savez(path, meta, ids=self.ids)
+
+    @classmethod
+    def _load(cls, meta, data, path):
+        ids = data["ids"]
+        if len(ids) == 0:
+            return cls(None, ids, 0, meta["ef_search"], meta["fingerprint"])
+        graph = cls._hnswlib().Index(space="ip", dim=meta["dim"])
+        graph.load_index(path + ".graph", max_elements=len(ids))
+        return cls(graph, ids, meta["dim"], meta["ef_search"], meta["fingerprint"])
+
+
+INDEX_KINDS = {cls.kind: cls for cls in (BruteForceIndex, IVFFlatIndex, HNSWIndex)}
+
+
+def build_index(kind: str, matrix: np.ndarray, ids: Sequence, **params) -> VectorIndex:
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}', expected one of {sorted(INDEX_KINDS)}")
+    return INDEX_KINDS[kind].build(matrix, ids, **params)
+
+
+def _savez(path: str, meta: dict, **arrays) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, meta=json.dumps(meta), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_index(path: str) -> VectorIndex:
+    with np.load(path, allow_pickle=True) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = {name: data[name] for name in data.files if name != "meta"}
+    return INDEX_KINDS[meta["kind"]]._load(meta, arrays, path)
+
+
+def load_or_build_index(kind: str, path: str, matrix: np.ndarray, ids: Sequence, **params) -> VectorIndex:
+    """Reuse the index saved at `path` if it was built from these exact vectors,
+    otherwise build a fresh one and save it."""
+    ids = np.asarray(ids)
+    normalized = normalize_rows(matrix) if len(matrix) else matrix
+    # Kinds that ignore the quantization parameter always report "none"
+    quantization = params.get("quantization", "none") if kind == BruteForceIndex.kind else "none"
+    if os.path.exists(path):
+        try:
+            index = load_index(path)
+            if (index.kind == kind and index.fingerprint == fingerprint(normalized, ids)
+                    and index.quantization == quantization):
+                return index
+        except Exception as e:
+            logger.warning("Could not load saved index %s: %s", path, e)
+    index = build_index(kind, matrix, ids, **params)
+    try:
+        index.save(path)
+    except Exception as e:
+        logger.warning("Could not save index %s: %s", path, e)
+    return index
+
+
+def recall_at_k(index: VectorIndex, exact: VectorIndex, queries: np.ndarray, k: int) -> float:
+    """Fraction of the exact top-k ids that `index` also returns, averaged over queries."""
+    hits = 0
+    for query in queries:
+        expected, _ = exact.search(query, k)
+        found, _ = index.search(query, k)
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+    return hits / (len(queries) * k)
+
+
+def benchmark(matrix: np.ndarray, queries: np.ndarray, k: int, kinds: Sequence[str], **params) -> list:
+    """Build each kind of index over `matrix` and report build time,
+    mean query latency and recall@k against the exact scan."""
+    ids = np.arange(len(matrix))
+    exact = BruteForceIndex.build(matrix, ids)
+    results = []
+    for kind in kinds:
+        started = time.perf_counter()
+        index = build_index(kind, matrix, ids, **params)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for query in queries:
+            index.search(query, k)
+        query_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        results.append({
+            "kind": kind,
+            "build_seconds": round(build_seconds, 3),
+            "query_ms": round(query_ms, 3),
+            f"recall@{k}": round(recall_at_k(index, exact, queries, k), 4),
+        })
+    return results
+
+
+def _synthetic_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Clustered random vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return (centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Recall@k / latency benchmark of the ANN indexes against the exact scan")
+    arg_parser.add_argument("--from-index", help="Benchmark over the vectors of a saved index")
+    arg_parser.add_argument("--n", type=int, default=50000)
+    arg_parser.add_argument("--dim", type=int, default=512)
+    arg_parser.add_argument("--queries", type=int, default=200)
+    arg_parser.add_argument("--k", type=int, default=10)
+    arg_parser.add_argument("--kinds", nargs="+", default=["brute", "ivf", "hnsw"])
+    arg_parser.add_argument("--nlist", type=int, default=IVF_NLIST)
+    arg_parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    arg_parser.add_argument("--ef-search", type=int, default=HNSW_EF_SEARCH)
+    args = arg_parser.parse_args()
+
+    if args.from_index:
+        saved = load_index(args.from_index)
+        # Through _vectors, which also dequantizes int8 and reads HNSW graphs that have no matrix
+        vectors = saved._vectors(np.arange(len(saved)))
+    else:
+        vectors = _synthetic_vectors(args.n, args.dim, clusters=max(1, args.n // 100), seed=0)
+    rng = np.random.default_rng(1)
+    query_vectors = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    query_vectors = query_vectors + 0.1 * rng.normal(size=query_vectors.shape).astype(np.float32)
+
+    for row in benchmark(vectors, query_vectors, args.k, args.kinds,
+                         nlist=args.nlist, nprobe=args.nprobe, ef_search=args.ef_search):
+        print(json.dumps(row))